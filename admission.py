@@ -0,0 +1,45 @@
+"""Per-client rate limits shared by the app's routes and blueprints.
+
+Every client gets a token bucket per endpoint (requests per minute, plus a
+burst allowance); clients are told by 429 answers when to come back.
+"""
+import math
+import os
+
+from flask import request, jsonify
+
+from ratelimit import RateLimiter
+
+RATE_LIMITED_MESSAGE = 'Too many requests. Please try again later.'
+
+info_limiter = RateLimiter(
+    rate=float(os.environ.get('YTD_INFO_RATE', 60)) / 60,
+    burst=int(os.environ.get('YTD_INFO_BURST', 10)),
+)
+download_limiter = RateLimiter(
+    rate=float(os.environ.get('YTD_DOWNLOAD_RATE', 30)) / 60,
+    burst=int(os.environ.get('YTD_DOWNLOAD_BURST', 10)),
+)
+
+
+def client_id():
+    return request.remote_addr or 'unknown'
+
+def rate_limited(limiter):
+    """Returns a 429 response if the calling client is over `limiter`'s rate, else None."""
+    refusal = rate_limit_refusal(limiter, client_id())
+    if refusal:
+        body, status, headers = refusal
+        return jsonify(body), status, headers
+    return None
+
+def rate_limit_refusal(limiter, client):
+    """Returns (body, status, headers) refusing `client` if it is over `limiter`'s rate, else None."""
+    wait = limiter.acquire(client)
+    if wait:
+        return too_many_requests(wait)
+    return None
+
+def too_many_requests(wait):
+    """(body, status, headers) telling a client to come back in `wait` seconds."""
+    return {'error': RATE_LIMITED_MESSAGE}, 429, {'Retry-After': str(math.ceil(wait))}
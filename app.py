@@ -1,61 +1,135 @@
 # app.py
 import os
-import tempfile
 import shutil
 import uuid
 import threading
-import queue
-from flask import Flask, request, jsonify, send_file, render_template, after_this_request
-from yt_dlp import YoutubeDL
+import time
+import copy
+import json
+import math
+import functools
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from flask import Flask, Response, request, jsonify, send_file, render_template
+from workers import WorkerPool, default_worker_count, run_bounded
+from cache import DownloadCache, canonical_key
+from zipstream import ZipStream
+from progress import ProgressTracker
+from events import TaskEvents
+from store import open_task_store
+from transfers import TransferLedger, DeliveryFile
+from reaper import Reaper, BUSY, make_job_dir
+from admission import (info_limiter, download_limiter, client_id, rate_limited, rate_limit_refusal,
+                       too_many_requests, RATE_LIMITED_MESSAGE)
+from governor import is_rate_limited
+from budget import JobBudget, Cancelled
+from profiles import transfer_opts, fragment_share
+import engine
+from engine import (
+    DOWNLOAD_FOLDER, JOB_DIR_PREFIX, YDL_OPTS_BASE, SINGLE_OUTTMPL, ENTRY_OUTTMPL, AUDIO_OUTPUTS,
+    DEFAULT_AUDIO_OUTPUT, JOB_LIMITS, INFO_WORKERS, outbound, ydl_pool, info_cache,
+    extraction_cache, metrics, stage_timings, failure_message, get_simple_error, record_stage,
+    output_opts, info_cache_key, extract_info_payload, extract_and_download, playlist_entries,
+    live_folders,
+)
+from downloads import downloads_bp
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 app = Flask(__name__)
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DOWNLOAD_FOLDER = os.path.join(os.path.expanduser('~'), 'Downloads', 'YouTube Downloader')
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
-
-# In-memory task storage and queue
-tasks = {}
-task_queue = queue.Queue()
-
-# Default options shared across operations
-YDL_OPTS_BASE = {
-    'quiet': True,
-    'no_warnings': True,
-}
-COOKIES_FILE = os.path.join(BASE_DIR, 'cookies.txt')
-if os.path.exists(COOKIES_FILE):
-    YDL_OPTS_BASE['cookiefile'] = COOKIES_FILE
-
-def get_simple_error(error_str):
-    """Parses a yt-dlp error string and returns a simplified version."""
-    if 'Private video' in error_str:
-        return 'This is a private video.'
-    if 'Video unavailable' in error_str:
-        return 'This video is unavailable.'
-    if 'removed for violating' in error_str:
-        return 'This video was removed.'
-    if 'not available in your country' in error_str:
-        return 'This video is not available in your country.'
-    if 'age-restricted' in error_str:
-        return 'This video is age-restricted.'
-    if 'Login required' in error_str:
-        return 'This video requires login.'
-    if 'payment to watch' in error_str:
-        return 'This is a paid video.'
-    if 'Premiere' in error_str:
-        return 'This video is a premiere.'
-    if 'Live event' in error_str:
-        return 'This is a live event.'
-    if 'HTTP Error 404' in error_str:
-        return 'Video not found.'
-    if 'HTTP Error 403' in error_str:
-        return 'Access denied to video.'
-    if 'HTTP Error 429' in error_str:
-        return 'Too many requests. Please try again later.'
-    if 'no file produced' in error_str:
-        return 'Download failed.'
-    
-    return 'An error occurred while processing your request.'
+app.register_blueprint(downloads_bp)
+
+# Task storage: in-memory by default, or a SQLite database shared by every
+# server process on the host when YTD_TASK_DB is set
+tasks = open_task_store(os.environ.get('YTD_TASK_DB'))
+
+# Identical in-flight requests share one job: dedupe key -> leader task id
+inflight = {}
+inflight_lock = threading.Lock()
+coalesced_count = 0
+
+# Tasks and archive readers still needing each shared, non-cached result:
+# path -> count, where a path not listed is needed by its own task only
+file_waiters = {}
+
+# Wakes /events streams when their task changes. Under a threaded WSGI server
+# each open stream holds a thread, so their number is capped; clients fall
+# back to polling /status when refused.
+task_events = TaskEvents()
+MAX_EVENT_STREAMS = int(os.environ.get('YTD_MAX_EVENT_STREAMS', 32))
+EVENT_KEEPALIVE = 15
+EVENT_STREAM_START = 'retry: 3000\n\n'
+event_stream_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+# Worker lanes: short single video/audio jobs never wait behind playlists
+SINGLE_WORKERS = int(os.environ.get('YTD_WORKERS', 0)) or default_worker_count()
+PLAYLIST_WORKERS = int(os.environ.get('YTD_PLAYLIST_WORKERS', 0)) or max(1, SINGLE_WORKERS // 4)
+
+# Playlist entries download in parallel: at most PLAYLIST_CONCURRENCY per
+# playlist and ENTRY_WORKERS across all playlists
+PLAYLIST_CONCURRENCY = int(os.environ.get('YTD_PLAYLIST_CONCURRENCY', 4))
+ENTRY_WORKERS = int(os.environ.get('YTD_ENTRY_WORKERS', 0)) or default_worker_count()
+entry_executor = ThreadPoolExecutor(max_workers=ENTRY_WORKERS, thread_name_prefix='playlist-entry')
+
+# HLS/DASH fragments fetched in parallel: each download gets an equal share
+# of FRAGMENT_SLOTS among the downloads running when it starts; the slots
+# never exceed what the outbound request rate can keep busy
+FRAGMENT_SLOTS = int(os.environ.get('YTD_FRAGMENT_SLOTS', 32))
+running_downloads = 0
+running_downloads_lock = threading.Lock()
+
+# ffmpeg merging and transcoding run on their own threads, one per core, so
+# download workers move on to the next download while a file is processed
+POSTPROCESS_WORKERS = int(os.environ.get('YTD_POSTPROCESS_WORKERS', 0)) or os.cpu_count() or 1
+postprocess_executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix='postprocess')
+
+# /info answer times join the engine's metrics, served at /metrics
+info_seconds = metrics.histogram('ytd_info_request_seconds', 'Time to answer /info.', ('cache',))
+
+# Admission control: each lane holds at most MAX_QUEUE waiting tasks, of
+# which at most MAX_QUEUED_PER_CLIENT from one client; per-client request
+# rates are limited in admission.py
+MAX_QUEUE = int(os.environ.get('YTD_MAX_QUEUE', 256))
+MAX_QUEUED_PER_CLIENT = int(os.environ.get('YTD_MAX_QUEUED_PER_CLIENT', 32))
+QUEUE_FULL_RETRY_AFTER = 30
+
+# Tasks that hit HTTP 429 are requeued up to THROTTLE_RETRIES times
+THROTTLE_RETRIES = int(os.environ.get('YTD_THROTTLE_RETRIES', 5))
+# /info answers 429 straight away rather than wait out a backoff longer than this
+INFO_MAX_BACKOFF_WAIT = 10
+
+# /info/batch extracts on a shared pool, at most INFO_BATCH_CONCURRENCY URLs
+# of one batch at a time so a big batch cannot hold up the others
+MAX_INFO_BATCH = int(os.environ.get('YTD_INFO_BATCH_MAX', 100))
+INFO_BATCH_CONCURRENCY = int(os.environ.get('YTD_INFO_BATCH_CONCURRENCY', 4))
+info_executor = ThreadPoolExecutor(max_workers=INFO_WORKERS, thread_name_prefix='info')
+
+# Finished single downloads, shared by every task asking for the same output
+# and, with YTD_TASK_DB, by every server process using the same task database
+download_cache = DownloadCache(
+    os.path.join(DOWNLOAD_FOLDER, '.cache'),
+    max_bytes=int(os.environ.get('YTD_DOWNLOAD_CACHE_BYTES', 5 * 1024 ** 3)),
+    shared=bool(os.environ.get('YTD_TASK_DB')),
+)
+download_cache.load()
+
+# Fetched results stay until every byte has reached a client, possibly over
+# several resumed Range requests, or until nobody has asked for them for
+# FILE_RETENTION seconds. With YTD_X_SENDFILE the front-end server sends the
+# file itself, so only the retention window applies.
+FILE_RETENTION = int(os.environ.get('YTD_FILE_RETENTION', 3600))
+transfers = TransferLedger(FILE_RETENTION)
+app.config['USE_X_SENDFILE'] = bool(os.environ.get('YTD_X_SENDFILE'))
+
+# Background cleanup of job directories in DOWNLOAD_FOLDER: results never
+# fetched, leftovers of crashed jobs and anything over the size budget. The
+# download cache keeps its own budget and is left alone.
+MAX_RESULT_AGE = int(os.environ.get('YTD_MAX_RESULT_AGE', 24 * 3600))
+MAX_FOLDER_BYTES = int(os.environ.get('YTD_MAX_FOLDER_BYTES', 10 * 1024 ** 3))
+REAPER_INTERVAL = int(os.environ.get('YTD_REAPER_INTERVAL', 60))
+
+# Budgets of the jobs running in this process, by task id
+job_budgets = {}
 
 @app.route('/')
 def index():
@@ -63,83 +137,162 @@ def index():
 
 @app.route('/info', methods=['POST'])
 def info():
-    data = request.get_json() or {}
+    answer = info_request(client_id(), request.get_json() or {}, request.args.get('page'))
+    body, status, headers = answer() if callable(answer) else answer
+    return jsonify(body), status, headers
+
+def info_request(client, data, page=None):
+    """Answers an /info request as (body, status, headers), or returns the extraction that will.
+
+    Refusals and cached payloads are answered at once. On a cache miss the
+    returned callable extracts and answers; the async server runs it on
+    `info_executor` (see asgi.py).
+    """
+    refusal = rate_limit_refusal(info_limiter, client)
+    if refusal:
+        return refusal
     url = data.get('url')
     if not url:
-        return jsonify({'error': 'missing url'}), 400
-
+        return {'error': 'missing url'}, 400, {}
     try:
-        ffmpeg_location = os.path.join(BASE_DIR, 'bin')
-        with YoutubeDL({**YDL_OPTS_BASE, 'skip_download': True, 'ffmpeg_location': ffmpeg_location}) as ydl:
-            info = ydl.extract_info(url, download=False)
-    except Exception as e:
-        simple_error = get_simple_error(str(e))
-        return jsonify({'error': simple_error}), 400
-
-    is_playlist = 'entries' in info
-
-    if is_playlist:
-        entries = []
-        for e in list(info.get('entries', []))[:10]:
-            if not e:
-                continue
-            entries.append({
-                'id': e.get('id'),
-                'title': e.get('title'),
-                'duration': e.get('duration'),
-                'thumbnail': e.get('thumbnail'),
-            })
-        return jsonify({
-            'type': 'playlist',
-            'id': info.get('id'),
-            'title': info.get('title'),
-            'uploader': info.get('uploader'),
-            'thumbnail': info.get('thumbnail'),
-            'total_videos': len(info.get('entries', [])),
-            'entries_sample': entries,
-        })
-
-    formats = []
-    for f in info.get('formats', []):
-        formats.append({
-            'format_id': f.get('format_id'),
-            'ext': f.get('ext'),
-            'acodec': f.get('acodec'),
-            'vcodec': f.get('vcodec'),
-            'filesize': f.get('filesize') or f.get('filesize_approx'),
-            'height': f.get('height'),
-            'abr': f.get('abr'),
-        })
+        page = int(page if page is not None else data.get('page', 0))
+    except (TypeError, ValueError):
+        page = -1
+    if page < 0:
+        return {'error': 'invalid page'}, 400, {}
 
-    return jsonify({
-        'type': 'video',
-        'id': info.get('id'),
-        'title': info.get('title'),
-        'uploader': info.get('uploader'),
-        'thumbnail': info.get('thumbnail'),
-        'formats': formats,
-    })
+    started = time.monotonic()
+    key = canonical_key(url)
+    payload = info_cache.get(info_cache_key(key, page))
+    if payload is not None:
+        info_seconds.observe(time.monotonic() - started, 'hit')
+        return payload, 200, {}
+    backoff = outbound.backoff_remaining()
+    if backoff > INFO_MAX_BACKOFF_WAIT:
+        return {'error': get_simple_error('HTTP Error 429')}, 429, {'Retry-After': str(math.ceil(backoff))}
+
+    def extract():
+        try:
+            payload = extract_info_payload(url, key, page)
+        except Exception as e:
+            return {'error': failure_message(e)}, 400, {}
+        info_seconds.observe(time.monotonic() - started, 'miss')
+        return payload, 200, {}
+
+    return extract
+
+@app.route('/info/batch', methods=['POST'])
+def info_batch():
+    data = request.get_json() or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({'error': 'missing urls'}), 400
+    if len(urls) > MAX_INFO_BATCH:
+        return jsonify({'error': f'at most {MAX_INFO_BATCH} urls per batch'}), 400
+    backoff = outbound.backoff_remaining()
+    if backoff > INFO_MAX_BACKOFF_WAIT:
+        return jsonify({'error': get_simple_error('HTTP Error 429')}), 429, {'Retry-After': str(math.ceil(backoff))}
+
+    # URLs naming the same video are extracted once and answered together
+    by_key = {}
+    for index, url in enumerate(urls):
+        by_key.setdefault(canonical_key(url), []).append((index, url))
+    hits = []
+    misses = deque()
+    for key, items in by_key.items():
+        payload = info_cache.get(key)
+        if payload is None:
+            misses.append((key, items))
+        else:
+            hits.append((items, payload))
+
+    # Every video to extract costs an /info token (a batch of cached answers
+    # costs one); videos beyond what the client has left are refused
+    granted, retry_after = info_limiter.take(client_id(), max(1, len(misses)))
+    if not granted:
+        body, status, headers = too_many_requests(retry_after)
+        return jsonify(body), status, headers
+    refused = [misses.pop() for _ in range(len(misses) - granted)]
+    headers = {'Retry-After': str(math.ceil(retry_after))} if refused else {}
+
+    def generate():
+        for items, payload in hits:
+            for index, url in items:
+                yield batch_line(index, url, info=payload)
+        for key, items in refused:
+            for index, url in items:
+                yield batch_line(index, url, error=RATE_LIMITED_MESSAGE)
+
+        running = {}
+        try:
+            while misses or running:
+                while misses and len(running) < INFO_BATCH_CONCURRENCY:
+                    key, items = misses.popleft()
+                    running[info_executor.submit(extract_info_payload, items[0][1], key)] = items
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    items = running.pop(future)
+                    error = future.exception()
+                    for index, url in items:
+                        if error is None:
+                            yield batch_line(index, url, info=future.result())
+                        else:
+                            yield batch_line(index, url, error=failure_message(error))
+        finally:
+            # The client went away: drop whatever has not started yet
+            for future in running:
+                future.cancel()
+
+    return Response(generate(), mimetype='application/x-ndjson', headers=headers)
+
+def batch_line(index, url, **result):
+    return json.dumps({'index': index, 'url': url, **result}) + '\n'
 
 @app.route('/download', methods=['POST'])
 def download():
+    limited = rate_limited(download_limiter)
+    if limited:
+        return limited
     data = request.get_json() or {}
     url = data.get('url')
     if not url:
         return jsonify({'error': 'missing url'}), 400
+    mode = data.get('mode', 'video')
+    if mode not in JOB_LIMITS:
+        return jsonify({'error': f"mode must be one of {', '.join(JOB_LIMITS)}"}), 400
+    audio_format = data.get('audio_format') or DEFAULT_AUDIO_OUTPUT
+    if audio_format not in AUDIO_OUTPUTS:
+        return jsonify({'error': f"audio_format must be one of {', '.join(AUDIO_OUTPUTS)}"}), 400
 
     task_id = str(uuid.uuid4())
     task = {
         'task_id': task_id,
         'url': url,
-        'mode': data.get('mode', 'video'),
+        'mode': mode,
         'format_id': data.get('format_id'),
         'submode': data.get('submode', 'video'),
+        'audio_format': audio_format,
         'status': 'pending',
         'result': None,
         'error': None,
+        'client': client_id(),
+        'enqueued_at': time.time(),
     }
+    if task['mode'] != 'playlist':
+        ydl_opts = single_ydl_opts(task['mode'], task['format_id'], audio_format)
+        if complete_from_cache(task, single_cache_key(url, ydl_opts)):
+            tasks[task_id] = task
+            return jsonify({'task_id': task_id})
+    if attach_to_inflight(task):
+        tasks[task_id] = task
+        return jsonify({'task_id': task_id})
+    task['lane'] = lane_for(task)
+    refused = admission_refused(task)
+    if refused:
+        release_inflight(task)
+        return refused
     tasks[task_id] = task
-    task_queue.put(task_id)
+    worker_pool.submit(task_id, task['lane'])
 
     return jsonify({'task_id': task_id})
 
@@ -148,144 +301,731 @@ def status(task_id):
     task = tasks.get(task_id)
     if not task:
         return jsonify({'error': 'task not found'}), 404
-    return jsonify({
+    return jsonify(status_payload(task))
+
+@app.route('/task/<task_id>', methods=['DELETE'])
+def cancel_task(task_id):
+    """Cancels a waiting or running task, or deletes a finished one and its file."""
+    task = tasks.get(task_id)
+    if not task:
+        return jsonify({'error': 'task not found'}), 404
+    if task['status'] in ('completed', 'failed'):
+        finish_task(task)
+        return jsonify({'status': 'deleted'})
+    if task.get('followers'):
+        return jsonify({'error': 'Other requests are waiting for this download.'}), 409
+
+    task['cancelled'] = True
+    if task['status'] == 'processing':
+        budget = job_budgets.get(task_id)
+        if budget is None:
+            tasks.save(task)
+            return jsonify({'error': 'The task is running in another server process.'}), 409
+        # The job stops at its next progress update or request and cleans up after itself
+        budget.cancel()
+        return jsonify(status_payload(task)), 202
+
+    with inflight_lock:
+        leader = tasks.get(task.get('leader'))
+        if leader and task_id in leader.get('followers', ()):
+            leader['followers'].remove(task_id)
+            tasks.save(leader)
+    task['status'] = 'failed'
+    task['error'] = failure_message(Cancelled())
+    # A worker that takes the task off the queue skips it
+    settle_task(task)
+    return jsonify(status_payload(task))
+
+def status_payload(task):
+    if task['status'] == 'pending' and task.get('leader'):
+        leader = tasks.get(task['leader'])
+        if leader and leader['status'] in ('completed', 'failed'):
+            # The leader may have finished in another server process
+            settle_follower(leader, task)
+        elif leader:
+            # Coalesced tasks report the progress of the job they are waiting on
+            task = leader
+    return {
         'status': task['status'],
-        'error': task['error'],
+        'error': task.get('error'),
+        'progress': task.get('progress'),
+        'timings': task.get('timings'),
+    }
+
+@app.route('/events/<task_id>')
+def events(task_id):
+    task = tasks.get(task_id)
+    if not task:
+        return jsonify({'error': 'task not found'}), 404
+    if not event_stream_slots.acquire(blocking=False):
+        return jsonify({'error': 'too many event streams'}), 503, {'Retry-After': '5'}
+
+    def stream():
+        yield EVENT_STREAM_START
+        last = None
+        while True:
+            frame, last, watch = event_step(task_id, last)
+            yield frame
+            if watch is None:
+                return
+            # Changes made by other server processes are picked up on the timeout
+            task_events.wait(*watch, timeout=EVENT_KEEPALIVE)
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
     })
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+def event_step(task_id, last):
+    """One frame of an /events stream after `last` was sent.
+
+    Returns (frame, payload now sent, watch); `watch` is the (task id,
+    version) to wait on before the next step, or None once the stream ends.
+    """
+    task = tasks.get(task_id)
+    if not task:
+        return 'event: gone\ndata: {}\n\n', last, None
+    # Followers change when their leader does, so listen on the leader
+    watched = task['leader'] if task['status'] == 'pending' and task.get('leader') else task_id
+    version = task_events.version(watched)
+    payload = status_payload(task)
+    frame = f'data: {json.dumps(payload)}\n\n' if payload != last else ': keep-alive\n\n'
+    if task['status'] in ('completed', 'failed'):
+        return frame, payload, None
+    return frame, payload, (watched, version)
 
 @app.route('/file/<task_id>')
 def file(task_id):
     task = tasks.get(task_id)
-    if not task or task['status'] != 'completed':
+    archive = task.get('archive') if task else None
+    # Playlist archives can be streamed while their entries are still downloading
+    live = archive is not None and task['status'] == 'processing' and request.args.get('live')
+    if not task or (task['status'] != 'completed' and not live):
         return jsonify({'error': 'file not available'}), 404
 
     filepath = task['result']
-    filename = os.path.basename(filepath)
+    transfers.touch(task_id)
 
-    @after_this_request
-    def cleanup(response):
-        try:
-            if task_id in tasks:
-                del tasks[task_id]
-            
-            if os.path.exists(filepath):
-                 # if it's a zip file, the result is the zip file itself, and we need to remove the original folder
-                if filename.endswith('.zip'):
-                    folder_to_remove = os.path.dirname(filepath)
-                    shutil.rmtree(folder_to_remove)
-                os.remove(filepath)
+    if archive is None and task['mode'] == 'playlist' and os.path.isdir(filepath):
+        # Finished by another server process, or before a restart
+        archive = ZipStream()
+        for name in sorted(os.listdir(filepath)):
+            if not name.startswith('.'):
+                archive.add(os.path.join(filepath, name))
+        archive.close()
+    if archive is not None:
+        return archive_response(archive, task.get('archive_name') or 'playlist.zip', filepath,
+                                lambda: task['status'] == 'completed' and finish_task(task))
+    return send_result_file(task, filepath)
 
-        except Exception as e:
-            app.logger.error(f"Error cleaning up task {task_id}: {e}")
-        return response
 
-    return send_file(filepath, as_attachment=True, download_name=filename)
+def send_result_file(task, filepath):
+    """Sends a result file with Range/If-Range support, cleaning up once all of it was delivered."""
+    name = os.path.basename(filepath)
+    if app.config['USE_X_SENDFILE']:
+        return send_file(filepath, as_attachment=True, download_name=name)
+
+    stat = os.stat(filepath)
+    size = stat.st_size
+
+    def delivered(start, stop):
+        if transfers.record(task['task_id'], start, stop, size):
+            finish_task(task)
+
+    # Handing the server a real file keeps wsgi.file_wrapper in play, and a
+    # resumed request seeks straight to its first byte
+    f = DeliveryFile(filepath, delivered)
+    response = send_file(f, as_attachment=True, download_name=name, conditional=False,
+                         etag=f'{stat.st_mtime}-{size}', last_modified=stat.st_mtime)
+    response.content_length = size
+    try:
+        response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        f.close()
+        raise
+    if response.status_code == 206:
+        f.span = (response.content_range.start, response.content_range.stop)
+    elif response.status_code == 200:
+        f.span = (0, size)
+    return response
 
 
-def worker():
+def finish_task(task):
+    """Forgets a fetched task and releases its result file."""
+    task_id = task['task_id']
+    try:
+        tasks.pop(task_id)
+    except KeyError:
+        return  # Already finished by another transfer or by the retention sweep
+    transfers.forget(task_id)
+    task_events.forget(task_id)
+
+    try:
+        filepath = task['result']
+        if task.get('cache_key'):
+            # Cached files stay on disk for the next task; just drop our reference
+            download_cache.release(task['cache_key'])
+        elif release_file(filepath):
+            remove_result(filepath)
+    except Exception as e:
+        app.logger.error(f"Error cleaning up task {task_id}: {e}")
+
+
+def remove_result(filepath):
+    # Playlist results are the folder the archive is streamed from
+    if os.path.isdir(filepath):
+        shutil.rmtree(filepath)
+    elif os.path.exists(filepath):
+        os.remove(filepath)
+
+
+def reap():
+    """One pass of background cleanup; returns the bytes reclaimed from DOWNLOAD_FOLDER."""
+    for task_id in transfers.expired():
+        task = tasks.get(task_id)
+        if task:
+            finish_task(task)
+
+    # Results nobody came back for, and failed tasks, are dropped after MAX_RESULT_AGE
+    cutoff = time.time() - MAX_RESULT_AGE
+    for task_id in list(tasks):
+        task = tasks.get(task_id)
+        if (task and task['status'] in ('completed', 'failed') and task_id not in transfers
+                and (task.get('finished_at') or task.get('enqueued_at') or 0) < cutoff):
+            finish_task(task)
+
+    return reaper.sweep()
+
+
+def run_reaper():
     while True:
-        task_id = task_queue.get()
-        task = tasks[task_id]
-        task['status'] = 'processing'
-        
-        tmpdir = None
+        time.sleep(REAPER_INTERVAL)
         try:
-            tmpdir = tempfile.mkdtemp(dir=DOWNLOAD_FOLDER)
-            
-            url = task['url']
-            mode = task['mode']
-            format_id = task['format_id']
-
-            ffmpeg_location = os.path.join(BASE_DIR, 'bin')
-
-            if mode == 'playlist':
-                outtmpl = os.path.join(tmpdir, '%(playlist_index)03d - %(title)s.%(ext)s')
-                ydl_opts = {
-                    **YDL_OPTS_BASE,
-                    'outtmpl': outtmpl,
-                    'ignoreerrors': True,
-                    'ffmpeg_location': ffmpeg_location,
-                }
-                submode = task['submode']
-                if submode == 'audio':
-                    ydl_opts.update({
-                        'format': 'bestaudio/best',
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }],
-                    })
-                else:
-                    ydl_opts.update({
-                        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best',
-                        'merge_output_format': 'mp4',
-                    })
-
-                with YoutubeDL(ydl_opts) as ydl:
-                    ydl.extract_info(url, download=True)
-                
-                zip_basename = os.path.join(DOWNLOAD_FOLDER, f"playlist-{os.path.basename(tmpdir)}")
-                zip_path = shutil.make_archive(zip_basename, 'zip', root_dir=tmpdir)
-                shutil.rmtree(tmpdir)
-
-                task['status'] = 'completed'
-                task['result'] = zip_path
-
-            else: # single video/audio
-                outtmpl = os.path.join(tmpdir, '%(id)s.%(ext)s')
-                if mode == 'audio':
-                    ydl_opts = {
-                        **YDL_OPTS_BASE,
-                        'format': 'bestaudio/best',
-                        'outtmpl': outtmpl,
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }],
-                        'noplaylist': True,
-                        'ffmpeg_location': ffmpeg_location,
-                    }
-                else: # video
-                    ydl_opts = {
-                        **YDL_OPTS_BASE,
-                        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best',
-                        'outtmpl': outtmpl,
-                        'merge_output_format': 'mp4',
-                        'noplaylist': True,
-                        'ffmpeg_location': ffmpeg_location,
-                    }
-                    if format_id:
-                        ydl_opts['format'] = format_id
-
-                with YoutubeDL(ydl_opts) as ydl:
-                    ydl.extract_info(url, download=True)
-
-                produced_files = [f for f in os.listdir(tmpdir) if not f.startswith('.')]
-                if not produced_files:
-                    raise Exception('no file produced')
-
-                outfile = os.path.join(tmpdir, produced_files[0])
-                
-                # Move file out of tmpdir so we can clean it
-                final_path = os.path.join(DOWNLOAD_FOLDER, produced_files[0])
-                shutil.move(outfile, final_path)
-                shutil.rmtree(tmpdir)
-
-                task['status'] = 'completed'
-                task['result'] = final_path
-
+            reap()
         except Exception as e:
-            if tmpdir and os.path.exists(tmpdir):
-                shutil.rmtree(tmpdir)
-            task['status'] = 'failed'
-            task['error'] = get_simple_error(str(e))
+            app.logger.error(f"Error reaping downloads: {e}")
+
+
+def result_owners():
+    """Maps every path in DOWNLOAD_FOLDER that a task refers to onto that task, or BUSY."""
+    owners = {}
+    for task_id in list(tasks):
+        task = tasks.get(task_id)
+        if not task:
+            continue
+        busy = task['status'] in ('pending', 'processing') or task_id in transfers
+        for path in (task.get('result'), task.get('workdir')):
+            if path:
+                owners[path] = BUSY if busy else task
+    for path in list(live_folders):
+        owners[path] = BUSY
+    return owners
+
+
+def evict_result(path, task):
+    if task is not None:
+        finish_task(task)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def archive_response(archive, filename, folder, cleanup):
+    """Streams `archive` as a stored ZIP, cleaning up only after a complete transfer.
+
+    The reader holds `folder` while it streams, so neither other readers nor
+    the task finishing remove the files under it.
+    """
+    finished = []
+    done = archive_reader(folder, cleanup)
+
+    def generate():
+        started = time.monotonic()
+        yield from archive
+        record_stage('zip', started)
+        finished.append(True)
+
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    length = archive.content_length()
+    if length is not None:
+        headers['Content-Length'] = str(length)
+    response = Response(generate(), mimetype='application/zip', headers=headers)
+    response.call_on_close(lambda: done(bool(finished)))
+    return response
+
+
+def archive_reader(folder, cleanup):
+    """Holds `folder` for an archive reader; returns the function to call once it stops.
+
+    That function takes whether the whole archive was sent, and runs
+    `cleanup` if so.
+    """
+    hold_file(folder)
+
+    def done(finished):
+        try:
+            if finished:
+                cleanup()
         finally:
-            task_queue.task_done()
+            if release_file(folder):
+                remove_result(folder)
+    return done
+
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'lanes': worker_pool.stats(),
+        'info_cache': info_cache.stats(),
+        'extraction_cache': extraction_cache.stats(),
+        'download_cache': download_cache.stats(),
+        'task_store': tasks.stats(),
+        'transfers': len(transfers),
+        'reaper': reaper.stats(),
+        'inflight': len(inflight),
+        'coalesced': coalesced_count,
+        'rate_limits': {'info': info_limiter.stats(), 'download': download_limiter.stats()},
+        'outbound': outbound.stats(),
+        'postprocess_workers': POSTPROCESS_WORKERS,
+        'running_downloads': running_downloads,
+        'fragment_share': fragment_share(FRAGMENT_SLOTS, running_downloads + 1, outbound.rate),
+        'ydl_pool': ydl_pool.stats(),
+        'streams': len(live_folders),
+        'stages': stage_timings.stats(),
+    })
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def lane_metric(field):
+    return lambda: {(name,): lane[field] for name, lane in worker_pool.stats().items()}
+
+
+def cache_metric(field):
+    caches = {'info': info_cache, 'extraction': extraction_cache, 'download': download_cache}
+    return lambda: {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+
+def dedupe_key(task):
+    return (canonical_key(task['url']), task['mode'], task['format_id'], task['submode'], audio_output(task))
+
+
+def attach_to_inflight(task):
+    """Makes `task` wait on an identical pending/processing task, if there is one.
+
+    Returns False when `task` should be queued as the leader of a new job.
+    """
+    global coalesced_count
+    key = dedupe_key(task)
+    with inflight_lock:
+        leader = tasks.get(inflight.get(key))
+        if leader is None or leader['status'] not in ('pending', 'processing'):
+            inflight[key] = task['task_id']
+            task['followers'] = []
+            return False
+        leader['followers'].append(task['task_id'])
+        task['leader'] = leader['task_id']
+        coalesced_count += 1
+        return True
+
+
+def admission_refused(task):
+    """Returns a 503 response if `task`'s lane, or its client's share of it, is full."""
+    lane = worker_pool.lane(task['lane'])
+    if lane.queue.qsize() < MAX_QUEUE and lane.queue.count(task['client']) < MAX_QUEUED_PER_CLIENT:
+        return None
+    retry_after = lane.stats()['wait_avg'] or QUEUE_FULL_RETRY_AFTER
+    return jsonify({'error': 'The server is busy. Please try again later.'}), 503, {'Retry-After': str(math.ceil(retry_after))}
+
+
+def release_inflight(task):
+    """Undoes `attach_to_inflight` for a leader that was never queued."""
+    with inflight_lock:
+        key = dedupe_key(task)
+        if inflight.get(key) == task['task_id']:
+            del inflight[key]
+
+
+def settle_followers(task):
+    """Hands a finished leader's outcome to every task that coalesced onto it."""
+    followers = hand_off_to_followers(task)
+    task_events.notify(task['task_id'])
+    for follower in followers:
+        task_events.notify(follower['task_id'])
+
+
+def hand_off_to_followers(task):
+    with inflight_lock:
+        key = dedupe_key(task)
+        if inflight.get(key) == task['task_id']:
+            del inflight[key]
+        followers = [tasks[f] for f in task.pop('followers', []) if f in tasks]
+
+    if task['status'] == 'completed' and not task.get('cache_key'):
+        with inflight_lock:
+            file_waiters[task['result']] = file_waiters.get(task['result'], 1) + len(followers)
+    for follower in followers:
+        settle_follower(task, follower)
+    return followers
+
+
+def settle_follower(leader, follower):
+    with inflight_lock:
+        if follower['status'] != 'pending':
+            return
+        if leader['status'] == 'completed' and leader.get('cache_key'):
+            follower['cache_key'] = leader['cache_key']
+            download_cache.acquire(leader['cache_key'])
+        if leader.get('archive'):
+            follower['archive'] = leader['archive']
+        follower['archive_name'] = leader.get('archive_name')
+        follower['result'] = leader['result']
+        follower['error'] = leader['error']
+        follower['status'] = leader['status']
+        follower['finished_at'] = time.time()
+    tasks.save(follower)
+
+
+def hold_file(filepath):
+    """Adds a waiter, such as an archive reader, to a result file besides its task."""
+    with inflight_lock:
+        file_waiters[filepath] = file_waiters.get(filepath, 1) + 1
+
+
+def release_file(filepath):
+    """Drops one waiter from a result file; True once nobody else needs it."""
+    with inflight_lock:
+        remaining = file_waiters.get(filepath, 1) - 1
+        if remaining > 0:
+            file_waiters[filepath] = remaining
+            return False
+        file_waiters.pop(filepath, None)
+        return True
+
+
+def download_playlist_entries(url, ydl_opts, tmpdir, archive=None, tracker=None):
+    """Downloads every playlist entry into `tmpdir` concurrently.
+
+    Each finished entry is added to `archive` straight away. Failed entries
+    are skipped, except that an entry refused with HTTP 429 is tried again,
+    up to THROTTLE_RETRIES times, once the governor's backoff ends.
+    """
+    def download_entry(item):
+        index, entry = item
+        prefix = f'{index:03d} - '
+        outtmpl = os.path.join(tmpdir, prefix + ENTRY_OUTTMPL)
+        started = time.monotonic()
+        retries = 0
+        while True:
+            postprocessing = []
+            try:
+                with running_download('playlist_entry') as transfer, engine.YoutubeDL(
+                        {**ydl_opts, **transfer, 'outtmpl': outtmpl, 'deferred_postprocessing': postprocessing}) as ydl:
+                    # Flat entries carry no playlist_index; progress reports it per entry
+                    result = ydl.process_ie_result(copy.deepcopy(entry), download=True,
+                                                   extra_info={'playlist_index': index})
+                break
+            except Exception as e:
+                if is_rate_limited(e) and retries < THROTTLE_RETRIES:
+                    # Every request waits out the backoff, so the retry just goes out after it
+                    retries += 1
+                    continue
+                if tracker:
+                    tracker.entry_done()
+                raise
+        stage_timings.record('download', started)
+        # The entry slot is free again once the download is done
+        return postprocess_executor.submit(finish_entry, prefix, result, postprocessing, time.monotonic())
+
+    def finish_entry(prefix, result, postprocessing, queued_at):
+        try:
+            run_postprocessing(postprocessing, queued_at)
+        finally:
+            if tracker:
+                tracker.entry_done()
+        if archive is not None:
+            for name in sorted(os.listdir(tmpdir)):
+                if name.startswith(prefix) and not name.endswith(('.part', '.ytdl', '.temp')):
+                    archive.add(os.path.join(tmpdir, name))
+        return result
+
+    entries = playlist_entries(url)
+    if tracker:
+        tracker.set_entries(len(entries))
+    results = [
+        result.exception() or result.result() if isinstance(result, Future) else result
+        for result in run_bounded(entry_executor, download_entry, entries, PLAYLIST_CONCURRENCY)
+    ]
+    for (index, entry), result in zip(entries, results):
+        if isinstance(result, Exception):
+            app.logger.warning(f"Skipping playlist entry {index} ({entry.get('id')}): {result}")
+    return results
+
+
+def lane_for(task):
+    return 'playlist' if task['mode'] == 'playlist' else 'single'
+
+
+def audio_output(task):
+    """The task's entry in AUDIO_OUTPUTS; tasks from before it existed were always mp3."""
+    return task.get('audio_format') or DEFAULT_AUDIO_OUTPUT
+
+
+def single_ydl_opts(mode, format_id, audio_format=DEFAULT_AUDIO_OUTPUT):
+    return {
+        **YDL_OPTS_BASE,
+        **output_opts(mode, format_id, audio_format),
+        'noplaylist': True,
+    }
+
+
+@contextlib.contextmanager
+def running_download(kind):
+    """Counts a download of `kind` as running for the block; yields its transfer options."""
+    global running_downloads
+    with running_downloads_lock:
+        running_downloads += 1
+        share = fragment_share(FRAGMENT_SLOTS, running_downloads, outbound.rate)
+    try:
+        yield transfer_opts(kind, share)
+    finally:
+        with running_downloads_lock:
+            running_downloads -= 1
+
+
+def single_cache_key(url, ydl_opts):
+    return download_cache.key_for(
+        canonical_key(url),
+        ydl_opts['format'],
+        [ydl_opts.get('postprocessors'), ydl_opts.get('merge_output_format')],
+    )
+
+
+def complete_from_cache(task, cache_key):
+    """Completes `task` with an already downloaded file, if the cache has one."""
+    cached_path = download_cache.acquire(cache_key)
+    if not cached_path:
+        return False
+    task['cache_key'] = cache_key
+    task['status'] = 'completed'
+    task['result'] = cached_path
+    task['finished_at'] = time.time()
+    return True
+
+
+def process_task(task_id):
+    task = tasks.get(task_id)
+    if not task or task['status'] in ('completed', 'failed'):
+        return  # Cancelled while queued
+    next_stage = None
+    try:
+        next_stage = run_task(task)
+    except Exception as e:
+        # run_task handles download errors itself; anything escaping it is a bug,
+        # but the task must still end instead of staying 'processing' for good
+        app.logger.exception(f"Task {task_id} crashed")
+        task['status'] = 'failed'
+        task['error'] = failure_message(e)
+    finally:
+        if task['status'] == 'pending':
+            job_budgets.pop(task_id, None)
+            tasks.save(task)
+            worker_pool.submit(task_id, task.get('lane') or lane_for(task))
+        elif next_stage:
+            tasks.save(task)
+            postprocess_executor.submit(next_stage)
+        else:
+            settle_task(task)
+
+
+def settle_task(task):
+    job_budgets.pop(task['task_id'], None)
+    task['finished_at'] = time.time()
+    tasks.save(task)
+    settle_followers(task)
+
+
+def run_postprocessing(postprocessing, queued_at, task=None):
+    record_stage('postprocess_wait', queued_at, task)
+    started = time.monotonic()
+    for job in postprocessing:
+        job()
+    record_stage('postprocess', started, task)
+
+
+def run_task(task):
+    """Runs `task` up to its post-processing; returns that stage if it is still to run."""
+    task['status'] = 'processing'
+    if task.get('enqueued_at'):
+        record_stage('queue', time.monotonic() - max(0.0, time.time() - task['enqueued_at']), task)
+    tracker = ProgressTracker(task, notify=lambda: task_events.notify(task['task_id']))
+    tmpdir = None
+    try:
+        budget = job_budgets[task['task_id']] = JobBudget(**JOB_LIMITS[task['mode']])
+        if task.get('cancelled'):
+            budget.cancel()
+        budget.check()
+        url = task['url']
+        mode = task['mode']
+        format_id = task['format_id']
+
+        if mode == 'playlist':
+            tmpdir = make_job_dir(DOWNLOAD_FOLDER, JOB_DIR_PREFIX)
+            ydl_opts = {
+                **YDL_OPTS_BASE,
+                **output_opts(task['submode'], audio_format=audio_output(task)),
+                'noplaylist': True,
+                'job_budget': budget,
+            }
+            ydl_opts.update(tracker.hooks())
+
+            started = time.monotonic()
+            archive = ZipStream()
+            task['archive'] = archive
+            task['archive_name'] = f"playlist-{os.path.basename(tmpdir)}.zip"
+            task['result'] = tmpdir
+            tasks.save(task)
+            download_playlist_entries(url, ydl_opts, tmpdir, archive, tracker)
+            budget.check()  # Entries fail one by one when the job is aborted
+            archive.close()
+            record_stage('playlist', started, task)
+
+            tracker.set_phase('finished')
+            task['status'] = 'completed'
+
+        else: # single video/audio
+            ydl_opts = single_ydl_opts(mode, format_id, audio_output(task))
+            cache_key = single_cache_key(url, ydl_opts)
+            if complete_from_cache(task, cache_key):
+                tracker.set_phase('finished')
+                return
+
+            tmpdir = task['workdir'] = make_job_dir(DOWNLOAD_FOLDER, JOB_DIR_PREFIX)
+            tasks.save(task)
+            ydl_opts['outtmpl'] = os.path.join(tmpdir, SINGLE_OUTTMPL)
+            ydl_opts.update(tracker.hooks())
+            ydl_opts['job_budget'] = budget
+            postprocessing = ydl_opts['deferred_postprocessing'] = []
+
+            started = time.monotonic()
+            with running_download('audio' if mode == 'audio' else 'video') as transfer, \
+                    engine.YoutubeDL({**ydl_opts, **transfer}) as ydl:
+                extract_and_download(ydl, url)
+            record_stage('download', started, task)
+
+            if postprocessing:
+                tracker.set_phase('postprocessing')
+                return functools.partial(
+                    postprocess_single, task, postprocessing, tmpdir, cache_key, tracker, time.monotonic())
+            store_single_result(task, tmpdir, cache_key, tracker)
+
+    except Exception as e:
+        if task.get('archive'):
+            task['archive'].close()
+        if tmpdir and os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        if is_rate_limited(e) and task.get('retries', 0) < THROTTLE_RETRIES:
+            # The governor holds every request back until the backoff ends,
+            # so the task just goes back in line instead of failing
+            task['retries'] = task.get('retries', 0) + 1
+            task['archive'] = None
+            task['result'] = None
+            tracker.set_phase('throttled')
+            task['status'] = 'pending'
+            return
+        tracker.set_phase('failed')
+        task['status'] = 'failed'
+        task['error'] = failure_message(e)
+
+
+def postprocess_single(task, postprocessing, tmpdir, cache_key, tracker, queued_at):
+    """Second stage of a single download: runs ffmpeg, then completes the task."""
+    try:
+        job_budgets[task['task_id']].check()
+        run_postprocessing(postprocessing, queued_at, task)
+        store_single_result(task, tmpdir, cache_key, tracker)
+    except Exception as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        tracker.set_phase('failed')
+        task['status'] = 'failed'
+        task['error'] = failure_message(e)
+    settle_task(task)
+
+
+def store_single_result(task, tmpdir, cache_key, tracker):
+    produced_files = [f for f in os.listdir(tmpdir) if not f.startswith('.')]
+    if not produced_files:
+        raise Exception('no file produced')
+
+    # Move the file into the download cache so we can clean tmpdir
+    final_path = download_cache.add(cache_key, os.path.join(tmpdir, produced_files[0]))
+    shutil.rmtree(tmpdir)
+
+    tracker.set_phase('finished')
+    task['cache_key'] = cache_key
+    task['status'] = 'completed'
+    task['result'] = final_path
+
+
+def task_enqueued_at(task_id):
+    task = tasks.get(task_id)
+    return task.get('enqueued_at') if task else None
+
+
+reaper = Reaper(
+    DOWNLOAD_FOLDER, MAX_RESULT_AGE, MAX_FOLDER_BYTES,
+    owners=result_owners, evict=evict_result, prefix=JOB_DIR_PREFIX,
+)
+worker_pool = WorkerPool(
+    process_task,
+    {'single': SINGLE_WORKERS, 'playlist': PLAYLIST_WORKERS},
+    enqueued_at=task_enqueued_at,
+    queue_factory=tasks.queue,
+)
+task_queue = worker_pool.lane('single').queue
+playlist_queue = worker_pool.lane('playlist').queue
+
+
+def start_background_work():
+    """Starts the download workers and the reaper; the server entry points call this, importing does not."""
+    # Temp dirs of jobs that died with an earlier server process
+    reaper.sweep_orphans()
+    worker_pool.start()
+    threading.Thread(target=run_reaper, name='reaper', daemon=True).start()
+
+
+def serve():
+    """App factory for `waitress-serve --call app:serve`."""
+    start_background_work()
+    return app
 
-# Start the worker thread
-threading.Thread(target=worker, daemon=True).start()
+metrics.collected('ytd_queue_depth', 'Tasks waiting per lane.', lane_metric('depth'), ('lane',))
+metrics.collected('ytd_active_workers', 'Workers running a task per lane.', lane_metric('active'), ('lane',))
+metrics.collected('ytd_tasks_started_total', 'Tasks taken off the queue per lane.', lane_metric('processed'),
+                  ('lane',), kind='counter')
+metrics.collected('ytd_tasks', 'Tasks held by the server.', lambda: len(tasks))
+metrics.collected('ytd_streams', 'Downloads being streamed through /download/stream.', lambda: len(live_folders))
+metrics.collected('ytd_cache_hits_total', 'Cache hits.', cache_metric('hits'), ('cache',), kind='counter')
+metrics.collected('ytd_cache_misses_total', 'Cache misses.', cache_metric('misses'), ('cache',), kind='counter')
+metrics.collected('ytd_cache_bytes', 'Bytes held per cache.', cache_metric('bytes'), ('cache',))
+metrics.collected('ytd_download_folder_bytes', 'Bytes used by job folders in the download folder.',
+                  lambda: reaper.total_bytes())
+metrics.collected('ytd_downloaded_bytes_total', 'Bytes downloaded from the video site.',
+                  lambda: outbound.bytes, kind='counter')
+metrics.collected('ytd_outbound_requests_total', 'HTTP requests made to the video site.',
+                  lambda: outbound.requests, kind='counter')
+metrics.collected('ytd_outbound_throttled_total', 'HTTP 429 answers from the video site.',
+                  lambda: outbound.throttled_count, kind='counter')
+metrics.collected('ytd_rate_limited_total', 'Client requests refused by the rate limit.',
+                  lambda: {('info',): info_limiter.limited, ('download',): download_limiter.limited},
+                  ('endpoint',), kind='counter')
 
 if __name__ == '__main__':
+    start_background_work()
     app.run(debug=True, port=5000)
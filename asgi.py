@@ -0,0 +1,270 @@
+"""Async serving mode: the app as an ASGI application, for uvicorn.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+/info, /status and /events are answered on the event loop: /info runs its
+extraction on `info_executor`, and /events streams wait on task changes
+without holding a thread. So do live playlist archives (/file?live=1),
+which wait on the loop for each entry to finish and read files on
+`bridge_executor` one block at a time. Every other route goes through the
+Flask app on a thread of `bridge_executor`, and the response body is pulled
+from it one block at a time, so a /file transfer to a slow client holds no
+thread while it waits for the client.
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+from werkzeug.wsgi import FileWrapper
+
+import app as server
+
+BRIDGE_THREADS = int(os.environ.get('YTD_ASGI_THREADS', 32))
+MAX_EVENT_STREAMS = int(os.environ.get('YTD_ASGI_MAX_EVENT_STREAMS', 4096))
+FILE_BLOCK_SIZE = 256 * 1024
+
+bridge_executor = ThreadPoolExecutor(max_workers=BRIDGE_THREADS, thread_name_prefix='asgi-bridge')
+
+
+def file_wrapper(f, buffer_size=8192):
+    # Fewer, larger reads: each block is one trip to the executor
+    return FileWrapper(f, max(buffer_size, FILE_BLOCK_SIZE))
+
+
+def wsgi_environ(scope, body):
+    server_addr = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_addr[0],
+        'SERVER_PORT': str(server_addr[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': file_wrapper,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def watch_disconnect(receive, gone):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    gone.set()
+
+
+async def send_json(send, body, status=200, headers=None):
+    data = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+        + [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in (headers or {}).items()],
+    })
+    await send({'type': 'http.response.body', 'body': data})
+
+
+class AsyncApp:
+    """ASGI application serving a Flask app, with async versions of its long-waiting routes."""
+
+    routes = [
+        ('POST', re.compile(r'/info'), 'info'),
+        ('GET', re.compile(r'/status/([^/]+)'), 'status'),
+        ('GET', re.compile(r'/events/([^/]+)'), 'events'),
+        ('GET', re.compile(r'/file/([^/]+)'), 'file'),
+    ]
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.event_streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        body = await read_body(receive)
+        if body is None:
+            return
+        gone = asyncio.Event()
+        watcher = asyncio.create_task(watch_disconnect(receive, gone))
+        try:
+            for method, pattern, name in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match and scope['method'] == method:
+                    return await getattr(self, name)(scope, body, send, gone, *match.groups())
+            await self.bridge(scope, body, send, gone)
+        finally:
+            watcher.cancel()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                server.start_background_work()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def info(self, scope, body, send, gone):
+        request = Request(wsgi_environ(scope, body))
+        try:
+            data = request.get_json() or {}
+        except HTTPException:
+            return await self.bridge(scope, body, send, gone)  # Let Flask answer malformed requests
+        client = (scope.get('client') or ('unknown',))[0]
+        answer = server.info_request(client, data, request.args.get('page'))
+        if callable(answer):
+            answer = await asyncio.get_running_loop().run_in_executor(server.info_executor, answer)
+        await send_json(send, *answer)
+
+    async def status(self, scope, body, send, gone, task_id):
+        task = server.tasks.get(task_id)
+        if not task:
+            return await send_json(send, {'error': 'task not found'}, 404)
+        await send_json(send, server.status_payload(task))
+
+    async def events(self, scope, body, send, gone, task_id):
+        if not server.tasks.get(task_id):
+            return await send_json(send, {'error': 'task not found'}, 404)
+        if self.event_streams >= MAX_EVENT_STREAMS:
+            return await send_json(send, {'error': 'too many event streams'}, 503, {'Retry-After': '5'})
+        self.event_streams += 1
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': server.EVENT_STREAM_START.encode(), 'more_body': True})
+            last = None
+            while not gone.is_set():
+                frame, last, watch = server.event_step(task_id, last)
+                await send({'type': 'http.response.body', 'body': frame.encode(), 'more_body': watch is not None})
+                if watch is None:
+                    return
+                waiting = asyncio.ensure_future(server.task_events.wait_async(*watch, timeout=server.EVENT_KEEPALIVE))
+                stopping = asyncio.ensure_future(gone.wait())
+                await asyncio.wait([waiting, stopping], return_when=asyncio.FIRST_COMPLETED)
+                waiting.cancel()
+                stopping.cancel()
+        finally:
+            self.event_streams -= 1
+
+    async def file(self, scope, body, send, gone, task_id):
+        task = server.tasks.get(task_id)
+        archive = task.get('archive') if task else None
+        live = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('live')
+        if archive is None or task['status'] != 'processing' or not live:
+            # Finished results never wait on a download
+            return await self.bridge(scope, body, send, gone)
+
+        loop = asyncio.get_running_loop()
+        server.transfers.touch(task_id)
+        done = server.archive_reader(task['result'], lambda: task['status'] == 'completed' and server.finish_task(task))
+        finished = False
+        try:
+            name = task.get('archive_name') or 'playlist.zip'
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'application/zip'),
+                (b'content-disposition', f'attachment; filename="{name}"'.encode('latin-1')),
+            ]})
+            started = time.monotonic()
+            index = 0
+            while not gone.is_set():
+                waiting = asyncio.ensure_future(archive.next_entry_async(index))
+                stopping = asyncio.ensure_future(gone.wait())
+                await asyncio.wait([waiting, stopping], return_when=asyncio.FIRST_COMPLETED)
+                stopping.cancel()
+                if not waiting.done():
+                    waiting.cancel()
+                    return
+                entry = waiting.result()
+                if entry is None:
+                    break
+                blocks = archive.entry_blocks(entry)
+                block = await loop.run_in_executor(self.executor, next, blocks, None)
+                while block is not None and not gone.is_set():
+                    await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+                    block = await loop.run_in_executor(self.executor, next, blocks, None)
+                index += 1
+            if gone.is_set():
+                return
+            await send({'type': 'http.response.body', 'body': b''.join(archive.central_directory())})
+            server.record_stage('zip', started)
+            finished = True
+        finally:
+            await loop.run_in_executor(self.executor, done, finished)
+
+    async def bridge(self, scope, body, send, gone):
+        """Runs the WSGI app on the executor and streams its response body back block by block."""
+        loop = asyncio.get_running_loop()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), headers]
+
+        iterable = await loop.run_in_executor(self.executor, self.wsgi_app, wsgi_environ(scope, body), start_response)
+        try:
+            iterator = iter(iterable)
+            # start_response may only be called once the first block is produced
+            block = await loop.run_in_executor(self.executor, next, iterator, None)
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+            })
+            while block is not None and not gone.is_set():
+                if block:
+                    await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+                block = await loop.run_in_executor(self.executor, next, iterator, None)
+            await send({'type': 'http.response.body'})
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+
+application = AsyncApp(server.app, bridge_executor)
@@ -0,0 +1,103 @@
+"""Counts extractor calls and HTTP round-trips for one /info + download flow.
+
+Serves a small video file from a local HTTP server, posts it to /info,
+then runs the download task for the same URL, once with the /info
+extraction reused and once with it discarded.
+
+    python benchmarks/bench_extraction_reuse.py
+"""
+import functools
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from yt_dlp.extractor.common import InfoExtractor
+
+import app as app_module
+
+counters = {'extract': 0, 'http': 0}
+
+
+class CountingHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        counters['http'] += 1
+        return super().send_head()
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        pass  # the generic extractor hangs up after sniffing the headers
+
+
+def count_extract(extract):
+    @functools.wraps(extract)
+    def wrapper(self, url):
+        counters['extract'] += 1
+        return extract(self, url)
+    return wrapper
+
+
+def run_flow(client, url, reuse):
+    counters.update(extract=0, http=0)
+    app_module.info_cache.clear()
+    app_module.extraction_cache.clear()
+
+    start = time.perf_counter()
+    response = client.post('/info', data=json.dumps({'url': url}), content_type='application/json')
+    assert response.status_code == 200, response.data
+    if not reuse:
+        app_module.extraction_cache.clear()
+
+    task_id = 'bench-' + str(reuse)
+    app_module.tasks[task_id] = {
+        'task_id': task_id, 'url': url, 'mode': 'video', 'format_id': None,
+        'submode': 'video', 'status': 'pending', 'result': None, 'error': None,
+    }
+    app_module.process_task(task_id)
+    while app_module.tasks[task_id]['status'] == 'processing':
+        time.sleep(0.001)  # post-processing finishes on its own pool
+    elapsed = time.perf_counter() - start
+
+    task = app_module.tasks.pop(task_id)
+    assert task['status'] == 'completed', task['error']
+    os.remove(task['result'])
+    return dict(counters, seconds=elapsed)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, 'sample.mp4'), 'wb') as f:
+            f.write(os.urandom(2 * 1024 * 1024))
+        app_module.DOWNLOAD_FOLDER = os.path.join(root, 'downloads')
+        os.makedirs(app_module.DOWNLOAD_FOLDER)
+
+        server = QuietServer(
+            ('127.0.0.1', 0), functools.partial(CountingHandler, directory=root))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/sample.mp4'
+
+        InfoExtractor.extract = count_extract(InfoExtractor.extract)
+        client = app_module.app.test_client()
+        try:
+            for reuse in (False, True):
+                result = run_flow(client, url, reuse)
+                label = 'reused extraction' if reuse else 'fresh extraction'
+                print(f"{label:>18}: {result['extract']} extractor calls, "
+                      f"{result['http']} HTTP requests, {result['seconds'] * 1000:.1f} ms")
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
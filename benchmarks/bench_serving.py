@@ -0,0 +1,180 @@
+"""How many clients each serving mode can hold while still answering /status.
+
+Starts the server twice on a seeded task database: threaded, as
+start_server.bat runs it (waitress-serve with --threads), and async (uvicorn
+serving asgi:application). At each level it holds open --held slow clients,
+half of them stalled /file downloads of a large result and half of them
+/events streams of a queued task, then times --probes /status requests and
+reports how many of the held clients were served at all.
+
+    python benchmarks/bench_serving.py [--held 0,32,128,512] [--threads 64] [--probes 200]
+"""
+import argparse
+import http.client
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from store import SQLiteTaskStore
+
+RESULT_SIZE = 256 * 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def seed(folder):
+    """A task database holding a finished download and a task nobody will ever run."""
+    result = os.path.join(folder, 'result.mp4')
+    with open(result, 'wb') as f:
+        f.truncate(RESULT_SIZE)
+    path = os.path.join(folder, 'tasks.db')
+    store = SQLiteTaskStore(path)
+    now = time.time()
+    store['done'] = {'task_id': 'done', 'url': 'u', 'mode': 'video', 'format_id': None, 'submode': 'video',
+                     'status': 'completed', 'result': result, 'error': None, 'enqueued_at': now, 'finished_at': now}
+    # No worker takes tasks from this lane, so its event streams stay open
+    store['queued'] = {'task_id': 'queued', 'url': 'u', 'mode': 'video', 'status': 'pending', 'lane': 'bench',
+                       'result': None, 'error': None, 'enqueued_at': now}
+    return path
+
+
+def start_server(mode, port, threads, db):
+    if mode == 'threaded':
+        command = [sys.executable, '-m', 'waitress', f'--threads={threads}', f'--listen=127.0.0.1:{port}', '--call', 'app:serve']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning', '--no-access-log', 'asgi:application']
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, 'YTD_TASK_DB': db},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if probe(port, timeout=1)[0] == 200:
+            return process
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def probe(port, path='/status/done', timeout=5):
+    started = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        return response.status, time.perf_counter() - started
+    except OSError:
+        return None, time.perf_counter() - started
+
+
+def hold(port, path):
+    """Sends a request and never reads the answer, like a client on a very slow link."""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.settimeout(5)
+    try:
+        sock.connect(('127.0.0.1', port))
+        sock.sendall(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def answer_of(sock):
+    """'200', '503', ... for a held client the server answered, 'waiting' otherwise."""
+    if sock is None:
+        return 'refused'
+    sock.settimeout(0.5)
+    try:
+        line = sock.recv(64)
+    except OSError:
+        return 'waiting'
+    return line.split(b' ')[1].decode() if line.startswith(b'HTTP/') else 'closed'
+
+
+def run_level(port, held, probes, concurrency):
+    files = [hold(port, '/file/done') for _ in range(held // 2)]
+    streams = [hold(port, '/events/queued') for _ in range(held - held // 2)]
+    time.sleep(1)
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(lambda _: probe(port), range(probes)))
+        file_answers = [answer_of(s) for s in files]
+        stream_answers = [answer_of(s) for s in streams]
+    finally:
+        for s in files + streams:
+            if s is not None:
+                s.close()
+    latencies = sorted(elapsed for status, elapsed in results if status == 200)
+    return {
+        'status_ok': len(latencies),
+        'p50': statistics.median(latencies) if latencies else None,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] if latencies else None,
+        'files': summarize(file_answers),
+        'streams': summarize(stream_answers),
+    }
+
+
+def summarize(answers):
+    counts = {}
+    for answer in answers:
+        counts[answer] = counts.get(answer, 0) + 1
+    return ' '.join(f'{answer}:{count}' for answer, count in sorted(counts.items())) or '-'
+
+
+def ms(seconds):
+    return f'{seconds * 1000:8.1f}' if seconds is not None else '       -'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--held', default='0,32,128,512', help='comma-separated numbers of slow clients')
+    parser.add_argument('--threads', type=int, default=64, help='waitress threads (start_server.bat uses 64)')
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel /status probes')
+    parser.add_argument('--modes', default='threaded,async')
+    args = parser.parse_args()
+
+    levels = [int(n) for n in args.held.split(',')]
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, 4 * max(levels) + 1024)), hard))
+
+    folder = tempfile.mkdtemp()
+    try:
+        db = seed(folder)
+        for mode in args.modes.split(','):
+            port = free_port()
+            process = start_server(mode, port, args.threads, db)
+            try:
+                print(f'{mode}:')
+                print(f'  {"held":>5} {"status ok":>10} {"p50 ms":>8} {"p95 ms":>8}  file answers / event answers')
+                for held in levels:
+                    r = run_level(port, held, args.probes, args.concurrency)
+                    print(f'  {held:5d} {r["status_ok"]:>5d}/{args.probes:<4d} {ms(r["p50"])} {ms(r["p95"])}  '
+                          f'{r["files"]} / {r["streams"]}')
+                    time.sleep(2)  # Let the server notice the closed connections
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measures enqueue and claim throughput of the task stores.
+
+Runs the in-memory store, the SQLite store drained by one process, and
+the SQLite store drained by several processes sharing one database file,
+and checks that no task is claimed twice.
+
+    python benchmarks/bench_task_store.py [tasks] [processes]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from store import MemoryTaskStore, SQLiteTaskStore
+
+
+def make_task(i):
+    return {'task_id': str(i), 'url': f'https://example.com/{i}', 'mode': 'video',
+            'status': 'pending', 'result': None, 'error': None,
+            'lane': 'single', 'enqueued_at': float(i)}
+
+
+def enqueue(store, count):
+    queue = store.queue('single')
+    start = time.perf_counter()
+    for i in range(count):
+        store[str(i)] = make_task(i)
+        queue.put(str(i))
+    return time.perf_counter() - start
+
+
+def drain_memory(store, count):
+    queue = store.queue('single')
+    for i in range(count):
+        queue.put(str(i))
+    start = time.perf_counter()
+    while not queue.empty():
+        store[queue.get()]['status'] = 'processing'
+    return time.perf_counter() - start
+
+
+def drain_sqlite(path, results):
+    store = SQLiteTaskStore(path)
+    claimed = []
+    while True:
+        task_id = store.claim('single')
+        if task_id is None:
+            break
+        claimed.append(task_id)
+    results.put(claimed)
+
+
+def claim_sqlite(path, processes):
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=drain_sqlite, args=(path, results))
+               for _ in range(processes)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    claimed = [task_id for _ in workers for task_id in results.get()]
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start, claimed
+
+
+def report(label, count, seconds):
+    print(f'{label:>28}: {count / seconds:>10.0f} tasks/s ({seconds * 1000:.1f} ms)')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    memory = MemoryTaskStore()
+    report('memory enqueue', count, enqueue(memory, count))
+    report('memory claim', count, drain_memory(memory, count))
+
+    for n in (1, processes):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'tasks.db')
+            report('sqlite enqueue', count, enqueue(SQLiteTaskStore(path), count))
+            seconds, claimed = claim_sqlite(path, n)
+            assert len(claimed) == len(set(claimed)) == count, 'tasks lost or claimed twice'
+            report(f'sqlite claim ({n} process{"es" if n > 1 else ""})', count, seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Measures download throughput under each transfer profile.
+
+Serves an HLS stream and a progressive file from a local HTTP server that
+adds a fixed latency to every request and caps each connection's
+bandwidth, roughly like a CDN edge, then downloads both with yt-dlp's
+defaults and with each profile from profiles.py.
+
+Downloads run through the app's YoutubeDL, so every request passes the
+shared outbound governor as configured by YTD_OUTBOUND_RATE and
+YTD_OUTBOUND_BANDWIDTH; --outbound-rate overrides the request rate. The
+share each profile gets is the app's: FRAGMENT_SLOTS split over --jobs
+concurrent downloads and capped by the request rate.
+
+    python benchmarks/bench_transfer_profiles.py [--segments 40] [--segment-kib 256] [--jobs 1]
+"""
+import argparse
+import functools
+import http.server
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import engine
+from profiles import PROFILES, transfer_opts, fragment_share
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serves /index.m3u8, /seg<N>.ts and /file.bin (with Range support)."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, *args, segments, segment_size, latency, rate, **kwargs):
+        self.segments = segments
+        self.segment_size = segment_size
+        self.latency = latency
+        self.rate = rate
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path == '/index.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+            for i in range(self.segments):
+                lines += ['#EXTINF:4.0,', f'seg{i}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            return self.send_body('\n'.join(lines).encode(), 'application/vnd.apple.mpegurl')
+        if re.fullmatch(r'/seg\d+\.ts', self.path):
+            return self.send_body(b'\x47' * self.segment_size, 'video/mp2t')
+        if self.path == '/file.bin':
+            size = self.segments * self.segment_size
+            start, stop = 0, size - 1
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                stop = min(stop, int(match.group(2))) if match.group(2) else stop
+            return self.send_body(b'\0' * (stop - start + 1), 'application/octet-stream',
+                                  content_range=(start, stop, size) if match else None)
+        self.send_error(404)
+
+    def send_body(self, body, content_type, content_range=None):
+        self.send_response(206 if content_range else 200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if content_range:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % content_range)
+        self.end_headers()
+        block = 64 * 1024
+        for offset in range(0, len(body), block):
+            self.wfile.write(body[offset:offset + block])
+            time.sleep(block / self.rate)
+
+
+def download(url, protocol, opts, folder):
+    info = {
+        'id': 'bench', 'title': 'bench', 'extractor': 'generic', 'extractor_key': 'Generic',
+        'webpage_url': url,
+        'formats': [{'format_id': 'media', 'url': url, 'protocol': protocol, 'ext': 'mp4',
+                     'vcodec': 'avc1', 'acodec': 'mp4a'}],
+    }
+    params = {
+        'quiet': True, 'no_warnings': True, 'noprogress': True, 'fixup': 'never',
+        'outtmpl': os.path.join(folder, '%(id)s.%(ext)s'), **opts,
+    }
+    waited = engine.outbound.waited
+    start = time.perf_counter()
+    with engine.YoutubeDL(params) as ydl:
+        ydl.process_ie_result(info, download=True)
+    elapsed = time.perf_counter() - start
+    waited = engine.outbound.waited - waited
+    size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    return size, elapsed, waited
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segments', type=int, default=40)
+    parser.add_argument('--segment-kib', type=int, default=256)
+    parser.add_argument('--latency-ms', type=float, default=30)
+    parser.add_argument('--connection-mbps', type=float, default=40, help='bandwidth cap per connection')
+    parser.add_argument('--fragment-slots', type=int, default=32, help='FRAGMENT_SLOTS')
+    parser.add_argument('--jobs', type=int, default=1, help='downloads sharing the fragment slots')
+    parser.add_argument('--outbound-rate', type=float, default=None,
+                        help='outbound requests per second (default: YTD_OUTBOUND_RATE, 20)')
+    args = parser.parse_args()
+
+    if args.outbound_rate is not None:
+        engine.outbound.rate = args.outbound_rate
+        engine.outbound.burst = max(1, int(args.outbound_rate))
+    share = fragment_share(args.fragment_slots, args.jobs, engine.outbound.rate)
+    print(f'outbound rate {engine.outbound.rate:g} req/s, fragment share {share}')
+
+    handler = functools.partial(
+        StandInHandler, segments=args.segments, segment_size=args.segment_kib * 1024,
+        latency=args.latency_ms / 1000, rate=args.connection_mbps * 1e6 / 8,
+    )
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    profiles = {'yt-dlp defaults': {}}
+    profiles.update((kind, transfer_opts(kind, share)) for kind in PROFILES)
+    folder = tempfile.mkdtemp()
+    try:
+        for label, url, protocol in (('HLS', base + '/index.m3u8', 'm3u8_native'),
+                                     ('progressive', base + '/file.bin', 'https')):
+            print(f'{label}:')
+            for name, opts in profiles.items():
+                size, elapsed, waited = download(url, protocol, opts, folder)
+                print(f'  {name:>16}: {size / elapsed / 1e6:7.1f} MB/s '
+                      f'({size / 1e6:.1f} MB in {elapsed:.2f} s, '
+                      f"{opts.get('concurrent_fragment_downloads', 1)} fragments at once, "
+                      f'{waited:.2f} s waiting for the governor)')
+    finally:
+        shutil.rmtree(folder)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Per-request overhead of building a YoutubeDL versus borrowing a pooled one.
+
+Each round builds (or borrows) an extraction-only YoutubeDL with a
+cookies.txt of --cookies entries, and extracts a small file from a local
+HTTP server with the generic extractor, as /info does.
+
+    python benchmarks/bench_ydl_pool.py [--rounds 200] [--cookies 500]
+"""
+import argparse
+import functools
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from yt_dlp import YoutubeDL
+
+from ydl_pool import SharedSession, YoutubeDLPool, sharing
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # the generic extractor hangs up after sniffing the headers
+
+
+def write_cookies(path, count):
+    with open(path, 'w') as f:
+        f.write('# Netscape HTTP Cookie File\n')
+        for i in range(count):
+            f.write(f'.example.com\tTRUE\t/\tFALSE\t4102444800\tcookie{i}\t{"v" * 64}\n')
+
+
+def fresh(params, url):
+    with YoutubeDL(params) as ydl:
+        ydl.extract_info(url, download=False, process=False)
+
+
+def pooled(pool, params, url):
+    with pool.instance('info', params) as ydl:
+        ydl.extract_info(url, download=False, process=False)
+
+
+def timed(rounds, fn, *args):
+    fn(*args)  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(*args)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--cookies', type=int, default=500)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    with open(os.path.join(root, 'sample.mp4'), 'wb') as f:
+        f.write(os.urandom(64 * 1024))
+    cookiefile = os.path.join(root, 'cookies.txt')
+    write_cookies(cookiefile, args.cookies)
+
+    server = QuietServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/sample.mp4'
+    params = {'quiet': True, 'no_warnings': True, 'skip_download': True, 'cookiefile': cookiefile}
+
+    session = SharedSession()
+    pool = YoutubeDLPool(sharing(YoutubeDL, session))
+    try:
+        per_fresh = timed(args.rounds, fresh, params, url)
+        per_pooled = timed(args.rounds, pooled, pool, params, url)
+        pool_stats = pool.stats()
+    finally:
+        pool.clear()
+        session.close()
+        server.shutdown()
+        shutil.rmtree(root)
+
+    print(f'fresh YoutubeDL per request: {per_fresh * 1000:7.2f} ms')
+    print(f'pooled YoutubeDL:            {per_pooled * 1000:7.2f} ms  ({per_fresh / per_pooled:.1f}x)')
+    print(f'pool: {pool_stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from yt_dlp.utils import DownloadCancelled
+
+
+class JobAborted(DownloadCancelled):
+    """Base of the errors that stop a job; yt-dlp lets them through instead of retrying or skipping."""
+    msg = 'Job aborted'
+
+
+class Cancelled(JobAborted):
+    msg = 'Task cancelled'
+
+
+class TimeLimitExceeded(JobAborted):
+    msg = 'Job time limit exceeded'
+
+
+class SizeLimitExceeded(JobAborted):
+    msg = 'Job size limit exceeded'
+
+
+class DurationLimitExceeded(JobAborted):
+    msg = 'Video duration limit exceeded'
+
+
+class JobBudget:
+    """Wall-time and byte limits for one job, plus a switch to cancel it.
+
+    Once the job is cancelled, runs past `max_seconds` or is about to
+    download more than `max_bytes` in total, `check` raises on every call;
+    yt-dlp calls it through `progress_hook` for every downloaded chunk and
+    before every HTTP request (see `budgeted`), so the job stops within a
+    chunk. `match_filter` refuses videos longer than `max_duration` seconds
+    before anything is downloaded. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_seconds=0, max_bytes=0, max_duration=0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.clock = clock
+        self.deadline = clock() + max_seconds if max_seconds else None
+        self._lock = threading.Lock()
+        self._sizes = {}  # download file -> bytes it will take
+        self._aborted = None  # JobAborted subclass once the job must stop
+
+    @property
+    def aborted(self):
+        return self._aborted is not None
+
+    def cancel(self):
+        self._abort(Cancelled)
+
+    def _abort(self, error):
+        with self._lock:
+            self._aborted = self._aborted or error
+
+    def check(self):
+        if self._aborted is None and self.deadline is not None and self.clock() > self.deadline:
+            self._abort(TimeLimitExceeded)
+        if self._aborted is not None:
+            raise self._aborted()
+
+    def progress_hook(self, d):
+        if d['status'] in ('downloading', 'finished') and self.max_bytes:
+            expected = max(
+                d.get('downloaded_bytes') or 0,
+                d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+            )
+            with self._lock:
+                self._sizes[d.get('tmpfilename') or d.get('filename')] = expected
+                total = sum(self._sizes.values())
+            if total > self.max_bytes:
+                self._abort(SizeLimitExceeded)
+        self.check()
+
+    def match_filter(self, info, incomplete=False):
+        self.check()
+        if self.max_duration and (info.get('duration') or 0) > self.max_duration:
+            raise DurationLimitExceeded()
+        return None
+
+
+def budgeted(ydl_class):
+    """Returns a subclass of `ydl_class` that enforces the JobBudget in its `job_budget` param, if any."""
+
+    class BudgetedYoutubeDL(ydl_class):
+
+        def __init__(self, params=None, auto_init=True):
+            super().__init__(params, auto_init)
+            budget = self.params.get('job_budget')
+            if budget is not None:
+                self.add_progress_hook(budget.progress_hook)
+                self.params.setdefault('match_filter', budget.match_filter)
+
+        def urlopen(self, req):
+            budget = self.params.get('job_budget')
+            if budget is not None:
+                budget.check()
+            return super().urlopen(req)
+
+    return BudgetedYoutubeDL
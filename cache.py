@@ -0,0 +1,317 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Index of the download cache, kept next to its entries
+INDEX_FILE = '.index.db'
+# Entry folders younger than this may still be being filled by another process
+LOAD_GRACE = 60
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtu.be')
+VIDEO_ID_RE = re.compile(r'^[0-9A-Za-z_-]{11}$')
+
+
+def canonical_key(url):
+    """Returns a cache key that is the same for every spelling of one video or playlist."""
+    url = url.strip()
+    parts = urlsplit(url if '://' in url else 'https://' + url)
+    host = parts.netloc.lower()
+    query = parse_qs(parts.query)
+
+    if host in YOUTUBE_HOSTS:
+        path = parts.path.rstrip('/')
+        if host == 'youtu.be' and VIDEO_ID_RE.match(path.lstrip('/')):
+            return 'youtube:' + path.lstrip('/')
+        for prefix in ('/shorts/', '/live/', '/embed/'):
+            if path.startswith(prefix) and VIDEO_ID_RE.match(path[len(prefix):]):
+                return 'youtube:' + path[len(prefix):]
+        if path == '/watch' and VIDEO_ID_RE.match(query.get('v', [''])[0]):
+            # A watch URL inside a playlist extracts as the playlist, so keep the list id
+            if query.get('list'):
+                return f"youtube:{query['v'][0]}:playlist:{query['list'][0]}"
+            return 'youtube:' + query['v'][0]
+        if path == '/playlist' and query.get('list'):
+            return 'youtube:playlist:' + query['list'][0]
+
+    return urlunsplit((parts.scheme.lower(), host, parts.path, parts.query, ''))
+
+
+class MetadataCache:
+    """Thread-safe LRU cache of JSON-serialisable values with a TTL.
+
+    Bounded both by entry count and by the approximate size of the stored
+    values. When `path` is given the cache can be saved to and loaded from
+    that file so warm entries survive restarts.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024, ttl=900, path=None, clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self.clock():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, ttl=None):
+        size = len(json.dumps(value, separators=(',', ':'), default=str))
+        if size > self.max_bytes:
+            return
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        now = self.clock()
+        with self._lock:
+            data = [[key, expires_at, value] for key, (expires_at, _, value) in self._entries.items() if expires_at > now]
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning('Could not save cache to %s: %s', self.path, e)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Could not load cache from %s: %s', self.path, e)
+            return
+        now = self.clock()
+        for key, expires_at, value in data:
+            if expires_at > now:
+                self.put(key, value, ttl=expires_at - now)
+
+
+class DownloadCache:
+    """Size-bounded LRU store of finished downloads, addressed by what produced them.
+
+    Each entry lives in `<folder>/<key>/<filename>`. Callers `acquire` an entry
+    before handing its path out and `release` it when done; entries with
+    outstanding references are never evicted.
+
+    The index, reference counts and LRU order live in a SQLite database in
+    the folder, so server processes sharing a task store also share one
+    cache. With `shared` False, `load` drops references left by an earlier
+    run, whose tasks are gone; with a shared task store they belong to
+    tasks that outlive any one process and are kept.
+    """
+
+    def __init__(self, folder, max_bytes=5 * 1024 ** 3, shared=False):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+        with self._transaction() as (db, _):
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    refs INTEGER NOT NULL,
+                    used REAL NOT NULL
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_lru ON entries (refs, used)')
+
+    @staticmethod
+    def key_for(video_key, format_selector, postprocessors=None):
+        spec = json.dumps([video_key, format_selector, postprocessors or []], sort_keys=True)
+        return hashlib.sha256(spec.encode('utf-8')).hexdigest()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.folder, INDEX_FILE), timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA busy_timeout=30000')
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Runs the block as one write transaction.
+
+        Yields the connection and a list the block fills with entry folders
+        to delete; they are deleted once the transaction has committed.
+        """
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        doomed = []
+        try:
+            yield db, doomed
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        for folder in doomed:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def load(self):
+        """Indexes entries on disk the index does not know and forgets those whose file is gone.
+
+        Folders younger than LOAD_GRACE are left alone, since another
+        process may be moving a file into one.
+        """
+        now = time.time()
+        with self._transaction() as (db, doomed):
+            known = dict(db.execute('SELECT key, path FROM entries'))
+            for key, path in known.items():
+                if not os.path.exists(path):
+                    db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            for entry in os.scandir(self.folder):
+                if not entry.is_dir() or entry.name in known or now - entry.stat().st_mtime < LOAD_GRACE:
+                    continue
+                files = [f for f in os.scandir(entry.path) if f.is_file() and not f.name.startswith('.')]
+                if len(files) != 1:
+                    doomed.append(entry.path)
+                    continue
+                stat = files[0].stat()
+                db.execute('INSERT INTO entries (key, path, size, refs, used) VALUES (?, ?, ?, 0, ?)',
+                           (entry.name, files[0].path, stat.st_size, stat.st_mtime))
+            if not self.shared:
+                db.execute('UPDATE entries SET refs = 0')
+            self._evict(db, doomed)
+
+    def acquire(self, key):
+        with self._transaction() as (db, doomed):
+            row = db.execute('SELECT path FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or not os.path.exists(row[0]):
+                if row is not None:
+                    db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    doomed.append(os.path.dirname(row[0]))
+                self.misses += 1
+                return None
+            db.execute('UPDATE entries SET refs = refs + 1, used = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def add(self, key, src_path):
+        """Moves `src_path` into the cache and returns its new, acquired path."""
+        entry_dir = os.path.join(self.folder, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, os.path.basename(src_path))
+        shutil.move(src_path, path)
+        size = os.path.getsize(path)
+        with self._transaction() as (db, doomed):
+            row = db.execute('SELECT path, refs FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                db.execute('INSERT INTO entries (key, path, size, refs, used) VALUES (?, ?, ?, 1, ?)',
+                           (key, path, size, time.time()))
+            else:
+                old_path, refs = row
+                # Readers of the old file keep it until the entry is evicted
+                if old_path != path and not refs and os.path.exists(old_path):
+                    os.remove(old_path)
+                db.execute('UPDATE entries SET path = ?, size = ?, refs = refs + 1, used = ? WHERE key = ?',
+                           (path, size, time.time(), key))
+            self._evict(db, doomed)
+        return path
+
+    def release(self, key):
+        with self._transaction() as (db, doomed):
+            db.execute('UPDATE entries SET refs = refs - 1 WHERE key = ? AND refs > 0', (key,))
+            self._evict(db, doomed)
+
+    def _evict(self, db, doomed):
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in db.execute(
+                'SELECT key, path, size FROM entries WHERE refs = 0 ORDER BY used').fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            doomed.append(os.path.dirname(path))
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        entries, total, in_use = self._db().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refs > 0), 0) FROM entries'
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': total,
+            'in_use': in_use,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,100 +1,83 @@
 # downloads.py
+import functools
+import mimetypes
 import os
-import shutil
-import tempfile
-from flask import Blueprint, request, jsonify, send_file
-from yt_dlp import YoutubeDL
+import threading
+from flask import Blueprint, Response, request, jsonify
+
+from admission import download_limiter, client_id, rate_limited
+from engine import STREAM_FORMATS, LiveDownload, stream_ydl_opts
 
 downloads_bp = Blueprint('downloads', __name__)
 
-# This will be set by the main app
-DOWNLOAD_FOLDER = None
-YDL_OPTS_BASE = {
-    'quiet': True,
-    'no_warnings': True,
-}
+# Each streamed download runs on its own thread next to the request's, so
+# their number is capped; past it, clients get 503 and can queue the
+# download through /download instead
+MAX_STREAMS = int(os.environ.get('YTD_MAX_STREAMS', 8))
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+# ...and one client holds at most MAX_STREAMS_PER_CLIENT of them
+MAX_STREAMS_PER_CLIENT = int(os.environ.get('YTD_MAX_STREAMS_PER_CLIENT', 2))
+client_streams = {}
+client_streams_lock = threading.Lock()
+
+
+def take_stream_slot(client):
+    """Reserves a stream slot for `client`; returns an error response if none is free, else None."""
+    with client_streams_lock:
+        if client_streams.get(client, 0) >= MAX_STREAMS_PER_CLIENT:
+            return jsonify({'error': 'Too many requests. Please try again later.'}), 429, {'Retry-After': '5'}
+        if not stream_slots.acquire(blocking=False):
+            return jsonify({'error': 'too many streamed downloads'}), 503, {'Retry-After': '5'}
+        client_streams[client] = client_streams.get(client, 0) + 1
+    return None
+
 
-@downloads_bp.route('/download', methods=['POST'])
-def download():
+def release_stream_slot(client):
+    with client_streams_lock:
+        client_streams[client] -= 1
+        if not client_streams[client]:
+            del client_streams[client]
+    stream_slots.release()
+
+
+@downloads_bp.route('/download/stream', methods=['POST'])
+def download_stream():
+    """Downloads a video or its audio and sends it to the client while it downloads."""
+    limited = rate_limited(download_limiter)
+    if limited:
+        return limited
     data = request.get_json() or {}
     url = data.get('url')
-    mode = data.get('mode', 'video')  # 'video', 'audio', or 'playlist'
+    mode = data.get('mode', 'video')  # 'video' or 'audio'
     format_id = data.get('format_id')
 
     if not url:
         return jsonify({'error': 'missing url'}), 400
-
-    tmpdir = tempfile.mkdtemp(dir=DOWNLOAD_FOLDER)
+    if mode not in STREAM_FORMATS:
+        return jsonify({'error': 'only video and audio can be streamed; use /download for playlists'}), 400
+    if format_id and '+' in format_id:
+        return jsonify({'error': 'merged formats cannot be streamed; use /download'}), 400
+    client = client_id()
+    refused = take_stream_slot(client)
+    if refused:
+        return refused
+    release = functools.partial(release_stream_slot, client)
 
     try:
-        if mode == 'playlist':
-            outtmpl = os.path.join(tmpdir, '%(playlist_index)03d - %(title)s.%(ext)s')
-            ydl_opts = {
-                **YDL_OPTS_BASE,
-                'outtmpl': outtmpl,
-                'ignoreerrors': True,
-            }
-            submode = data.get('submode', 'video')  # 'video' or 'audio'
-            if submode == 'audio':
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                })
-            else:
-                ydl_opts.update({
-                    'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best',
-                    'merge_output_format': 'mp4',
-                })
-
-            with YoutubeDL(ydl_opts) as ydl:
-                ydl.extract_info(url, download=True)
-
-            zip_path = shutil.make_archive(tmpdir, 'zip', tmpdir)
-            return send_file(zip_path, as_attachment=True, download_name=os.path.basename(zip_path))
-
-        else:
-            outtmpl = os.path.join(tmpdir, '%(id)s.%(ext)s')
-            if mode == 'audio':
-                ydl_opts = {
-                    **YDL_OPTS_BASE,
-                    'format': 'bestaudio/best',
-                    'outtmpl': outtmpl,
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'noplaylist': True,
-                }
-            else:
-                ydl_opts = {
-                    **YDL_OPTS_BASE,
-                    'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best',
-                    'outtmpl': outtmpl,
-                    'merge_output_format': 'mp4',
-                    'noplaylist': True,
-                }
-                if format_id:
-                    ydl_opts['format'] = format_id
-
-            with YoutubeDL(ydl_opts) as ydl:
-                ydl.extract_info(url, download=True)
-
-            produced_files = [f for f in os.listdir(tmpdir) if not f.startswith('.')]
-            if not produced_files:
-                return jsonify({'error': 'no file produced'}), 500
-
-            outfile = os.path.join(tmpdir, produced_files[0])
-            return send_file(outfile, as_attachment=True, download_name=os.path.basename(outfile))
+        download = LiveDownload(url, mode, stream_ydl_opts(mode, format_id))
+    except Exception:
+        release()
+        raise
+    path = download.wait_started()
+    if path is None:
+        download.close()
+        release()
+        return jsonify({'error': download.message}), 400
 
-    except Exception as e:
-        return jsonify({'error': 'download failed: ' + str(e)}), 500
-    finally:
-        try:
-            shutil.rmtree(tmpdir)
-        except Exception:
-            pass
+    name = os.path.basename(path)
+    response = Response(download.chunks(), mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename="{name}"'})
+    # Closing the response before the end cancels the download
+    response.call_on_close(download.close)
+    response.call_on_close(release)
+    return response
@@ -0,0 +1,418 @@
+"""The extraction and download engine behind every route.
+
+yt-dlp options, the governed and pooled YoutubeDL, the /info caches and
+payloads, error reporting, stage metrics and per-mode job limits live here,
+so the /info routes, the download queue in app.py and the streaming
+download in downloads.py all extract and download the same way.
+"""
+import atexit
+import copy
+import itertools
+import logging
+import os
+import shutil
+import threading
+import time
+
+from yt_dlp import YoutubeDL as BaseYoutubeDL
+from yt_dlp.utils import PagedList
+
+from budget import JobBudget, Cancelled, budgeted
+from cache import MetadataCache, canonical_key
+from formats import rank_formats, download_selector
+from governor import OutboundGovernor, governed
+from metrics import Registry
+from reaper import make_job_dir
+from stages import StageTimings, deferring
+from workers import default_worker_count
+from ydl_pool import SharedSession, YoutubeDLPool, sharing
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DOWNLOAD_FOLDER = os.path.join(os.path.expanduser('~'), 'Downloads', 'YouTube Downloader')
+os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+# Only job directories are ever reaped, never other files in the folder
+JOB_DIR_PREFIX = 'tmp'
+
+# Default options shared across operations
+YDL_OPTS_BASE = {
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    'ffmpeg_location': os.path.join(BASE_DIR, 'bin'),
+}
+COOKIES_FILE = os.path.join(BASE_DIR, 'cookies.txt')
+if os.path.exists(COOKIES_FILE):
+    YDL_OPTS_BASE['cookiefile'] = COOKIES_FILE
+
+VIDEO_FORMAT = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best'
+SINGLE_OUTTMPL = '%(id)s.%(ext)s'
+# Playlist entries are named after their title, behind their playlist index
+ENTRY_OUTTMPL = '%(title)s.%(ext)s'
+
+# Audio outputs: 'original' keeps the site's audio stream, at most copied
+# into a plain audio container; 'm4a' picks the AAC stream and copies it into
+# .m4a (only a video without one is transcoded); 'mp3' always transcodes
+AUDIO_OUTPUTS = {
+    'original': {
+        'format': 'bestaudio/best',
+        'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}],
+    },
+    'm4a': {
+        'format': 'bestaudio[ext=m4a]/bestaudio/best',
+        'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a'}],
+    },
+    'mp3': {
+        'format': 'bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+    },
+}
+DEFAULT_AUDIO_OUTPUT = 'mp3'
+
+# Streamed downloads are sent while they download, so they take a single
+# file that needs no merging, conversion or fixing up afterwards
+STREAM_FORMATS = {
+    'video': 'best[ext=mp4]/best',
+    'audio': 'bestaudio[ext=m4a]/bestaudio',
+}
+STREAM_CHUNK_SIZE = 256 * 1024
+# How long a reader waits for more data before looking again by itself
+STREAM_POLL = 1
+
+# Stage timings for /stats, and Prometheus metrics at /metrics. Histograms
+# and counters are updated where the work happens; the remaining metrics are
+# read from existing stats when scraped (see the end of app.py)
+stage_timings = StageTimings()
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    'ytd_stage_seconds', 'Time spent in each stage of info lookups and download jobs.', ('stage',))
+errors_total = metrics.counter('ytd_errors_total', 'Failed info lookups and jobs by error category.', ('category',))
+
+# Every YoutubeDL shares one governor: a cap on outbound requests per second
+# and on total download bandwidth, and a common backoff after HTTP 429
+outbound = OutboundGovernor(
+    rate=float(os.environ.get('YTD_OUTBOUND_RATE', 20)),
+    bandwidth=int(os.environ.get('YTD_OUTBOUND_BANDWIDTH', 0)),
+    backoff_base=float(os.environ.get('YTD_BACKOFF_BASE', 5)),
+    backoff_max=float(os.environ.get('YTD_BACKOFF_MAX', 300)),
+)
+# Every YoutubeDL also shares one cookie jar and one set of HTTP connections
+ydl_session = SharedSession()
+atexit.register(ydl_session.close)
+YoutubeDL = governed(budgeted(deferring(sharing(BaseYoutubeDL, ydl_session))), outbound)
+
+# Extraction-only YoutubeDL instances are reused between lookups
+INFO_WORKERS = int(os.environ.get('YTD_INFO_WORKERS', 0)) or default_worker_count()
+ydl_pool = YoutubeDLPool(lambda params: YoutubeDL(params), max_idle=INFO_WORKERS)
+atexit.register(ydl_pool.clear)
+
+# Playlist /info responses are paged; only the requested page is read
+PLAYLIST_PAGE_SIZE = int(os.environ.get('YTD_PLAYLIST_PAGE_SIZE', 10))
+MAX_URL_REDIRECTS = 5
+
+# Trimmed /info payloads keyed by canonical URL / video id
+info_cache = MetadataCache(
+    max_entries=int(os.environ.get('YTD_INFO_CACHE_SIZE', 512)),
+    max_bytes=int(os.environ.get('YTD_INFO_CACHE_BYTES', 32 * 1024 * 1024)),
+    ttl=int(os.environ.get('YTD_INFO_CACHE_TTL', 900)),
+    path=os.environ.get('YTD_INFO_CACHE_FILE'),
+)
+info_cache.load()
+atexit.register(info_cache.save)
+
+# Full extraction results from /info, reused by downloads of the same URL
+# while the stream URLs inside them are still fresh
+extraction_cache = MetadataCache(
+    max_entries=int(os.environ.get('YTD_EXTRACTION_CACHE_SIZE', 64)),
+    max_bytes=int(os.environ.get('YTD_EXTRACTION_CACHE_BYTES', 64 * 1024 * 1024)),
+    ttl=int(os.environ.get('YTD_EXTRACTION_TTL', 300)),
+)
+
+# Per-mode limits on a job's wall time (seconds), downloaded bytes, and
+# video duration (seconds; for playlists, per entry). A job over a limit is
+# aborted and its files removed. 0 disables a limit.
+def job_limits(mode, seconds, nbytes, duration):
+    prefix = f'YTD_{mode.upper()}_'
+    return {
+        'max_seconds': int(os.environ.get(prefix + 'MAX_SECONDS', seconds)),
+        'max_bytes': int(os.environ.get(prefix + 'MAX_BYTES', nbytes)),
+        'max_duration': int(os.environ.get(prefix + 'MAX_DURATION', duration)),
+    }
+
+JOB_LIMITS = {
+    'video': job_limits('video', 3600, 8 * 1024 ** 3, 4 * 3600),
+    'audio': job_limits('audio', 1800, 1024 ** 3, 4 * 3600),
+    'playlist': job_limits('playlist', 6 * 3600, 32 * 1024 ** 3, 4 * 3600),
+}
+
+# (text in a yt-dlp error, category, message shown to the user), checked in order
+ERROR_CATEGORIES = [
+    ('Private video', 'private', 'This is a private video.'),
+    ('Video unavailable', 'unavailable', 'This video is unavailable.'),
+    ('removed for violating', 'removed', 'This video was removed.'),
+    ('not available in your country', 'geo_blocked', 'This video is not available in your country.'),
+    ('age-restricted', 'age_restricted', 'This video is age-restricted.'),
+    ('Login required', 'login_required', 'This video requires login.'),
+    ('payment to watch', 'paid', 'This is a paid video.'),
+    ('Premiere', 'premiere', 'This video is a premiere.'),
+    ('Live event', 'live', 'This is a live event.'),
+    ('HTTP Error 404', 'not_found', 'Video not found.'),
+    ('HTTP Error 403', 'forbidden', 'Access denied to video.'),
+    ('HTTP Error 429', 'rate_limited', 'Too many requests. Please try again later.'),
+    ('no file produced', 'no_file', 'Download failed.'),
+    (Cancelled.msg, 'cancelled', 'The download was cancelled.'),
+    ('Job time limit exceeded', 'time_limit', 'The download took too long.'),
+    ('Job size limit exceeded', 'size_limit', 'The download is too large.'),
+    ('Video duration limit exceeded', 'too_long', 'This video is too long.'),
+]
+OTHER_ERROR = ('other', 'An error occurred while processing your request.')
+
+def classify_error(error_str):
+    """Returns the (category, message) pair for a yt-dlp error string."""
+    for needle, category, message in ERROR_CATEGORIES:
+        if needle in error_str:
+            return category, message
+    return OTHER_ERROR
+
+def get_simple_error(error_str):
+    """Parses a yt-dlp error string and returns a simplified version."""
+    return classify_error(error_str)[1]
+
+def failure_message(error):
+    """Counts a failed request or job by category and returns the message for the user."""
+    category, message = classify_error(str(error))
+    errors_total.inc(category)
+    return message
+
+
+def record_stage(stage, started, task=None):
+    """Adds the time since `started` to the stage totals and, if given, to the task's timings."""
+    elapsed = stage_timings.record(stage, started)
+    stage_seconds.observe(elapsed, stage)
+    if task is not None:
+        task.setdefault('timings', {})[stage] = round(elapsed, 3)
+
+
+def audio_ydl_opts(audio_format):
+    output = AUDIO_OUTPUTS[audio_format]
+    return {'format': output['format'], 'postprocessors': copy.deepcopy(output['postprocessors'])}
+
+
+def output_opts(mode, format_id=None, audio_format=DEFAULT_AUDIO_OUTPUT):
+    """Format selection and post-processing options for a video or audio download."""
+    if mode == 'audio':
+        return audio_ydl_opts(audio_format)
+    return {
+        'format': download_selector(format_id) if format_id else VIDEO_FORMAT,
+        'merge_output_format': 'mp4',
+    }
+
+
+def stream_ydl_opts(mode, format_id=None):
+    """Options for a streamed download; `format_id` must name a single format."""
+    return {
+        **YDL_OPTS_BASE,
+        'format': format_id or STREAM_FORMATS[mode],
+        'noplaylist': True,
+        'fixup': 'never',  # The bytes are already on their way to the client
+    }
+
+
+def info_cache_key(key, page):
+    return key if not page else f'{key}#page={page}'
+
+def extract_info_payload(url, key, page=0):
+    """Extracts `url`, caching both the full extraction and the trimmed /info payload.
+
+    Playlists are not resolved: only the entries of the requested page are
+    read from the lazily paged entry list.
+    """
+    started = time.monotonic()
+    params = {**YDL_OPTS_BASE, 'skip_download': True}
+    with ydl_pool.instance('info', params) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        for _ in range(MAX_URL_REDIRECTS):
+            if info.get('_type') != 'url':
+                break
+            info = ydl.extract_info(info['url'], download=False, ie_key=info.get('ie_key'), process=False)
+        if 'entries' in info:
+            payload = build_playlist_payload(info, page)
+        else:
+            info = ydl.process_ie_result(info, download=False)
+            extraction_cache.put(key, ydl.sanitize_info(info, remove_private_keys=True))
+            payload = build_info_payload(info)
+    record_stage('extract', started)
+    info_cache.put(info_cache_key(key, page), payload)
+    return payload
+
+def build_playlist_payload(info, page=0):
+    """One page of a playlist, read from its entries without resolving the rest."""
+    entries = info.get('entries') or []
+    start = page * PLAYLIST_PAGE_SIZE
+    # Read one entry past the page to learn whether another page follows
+    if isinstance(entries, PagedList):
+        items = entries.getslice(start, start + PLAYLIST_PAGE_SIZE + 1)
+    else:
+        items = list(itertools.islice(entries, start, start + PLAYLIST_PAGE_SIZE + 1))
+    has_more = len(items) > PLAYLIST_PAGE_SIZE
+
+    total = info.get('playlist_count')
+    if total is None and isinstance(entries, list):
+        total = len(entries)
+    if total is None and not has_more:
+        total = start + len(items)
+
+    return {
+        'type': 'playlist',
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'uploader': info.get('uploader'),
+        'thumbnail': info.get('thumbnail') or last_thumbnail(info),
+        'total_videos': total,
+        'page': page,
+        'next_page': page + 1 if has_more else None,
+        'entries': [
+            {
+                'id': e.get('id'),
+                'title': e.get('title'),
+                'duration': e.get('duration'),
+                'thumbnail': e.get('thumbnail') or last_thumbnail(e),
+            }
+            for e in items[:PLAYLIST_PAGE_SIZE] if e
+        ],
+    }
+
+def last_thumbnail(info):
+    thumbnails = info.get('thumbnails') or []
+    return thumbnails[-1].get('url') if thumbnails else None
+
+def build_info_payload(info):
+    return {
+        'type': 'video',
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'uploader': info.get('uploader'),
+        'thumbnail': info.get('thumbnail'),
+        'duration': info.get('duration'),
+        'formats': rank_formats(info),
+    }
+
+
+def extract_and_download(ydl, url):
+    """Downloads `url`, reusing a fresh /info extraction instead of extracting again."""
+    info = extraction_cache.get(canonical_key(url))
+    if info is not None and info.get('_type') != 'playlist':
+        try:
+            return ydl.process_ie_result(copy.deepcopy(info), download=True)
+        except Exception as e:
+            logger.info(f"Cached extraction for {url} could not be used, extracting again: {e}")
+    return ydl.extract_info(url, download=True)
+
+
+def playlist_entries(url):
+    """Returns (playlist_index, entry) pairs without resolving every entry up front."""
+    info = extraction_cache.get(canonical_key(url))
+    if info is None or info.get('_type') != 'playlist':
+        with ydl_pool.instance('flat', {**YDL_OPTS_BASE, 'extract_flat': 'in_playlist'}) as ydl:
+            # Not sanitize_info: removing private keys would also drop 'entries'
+            info = ydl.extract_info(url, download=False)
+    return [
+        (e.get('playlist_index') or i, e)
+        for i, e in enumerate(info.get('entries') or [], 1)
+        if e
+    ]
+
+
+# Job folders of streamed downloads still in progress; this process's reaper
+# leaves them alone, and other processes sharing the folder see their owner marker
+live_folders = set()
+
+
+class LiveDownload:
+    """A download on its own thread whose file is read while it is being written.
+
+    yt-dlp writes straight to the final file (`nopart`), which `chunks`
+    follows until the download has finished. Closing the reader before then
+    cancels the download; either way the job folder is removed at the end.
+    """
+
+    def __init__(self, url, mode, params):
+        self.url = url
+        self.folder = make_job_dir(DOWNLOAD_FOLDER, JOB_DIR_PREFIX)
+        live_folders.add(self.folder)
+        self.budget = JobBudget(**JOB_LIMITS[mode])
+        self.params = {
+            **params,
+            'outtmpl': os.path.join(self.folder, SINGLE_OUTTMPL),
+            'nopart': True,
+            'job_budget': self.budget,
+            'progress_hooks': [self._progress],
+        }
+        self.path = None
+        self.done = False
+        self.error = None
+        self.message = None
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='live-download', daemon=True)
+        self._thread.start()
+
+    def _progress(self, d):
+        with self._changed:
+            if self.path is None and d.get('filename'):
+                self.path = d['filename']
+            self._changed.notify_all()
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            with YoutubeDL(self.params) as ydl:
+                extract_and_download(ydl, self.url)
+            record_stage('stream', started)
+            if self.path is None:
+                raise Exception('no file produced')
+        except Exception as e:
+            self.error = e
+            self.message = failure_message(e)
+        finally:
+            with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    def wait_started(self):
+        """Blocks until data is being written or the download failed; returns the file path or None."""
+        with self._changed:
+            self._changed.wait_for(lambda: (self.path is not None and os.path.exists(self.path)) or self.done)
+        return self.path if self.error is None else None
+
+    def chunks(self, size=STREAM_CHUNK_SIZE):
+        """Yields the file as it is written; raises the download's error if it fails midway."""
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    finished = self.done
+                    data = f.read(size)
+                    if data:
+                        yield data
+                    elif finished:
+                        break
+                    else:
+                        with self._changed:
+                            if not self.done:
+                                self._changed.wait(STREAM_POLL)
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the download if it is still running and removes its folder."""
+        if not self.done:
+            self.budget.cancel()
+        self._thread.join()
+        shutil.rmtree(self.folder, ignore_errors=True)
+        live_folders.discard(self.folder)
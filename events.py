@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+
+class TaskEvents:
+    """Change notifications for tasks.
+
+    Every `notify(task_id)` bumps that task's version and wakes only the
+    listeners waiting on that task, so idle listeners cost nothing until
+    their own task changes. Listeners on an asyncio event loop use
+    `wait_async`, which holds no thread while it waits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._conditions = {}
+        self._waiters = {}
+        self._watchers = {}  # task_id -> {(loop, future)} of wait_async callers
+
+    def version(self, task_id):
+        with self._lock:
+            return self._versions.get(task_id, 0)
+
+    def notify(self, task_id):
+        with self._lock:
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            cond = self._conditions.get(task_id)
+            if cond is not None:
+                cond.notify_all()
+            self._wake_watchers(task_id)
+
+    def wait(self, task_id, seen, timeout=None):
+        """Blocks until the task's version differs from `seen`; returns the current version."""
+        with self._lock:
+            if self._versions.get(task_id, 0) == seen:
+                cond = self._conditions.get(task_id)
+                if cond is None:
+                    cond = self._conditions[task_id] = threading.Condition(self._lock)
+                self._waiters[task_id] = self._waiters.get(task_id, 0) + 1
+                try:
+                    cond.wait_for(lambda: self._versions.get(task_id, 0) != seen, timeout)
+                finally:
+                    self._waiters[task_id] -= 1
+                    if not self._waiters[task_id]:
+                        del self._waiters[task_id]
+                        del self._conditions[task_id]
+            return self._versions.get(task_id, 0)
+
+    async def wait_async(self, task_id, seen, timeout=None):
+        """Awaits a change of the task's version from `seen`; returns the current version."""
+        loop = asyncio.get_running_loop()
+        watcher = (loop, loop.create_future())
+        with self._lock:
+            if self._versions.get(task_id, 0) != seen:
+                return self._versions.get(task_id, 0)
+            self._watchers.setdefault(task_id, set()).add(watcher)
+        try:
+            await asyncio.wait([watcher[1]], timeout=timeout)
+        finally:
+            with self._lock:
+                watchers = self._watchers.get(task_id)
+                if watchers is not None:
+                    watchers.discard(watcher)
+                    if not watchers:
+                        del self._watchers[task_id]
+        return self.version(task_id)
+
+    def _wake_watchers(self, task_id):
+        for loop, future in self._watchers.get(task_id, ()):
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # Its event loop is closed
+
+    def forget(self, task_id):
+        with self._lock:
+            self._versions.pop(task_id, None)
+            cond = self._conditions.get(task_id)
+            if cond is not None:
+                cond.notify_all()
+            self._wake_watchers(task_id)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
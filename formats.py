@@ -0,0 +1,146 @@
+# Codec families, best first when two options share a resolution: avc1 plays
+# everywhere and merges with m4a audio into mp4 without re-muxing
+VIDEO_CODECS = ('avc1', 'vp9', 'av01', 'hevc')
+AUDIO_CODECS = ('mp4a', 'opus', 'vorbis', 'mp3')
+CODEC_ALIASES = {'h264': 'avc1', 'avc': 'avc1', 'vp09': 'vp9', 'hvc1': 'hevc', 'hev1': 'hevc', 'h265': 'hevc'}
+# Audio that merges into the same container as the video without re-encoding
+AUDIO_FOR_VIDEO_EXT = {'mp4': 'm4a', 'webm': 'webm'}
+
+
+def codec_family(codec):
+    """'avc1.640028' -> 'avc1'; None for missing or 'none' codecs."""
+    if not codec or codec == 'none':
+        return None
+    family = codec.split('.')[0].lower()
+    return CODEC_ALIASES.get(family, family)
+
+
+def has_video(f):
+    return f.get('vcodec') != 'none'
+
+
+def has_audio(f):
+    return f.get('acodec') != 'none'
+
+
+def usable(f):
+    """False for storyboards, DRM-protected streams and formats without any media."""
+    if f.get('has_drm') or f.get('ext') == 'mhtml' or f.get('format_note') == 'storyboard':
+        return False
+    return has_video(f) or has_audio(f)
+
+
+def estimate_size(f, duration):
+    """Size in bytes from the format's metadata, or from its bitrate and the video duration."""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if not size and duration and f.get('tbr'):
+        size = int(f['tbr'] * 1000 / 8 * duration)
+    return size or None
+
+
+def _preference(value, order):
+    return order.index(value) if value in order else len(order)
+
+
+def _best(formats, key):
+    best = {}
+    for f in formats:
+        group = key(f)
+        current = best.get(group)
+        if current is None or _quality(f) > _quality(current):
+            best[group] = f
+    return best
+
+
+def _quality(f):
+    return (f.get('fps') or 0, f.get('tbr') or f.get('abr') or 0, f.get('filesize') or f.get('filesize_approx') or 0)
+
+
+def _audio_for(video, audio_by_ext, best_audio):
+    return audio_by_ext.get(AUDIO_FOR_VIDEO_EXT.get(video.get('ext'))) or best_audio
+
+
+def rank_formats(info):
+    """Returns the usable download options of `info`, best first.
+
+    Video formats are grouped by height and codec family, keeping the best
+    of each group. Video-only formats are paired with the audio stream that
+    merges into the same container, and every option carries the yt-dlp
+    selector that downloads it plus its estimated total size. The best audio
+    stream of each codec follows as audio-only options.
+    """
+    duration = info.get('duration')
+    formats = [f for f in info.get('formats') or [] if usable(f)]
+    audio = [f for f in formats if has_audio(f) and not has_video(f)]
+    video = [f for f in formats if has_video(f)]
+
+    best_audio = max(audio, key=_quality) if audio else None
+    audio_by_ext = {}
+    for f in sorted(audio, key=_quality):
+        audio_by_ext[f.get('ext')] = f
+
+    options = []
+    groups = _best(video, lambda f: (f.get('height'), codec_family(f.get('vcodec'))))
+    for f in groups.values():
+        size = estimate_size(f, duration)
+        selector = f['format_id']
+        acodec = codec_family(f.get('acodec'))
+        ext = f.get('ext')
+        if not has_audio(f) and best_audio is not None:
+            paired = _audio_for(f, audio_by_ext, best_audio)
+            selector = f"{f['format_id']}+{paired['format_id']}"
+            audio_size = estimate_size(paired, duration)
+            size = size + audio_size if size and audio_size else None
+            acodec = codec_family(paired.get('acodec'))
+            ext = 'mp4'  # video downloads merge into mp4
+        options.append({
+            'kind': 'video',
+            'selector': selector,
+            'label': _video_label(f),
+            'height': f.get('height'),
+            'fps': f.get('fps'),
+            'vcodec': codec_family(f.get('vcodec')),
+            'acodec': acodec,
+            'ext': ext,
+            'filesize': size,
+        })
+    options.sort(key=lambda o: (
+        -(o['height'] or 0), -(o['fps'] or 0),
+        _preference(o['vcodec'], VIDEO_CODECS), o['filesize'] or 0,
+    ))
+
+    audio_options = []
+    for family, f in _best(audio, lambda f: codec_family(f.get('acodec'))).items():
+        audio_options.append({
+            'kind': 'audio',
+            'selector': f['format_id'],
+            'label': f"{round(f['abr'])}k {f.get('ext')}" if f.get('abr') else f.get('ext'),
+            'abr': f.get('abr'),
+            'acodec': family,
+            'ext': f.get('ext'),
+            'filesize': estimate_size(f, duration),
+        })
+    audio_options.sort(key=lambda o: (-(o['abr'] or 0), _preference(o['acodec'], AUDIO_CODECS)))
+    return options + audio_options
+
+
+def _video_label(f):
+    if not f.get('height'):
+        return f.get('format_note') or f.get('ext') or f['format_id']
+    label = f"{f['height']}p"
+    if f.get('fps') and f['fps'] > 30:
+        label += f"{round(f['fps'])}"
+    family = codec_family(f.get('vcodec'))
+    return f'{label} {family}' if family else label
+
+
+def download_selector(format_id):
+    """yt-dlp selector for a `format_id` sent by a client.
+
+    Selectors from `rank_formats` are used as they are. A bare format id
+    is merged with the best audio, so a video-only format still downloads
+    with sound; yt-dlp drops the extra audio if the format already has one.
+    """
+    if any(c in format_id for c in '+/[]'):
+        return format_id
+    return f'{format_id}+bestaudio[ext=m4a]/{format_id}+bestaudio/{format_id}'
@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+
+from yt_dlp.networking.exceptions import HTTPError
+
+
+class OutboundGovernor:
+    """Shared limits on all outbound traffic to the video site.
+
+    Every HTTP request waits for a slot so that, across all threads, at most
+    `rate` requests start per second (with bursts of up to `burst`), and
+    downloaded bytes are paced to `bandwidth` bytes per second. When the
+    site answers 429, every request waits out an exponential backoff with
+    jitter; the backoff doubles with each consecutive 429 and resets after
+    a successful request. A `rate` or `bandwidth` of 0 means no limit.
+    """
+
+    def __init__(self, rate=0, bandwidth=0, burst=None, backoff_base=5, backoff_max=300,
+                 clock=time.monotonic, sleep=time.sleep, jitter=random.random):
+        self.rate = rate
+        self.bandwidth = bandwidth
+        self.burst = burst or max(1, int(rate))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._next_request = 0.0
+        self._next_byte = 0.0
+        self._backoff_until = 0.0
+        self._streak = 0
+        self._offsets = {}  # download file -> bytes already counted
+        self.requests = 0
+        self.bytes = 0
+        self.throttled_count = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        """Blocks until the next request may start."""
+        with self._lock:
+            now = self.clock()
+            start = max(now, self._backoff_until)
+            if self.rate:
+                interval = 1 / self.rate
+                tat = max(self._next_request, now)
+                start = max(start, tat - (self.burst - 1) * interval)
+                self._next_request = max(tat, start) + interval
+            self.requests += 1
+            wait = start - now
+            self.waited += max(0.0, wait)
+        if wait > 0:
+            self.sleep(wait)
+
+    def consume(self, nbytes):
+        """Accounts for `nbytes` received, blocking the caller while over the bandwidth budget."""
+        with self._lock:
+            self.bytes += nbytes
+            if not self.bandwidth:
+                return
+            now = self.clock()
+            tat = max(self._next_byte, now)
+            self._next_byte = tat + nbytes / self.bandwidth
+            # Up to a second's worth of bytes may arrive ahead of schedule
+            wait = self._next_byte - now - 1
+            self.waited += max(0.0, wait)
+        if wait > 0:
+            self.sleep(wait)
+
+    def throttled(self):
+        """Records a 429 answer and extends the shared backoff; returns its length in seconds."""
+        with self._lock:
+            self._streak += 1
+            self.throttled_count += 1
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self._streak - 1))
+            delay *= 0.5 + self.jitter() / 2
+            self._backoff_until = max(self._backoff_until, self.clock() + delay)
+            return delay
+
+    def succeeded(self):
+        with self._lock:
+            self._streak = 0
+
+    def backoff_remaining(self):
+        with self._lock:
+            return max(0.0, self._backoff_until - self.clock())
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook that feeds downloaded bytes into `consume`."""
+        key = d.get('tmpfilename') or d.get('filename')
+        if d['status'] != 'downloading':
+            with self._lock:
+                self._offsets.pop(key, None)
+            return
+        downloaded = d.get('downloaded_bytes') or 0
+        with self._lock:
+            delta = downloaded - self._offsets.get(key, 0)
+            self._offsets[key] = downloaded
+        if delta > 0:
+            self.consume(delta)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'bandwidth': self.bandwidth,
+                'backoff_remaining': max(0.0, self._backoff_until - self.clock()),
+                'backoff_streak': self._streak,
+                'throttled': self.throttled_count,
+                'requests': self.requests,
+                'bytes': self.bytes,
+                'waited': self.waited,
+            }
+
+
+def is_rate_limited(error):
+    """True if `error` (or its message) is the site's HTTP 429 answer."""
+    return 'HTTP Error 429' in str(error)
+
+
+def governed(ydl_class, governor):
+    """Returns a subclass of `ydl_class` whose HTTP requests and downloads all go through `governor`."""
+
+    class GovernedYoutubeDL(ydl_class):
+
+        def __init__(self, params=None, auto_init=True):
+            super().__init__(params, auto_init)
+            self.add_progress_hook(governor.progress_hook)
+
+        def urlopen(self, req):
+            governor.acquire()
+            try:
+                response = super().urlopen(req)
+            except HTTPError as e:
+                if e.status == 429:
+                    governor.throttled()
+                raise
+            governor.succeeded()
+            return response
+
+    return GovernedYoutubeDL
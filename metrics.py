@@ -0,0 +1,132 @@
+import bisect
+import threading
+
+# Seconds; spans a cache hit (milliseconds) to a long playlist (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, _labels(self.labels, key), value
+
+
+class Histogram:
+    """Distribution of observed values in cumulative `le` buckets, per label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> (per-bucket counts incl. +Inf, [sum, count])
+
+    def observe(self, value, *values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][index] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {key: (list(counts), list(totals)) for key, (counts, totals) in self._series.items()}
+        names = self.labels + ('le',)
+        for key, (counts, (total, count)) in snapshot.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                yield f'{self.name}_bucket', _labels(names, key + (_number(bound),)), cumulative
+            yield f'{self.name}_sum', _labels(self.labels, key), total
+            yield f'{self.name}_count', _labels(self.labels, key), count
+
+
+class Collected:
+    """Metric read from existing state when scraped, so it costs nothing in between.
+
+    `collect()` returns a number, or a dict mapping tuples of label values
+    to numbers.
+    """
+
+    def __init__(self, name, help, collect, labels=(), kind='gauge'):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield self.name, _labels(self.labels, key), value
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name, help, collect, labels=(), kind='gauge'):
+        return self.register(Collected(name, help, collect, labels, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,45 @@
+MIB = 1024 * 1024
+
+# What each kind of download may use at most. Audio streams are small, so a
+# couple of parallel fragments already saturate them; video may fetch more
+# fragments at once, while playlist entries, which already run several at a
+# time, get fewer. Progressive downloads are fetched in 10 MiB ranges, which
+# keeps YouTube from throttling long single-range transfers.
+PROFILES = {
+    'audio': {'fragments': 2, 'chunk_size': None, 'buffer_size': 64 * 1024, 'retries': 10},
+    'video': {'fragments': 8, 'chunk_size': 10 * MIB, 'buffer_size': 256 * 1024, 'retries': 10},
+    'playlist_entry': {'fragments': 4, 'chunk_size': 10 * MIB, 'buffer_size': 256 * 1024, 'retries': 5},
+}
+MAX_RETRY_SLEEP = 30
+
+
+def retry_sleep(attempt):
+    """Seconds to wait before retry `attempt` (0-based): 1, 2, 4, ... up to MAX_RETRY_SLEEP."""
+    return min(MAX_RETRY_SLEEP, 2 ** attempt)
+
+
+def fragment_share(fragment_slots, concurrent_jobs, request_rate=0):
+    """Parallel fragments each job may use so that all jobs together stay within `fragment_slots`.
+
+    A fragment request takes about a second or more, so with every request
+    capped at `request_rate` per second, fragments in flight beyond that
+    number would only queue in the outbound governor.
+    """
+    if request_rate:
+        fragment_slots = min(fragment_slots, max(1, int(request_rate)))
+    return max(1, fragment_slots // max(1, concurrent_jobs))
+
+
+def transfer_opts(kind, share, profiles=PROFILES):
+    """yt-dlp options for a download of `kind`, using at most `share` parallel fragments."""
+    profile = profiles[kind]
+    opts = {
+        'concurrent_fragment_downloads': max(1, min(profile['fragments'], share)),
+        'buffersize': profile['buffer_size'],
+        'retries': profile['retries'],
+        'fragment_retries': profile['retries'],
+        'retry_sleep_functions': {'http': retry_sleep, 'fragment': retry_sleep},
+    }
+    if profile['chunk_size']:
+        opts['http_chunk_size'] = profile['chunk_size']
+    return opts
@@ -0,0 +1,98 @@
+import time
+
+POSTPROCESSOR_PHASES = {
+    'Merger': 'merging',
+    'FFmpegMerger': 'merging',
+    'ExtractAudio': 'transcoding',
+    'FFmpegExtractAudio': 'transcoding',
+}
+
+
+class ProgressTracker:
+    """Publishes yt-dlp progress for one task into `task['progress']`.
+
+    Hooks are called from the download threads; every publish builds a new
+    dict and swaps it in with a single assignment, so readers never see a
+    half-written record and building it takes no lock. Byte updates are
+    throttled to one publish per `interval` seconds, while phase changes,
+    moves to another playlist entry and finished downloads are published
+    immediately. `notify`, if given, is called after each publish.
+    """
+
+    def __init__(self, task, interval=0.5, clock=time.monotonic, notify=None):
+        self.task = task
+        self.notify = notify
+        self.interval = interval
+        self.clock = clock
+        self.phase = 'extracting'
+        self.entries_total = None
+        self.entries_done = 0
+        self.current_entry = None
+        self._downloads = {}  # download key -> (downloaded, total, speed, eta)
+        self._last_publish = 0.0
+        self.publish()
+
+    def progress_hook(self, d):
+        info = d.get('info_dict') or {}
+        key = (info.get('playlist_index'), d.get('filename') or info.get('format_id'))
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if d['status'] == 'finished':
+            downloaded = total = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            self._downloads[key] = (downloaded, total, None, 0)
+        elif d['status'] == 'downloading':
+            self._downloads[key] = (d.get('downloaded_bytes') or 0, total, d.get('speed'), d.get('eta'))
+        else:
+            return
+        force = self.phase != 'downloading' or d['status'] == 'finished'
+        if info.get('playlist_index') and info['playlist_index'] != self.current_entry:
+            self.current_entry = info['playlist_index']
+            force = True
+        self.phase = 'downloading'
+        self.publish(force=force)
+
+    def postprocessor_hook(self, d):
+        if d['status'] != 'started':
+            return
+        self.set_phase(POSTPROCESSOR_PHASES.get(d.get('postprocessor'), 'postprocessing'))
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.publish()
+
+    def set_entries(self, total):
+        self.entries_total = total
+        self.publish()
+
+    def entry_done(self):
+        self.entries_done += 1
+        self.publish()
+
+    def hooks(self):
+        """yt-dlp options that route progress into this tracker."""
+        return {
+            'progress_hooks': [self.progress_hook],
+            'postprocessor_hooks': [self.postprocessor_hook],
+        }
+
+    def publish(self, force=True):
+        now = self.clock()
+        if not force and now - self._last_publish < self.interval:
+            return
+        self._last_publish = now
+
+        downloads = list(self._downloads.values())
+        active = [d for d in downloads if d[2] is not None]
+        totals = [d[1] for d in downloads]
+        etas = [d[3] for d in active if d[3] is not None]
+        self.task['progress'] = {
+            'phase': self.phase,
+            'downloaded_bytes': sum(d[0] for d in downloads),
+            'total_bytes': sum(totals) if totals and all(totals) else None,
+            'speed': sum(d[2] for d in active) if active else None,
+            'eta': max(etas) if etas else None,
+            'entry': self.current_entry,
+            'entries_done': self.entries_done,
+            'entries_total': self.entries_total,
+        }
+        if self.notify:
+            self.notify()
@@ -0,0 +1,63 @@
+import threading
+import time
+
+PRUNE_AT = 1024
+
+
+class RateLimiter:
+    """Token buckets keyed by client.
+
+    Each client may make `burst` requests at once and then `rate` requests
+    per second. Buckets that have refilled completely carry no information,
+    so they are dropped once there are many, keeping memory bounded by the
+    number of recently active clients. A `rate` of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._buckets = {}  # key -> (tokens, last refill)
+        self._prune_at = PRUNE_AT
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def acquire(self, key):
+        """Takes a token for `key`; returns 0 if allowed, else seconds until one is available."""
+        return self.take(key, 1)[1]
+
+    def take(self, key, count):
+        """Takes up to `count` tokens for `key`.
+
+        Returns how many were taken and, if fewer than `count`, the seconds
+        until the next one is available (else 0).
+        """
+        if not self.rate:
+            return count, 0
+        now = self.clock()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            taken = min(count, int(tokens))
+            self._buckets[key] = (tokens - taken, now)
+            if taken < count:
+                self.limited += 1
+                return taken, (1 - (tokens - taken)) / self.rate
+            if len(self._buckets) >= self._prune_at:
+                self._prune(now)
+            return taken, 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def _prune(self, now):
+        self._buckets = {
+            key: (tokens, last) for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * self.rate < self.burst
+        }
+        self._prune_at = max(PRUNE_AT, 2 * len(self._buckets))
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'clients': len(self._buckets), 'limited': self.limited}
@@ -0,0 +1,183 @@
+import logging
+import os
+import socket
+import tempfile
+import time
+
+from store import pid_alive
+
+logger = logging.getLogger(__name__)
+
+# Returned by `owners()` for paths a running task is still writing to
+BUSY = 'busy'
+# Unowned entries younger than this may belong to a task that is just starting
+ORPHAN_GRACE = 60
+# Job folders name the process that made them in this file, so servers sharing
+# a download folder leave each other's running jobs alone
+OWNER_FILE = '.owner'
+
+
+def entry_size(path):
+    """Bytes used by a file, or by every file below a directory."""
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def make_job_dir(folder, prefix):
+    """Creates a job folder in `folder` marked as owned by this process."""
+    path = tempfile.mkdtemp(prefix=prefix, dir=folder)
+    with open(os.path.join(path, OWNER_FILE), 'w') as f:
+        f.write(f'{socket.gethostname()}:{os.getpid()}')
+    return path
+
+
+def owned_elsewhere(path):
+    """True for a job folder made by another process on this host that is still running."""
+    try:
+        with open(os.path.join(path, OWNER_FILE)) as f:
+            host, _, pid = f.read().rpartition(':')
+    except OSError:
+        return False
+    return host == socket.gethostname() and pid.isdigit() and int(pid) != os.getpid() and pid_alive(int(pid))
+
+
+class Reaper:
+    """Keeps the top level of a download folder within an age and a size budget.
+
+    Each `scan` lists the folder once and re-measures at most `batch` entries
+    that are new or whose mtime changed, so a large folder is measured over
+    several ticks instead of being walked on every one. `sweep` then evicts
+    entries older than `max_age` and, while the folder holds more than
+    `max_bytes`, the least valuable of the rest: entries no task refers to
+    first, then the oldest.
+
+    Only entries whose names start with `prefix` are considered, so files a
+    user keeps in the same folder are never touched.
+
+    `owners()` maps paths to the task that owns them, or to BUSY for paths
+    that must not be touched. Job folders it does not know are also kept
+    while the process named in their OWNER_FILE is running. `evict(path, owner)` removes one entry; owner
+    is None for orphans.
+    """
+
+    def __init__(self, folder, max_age, max_bytes, owners, evict, prefix='', batch=64, clock=time.time):
+        self.folder = folder
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.owners = owners
+        self.evict = evict
+        self.prefix = prefix
+        self.batch = batch
+        self.clock = clock
+        self._index = {}  # name -> (mtime, size)
+        self.reclaimed_bytes = 0
+        self.reclaimed_entries = 0
+
+    def scan(self, limit=None):
+        """Updates the index; returns how many changed entries are still unmeasured."""
+        limit = self.batch if limit is None else limit
+        seen = {}
+        changed = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.startswith(self.prefix):
+                    continue
+                try:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+                seen[entry.name] = mtime
+                known = self._index.get(entry.name)
+                if known is None or known[0] != mtime:
+                    changed.append(entry.name)
+
+        for name in list(self._index):
+            if name not in seen:
+                del self._index[name]
+        for name in changed[:limit]:
+            try:
+                self._index[name] = (seen[name], entry_size(os.path.join(self.folder, name)))
+            except OSError:
+                pass
+        return max(0, len(changed) - limit)
+
+    def total_bytes(self):
+        return sum(size for _, size in self._index.values())
+
+    def sweep(self):
+        """Scans, then evicts what is over budget; returns the bytes reclaimed."""
+        self.scan()
+        now = self.clock()
+        owners = self.owners()
+        total = self.total_bytes()
+        candidates = []
+        for name, (mtime, size) in self._index.items():
+            path = os.path.join(self.folder, name)
+            owner = owners.get(path)
+            if owner == BUSY or (owner is None and (now - mtime < ORPHAN_GRACE or owned_elsewhere(path))):
+                continue
+            candidates.append((owner is not None, mtime, name, size, owner))
+        candidates.sort(key=lambda c: c[:2])
+
+        reclaimed = 0
+        for _, mtime, name, size, owner in candidates:
+            expired = self.max_age and now - mtime > self.max_age
+            over_budget = self.max_bytes and total > self.max_bytes
+            if expired or over_budget:
+                if self._evict(name, owner):
+                    total -= size
+                    reclaimed += size
+        if reclaimed:
+            logger.info('Reclaimed %d bytes from %s', reclaimed, self.folder)
+        return reclaimed
+
+    def sweep_orphans(self):
+        """Removes every entry no task refers to, regardless of `max_age`; for use at startup.
+
+        Entries younger than ORPHAN_GRACE and job folders of other running
+        processes sharing the folder are kept.
+        """
+        while self.scan(limit=len(self._index) + 1024):
+            pass
+        now = self.clock()
+        owners = self.owners()
+        reclaimed = 0
+        for name, (mtime, size) in list(self._index.items()):
+            path = os.path.join(self.folder, name)
+            if path in owners or now - mtime < ORPHAN_GRACE or owned_elsewhere(path):
+                continue
+            if self._evict(name, None):
+                reclaimed += size
+        if reclaimed:
+            logger.info('Removed %d bytes of orphaned downloads from %s', reclaimed, self.folder)
+        return reclaimed
+
+    def _evict(self, name, owner):
+        path = os.path.join(self.folder, name)
+        try:
+            self.evict(path, owner)
+        except OSError as e:
+            logger.warning('Could not remove %s: %s', path, e)
+        if os.path.lexists(path):
+            return False
+        self.reclaimed_bytes += self._index.pop(name)[1]
+        self.reclaimed_entries += 1
+        return True
+
+    def stats(self):
+        return {
+            'entries': len(self._index),
+            'bytes': self.total_bytes(),
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'reclaimed_entries': self.reclaimed_entries,
+        }
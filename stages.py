@@ -0,0 +1,53 @@
+import functools
+import threading
+import time
+
+
+class StageTimings:
+    """Wall-time totals per pipeline stage (queue, download, post-process, ...)."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> [count, total, max]
+
+    def record(self, stage, started):
+        """Records the time since `started` (a `clock` reading) under `stage`; returns it."""
+        elapsed = max(0.0, self.clock() - started)
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+        return elapsed
+
+    def stats(self):
+        with self._lock:
+            return {
+                stage: {'count': count, 'avg': total / count, 'max': longest, 'total': total}
+                for stage, (count, total, longest) in self._stages.items()
+            }
+
+
+def deferring(ydl_class):
+    """Returns a subclass of `ydl_class` that can leave post-processing for later.
+
+    When the `deferred_postprocessing` param is a list, each download's
+    post-processing (merging formats, extracting audio, ...) is appended to
+    it as a callable instead of being run, so the thread that downloaded the
+    file can go on to the next download while another thread runs ffmpeg.
+    The callables need no network access and may run after the instance is
+    closed. Without the param, downloads are post-processed as usual.
+    """
+
+    class DeferringYoutubeDL(ydl_class):
+
+        def post_process(self, filename, info, files_to_move=None):
+            jobs = self.params.get('deferred_postprocessing')
+            if jobs is None:
+                return super().post_process(filename, info, files_to_move)
+            jobs.append(functools.partial(ydl_class.post_process, self, filename, info, files_to_move))
+            info['filepath'] = filename
+            return info
+
+    return DeferringYoutubeDL
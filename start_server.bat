@@ -19,9 +19,14 @@ REM Install dependencies
 echo "Installing dependencies from requirements.txt..."
 pip install -r requirements.txt
 
-REM Start the server
-echo "Starting the production server with Waitress..."
+REM Start the server; "start_server.bat async" serves the ASGI app (asgi.py) instead
 echo "Your application will be available at http://localhost:5000 or http://<your-ip-address>:5000"
-waitress-serve --host 0.0.0.0 --port 5000 app:app
+IF "%1"=="async" (
+    echo "Starting the async server with Uvicorn..."
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+) ELSE (
+    echo "Starting the production server with Waitress..."
+    waitress-serve --host 0.0.0.0 --port 5000 --threads 64 --call app:serve
+)
 
 pause
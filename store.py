@@ -0,0 +1,358 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+
+from workers import FairQueue
+
+logger = logging.getLogger(__name__)
+
+# Task fields that only make sense inside the process that owns the task
+# (live archives, progress, coalescing links); they are never persisted.
+VOLATILE_FIELDS = ('archive', 'progress', 'followers', 'leader')
+
+
+class MemoryTaskStore(dict):
+    """Process-local task store: a plain dict plus one FairQueue per lane, grouped by client."""
+
+    def queue(self, lane):
+        return FairQueue(key=self._client_of)
+
+    def _client_of(self, task_id):
+        task = self.get(task_id)
+        return task.get('client') if task else None
+
+    def save(self, task):
+        pass
+
+    def recover(self):
+        return 0
+
+    def stats(self):
+        return {'backend': 'memory', 'tasks': len(self)}
+
+
+class SQLiteTaskStore(MutableMapping):
+    """Task store backed by a SQLite database in WAL mode.
+
+    Several server processes on one host can share the same database file:
+    a task row inserted with state `pending` is the queue entry, and workers
+    in any process claim it atomically, oldest first among the clients with
+    the fewest tasks already processing in that lane (counted per client in
+    `lane_clients` by triggers). Claimed rows carry an owner and a
+    heartbeat; rows whose owner died are put back to `pending` by `recover`,
+    which runs at startup and on every heartbeat.
+
+    Reads always go to the database. Tasks created or claimed by this process
+    are also kept as live dicts so in-process fields such as progress and
+    playlist archives survive between reads; call `save` after changing a
+    task's persistent fields.
+    """
+
+    def __init__(self, path, lease=120, poll_interval=0.5):
+        self.path = path
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._local = threading.local()
+        self._live = {}
+        self._wakeups = {}
+        with self._db() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    lane TEXT,
+                    state TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    enqueued_at REAL,
+                    owner TEXT,
+                    heartbeat REAL
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (lane, state, enqueued_at)')
+            self._create_client_counts(db)
+        self._heartbeat = threading.Thread(target=self._beat, name='task-store-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    @staticmethod
+    def _create_client_counts(db):
+        """Keeps per-lane, per-client pending and processing counts next to the tasks.
+
+        Triggers update the counts in the same transaction as the task rows,
+        so every process sees them and `claim` can rank clients without
+        counting their tasks on every call.
+        """
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            columns = [row[1] for row in db.execute('PRAGMA table_info(tasks)')]
+            if 'client' not in columns:
+                # Databases created before the column kept the client only in `data`
+                db.execute("ALTER TABLE tasks ADD COLUMN client TEXT NOT NULL DEFAULT ''")
+                db.execute("UPDATE tasks SET client = COALESCE(json_extract(data, '$.client'), '')")
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_client ON tasks (lane, state, client, enqueued_at)')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS lane_clients (
+                    lane TEXT NOT NULL,
+                    client TEXT NOT NULL,
+                    pending INTEGER NOT NULL,
+                    processing INTEGER NOT NULL,
+                    PRIMARY KEY (lane, client)
+                )
+            ''')
+            count_old = '''
+                UPDATE lane_clients SET pending = pending - (OLD.state = 'pending'),
+                    processing = processing - (OLD.state = 'processing')
+                WHERE lane = OLD.lane AND client = OLD.client;
+                DELETE FROM lane_clients
+                WHERE lane = OLD.lane AND client = OLD.client AND pending = 0 AND processing = 0;
+            '''
+            count_new = '''
+                INSERT INTO lane_clients (lane, client, pending, processing)
+                SELECT NEW.lane, NEW.client, NEW.state = 'pending', NEW.state = 'processing'
+                WHERE NEW.lane IS NOT NULL AND NEW.state IN ('pending', 'processing')
+                ON CONFLICT (lane, client) DO UPDATE SET pending = pending + excluded.pending,
+                    processing = processing + excluded.processing;
+            '''
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS lane_clients_insert AFTER INSERT ON tasks
+                WHEN NEW.state IN ('pending', 'processing') BEGIN {count_new} END
+            ''')
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS lane_clients_update AFTER UPDATE OF lane, state, client ON tasks
+                WHEN OLD.state IN ('pending', 'processing') OR NEW.state IN ('pending', 'processing')
+                BEGIN {count_old} {count_new} END
+            ''')
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS lane_clients_delete AFTER DELETE ON tasks
+                WHEN OLD.state IN ('pending', 'processing') BEGIN {count_old} END
+            ''')
+            # Rebuilt on every start, so counts from any older schema are made right
+            db.execute('DELETE FROM lane_clients')
+            db.execute('''
+                INSERT INTO lane_clients (lane, client, pending, processing)
+                SELECT lane, client, SUM(state = 'pending'), SUM(state = 'processing') FROM tasks
+                WHERE lane IS NOT NULL AND state IN ('pending', 'processing')
+                GROUP BY lane, client
+            ''')
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA busy_timeout=30000')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _persistent(task):
+        return {k: v for k, v in task.items() if k not in VOLATILE_FIELDS}
+
+    def _load(self, task_id):
+        row = self._db().execute(
+            'SELECT data, owner FROM tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def __getitem__(self, task_id):
+        data, owner = self._load(task_id)
+        live = self._live.get(task_id)
+        if data is None:
+            self._live.pop(task_id, None)
+            raise KeyError(task_id)
+        if live is None:
+            if owner != self.owner:
+                return data
+            live = self._live[task_id] = data
+        elif owner != self.owner:
+            # Another process may have moved the task on
+            live.update(data)
+        return live
+
+    def __setitem__(self, task_id, task):
+        lane = task.get('lane')
+        self._db().execute('''
+            INSERT INTO tasks (task_id, lane, state, data, enqueued_at, client) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (task_id) DO UPDATE SET lane = excluded.lane, state = excluded.state, data = excluded.data,
+                enqueued_at = excluded.enqueued_at, client = excluded.client, owner = NULL, heartbeat = NULL
+        ''', (task_id, lane, task['status'], json.dumps(self._persistent(task)), task.get('enqueued_at'),
+              task.get('client') or ''))
+        self._live[task_id] = task
+        if lane and task['status'] == 'pending':
+            self._wakeup(lane).set()
+
+    def __delitem__(self, task_id):
+        cursor = self._db().execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+        self._live.pop(task_id, None)
+        if not cursor.rowcount:
+            raise KeyError(task_id)
+
+    def __contains__(self, task_id):
+        if task_id is None:
+            return False
+        return self._db().execute('SELECT 1 FROM tasks WHERE task_id = ?', (task_id,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self._db().execute('SELECT task_id FROM tasks')])
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def clear(self):
+        self._db().execute('DELETE FROM tasks')
+        self._live.clear()
+
+    def save(self, task):
+        self._db().execute(
+            'UPDATE tasks SET state = ?, data = ? WHERE task_id = ?',
+            (task['status'], json.dumps(self._persistent(task)), task['task_id']),
+        )
+        if task['status'] not in ('pending', 'processing'):
+            self._db().execute('UPDATE tasks SET owner = NULL WHERE task_id = ?', (task['task_id'],))
+
+    def claim(self, lane):
+        """Atomically moves the next pending task of `lane` to `processing`.
+
+        Tasks of clients with the fewest tasks in progress go first, so one
+        client's burst cannot starve the others; ties go to the oldest task.
+        """
+        now = time.time()
+        row = self._db().execute('''
+            UPDATE tasks SET state = 'processing', owner = :owner, heartbeat = :now,
+                data = json_set(data, '$.status', 'processing')
+            WHERE task_id = (
+                SELECT t.task_id FROM lane_clients c JOIN tasks t ON t.task_id = (
+                    SELECT task_id FROM tasks
+                    WHERE lane = c.lane AND state = 'pending' AND client = c.client
+                    ORDER BY enqueued_at LIMIT 1
+                )
+                WHERE c.lane = :lane AND c.pending > 0
+                ORDER BY c.processing, t.enqueued_at
+                LIMIT 1
+            ) AND state = 'pending'
+            RETURNING task_id
+        ''', {'owner': self.owner, 'now': now, 'lane': lane}).fetchone()
+        if row is None:
+            return None
+        if row[0] in self._live:
+            self._live[row[0]]['status'] = 'processing'
+        return row[0]
+
+    def pending_count(self, lane, client=None):
+        if client is None:
+            return self._db().execute(
+                'SELECT COALESCE(SUM(pending), 0) FROM lane_clients WHERE lane = ?', (lane,)
+            ).fetchone()[0]
+        row = self._db().execute(
+            'SELECT pending FROM lane_clients WHERE lane = ? AND client = ?', (lane, client or '')
+        ).fetchone()
+        return row[0] if row else 0
+
+    def queue(self, lane):
+        return SQLiteLaneQueue(self, lane)
+
+    def _wakeup(self, lane):
+        return self._wakeups.setdefault(lane, threading.Event())
+
+    def recover(self):
+        """Returns tasks held by dead workers to the queue; returns how many."""
+        db = self._db()
+        rows = db.execute("SELECT task_id, owner, heartbeat FROM tasks WHERE state = 'processing'").fetchall()
+        host = socket.gethostname()
+        stale = []
+        for task_id, owner, heartbeat in rows:
+            if owner == self.owner:
+                continue
+            owner_host, _, pid = (owner or '').rpartition(':')
+            dead_local = owner_host == host and pid.isdigit() and not pid_alive(int(pid))
+            if dead_local or (heartbeat or 0) < time.time() - self.lease:
+                stale.append(task_id)
+        for task_id in stale:
+            db.execute('''
+                UPDATE tasks SET state = 'pending', owner = NULL,
+                    data = json_set(data, '$.status', 'pending')
+                WHERE task_id = ? AND state = 'processing'
+            ''', (task_id,))
+        if stale:
+            logger.info('Requeued %d tasks abandoned by dead workers', len(stale))
+        return len(stale)
+
+    def _beat(self):
+        while True:
+            time.sleep(self.lease / 4)
+            try:
+                self._db().execute(
+                    "UPDATE tasks SET heartbeat = ? WHERE owner = ? AND state = 'processing'",
+                    (time.time(), self.owner),
+                )
+                self.recover()
+            except sqlite3.Error as e:
+                logger.warning('Task store heartbeat failed: %s', e)
+
+    def stats(self):
+        counts = dict(self._db().execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+        return {'backend': 'sqlite', 'path': self.path, 'tasks': sum(counts.values()), 'states': counts}
+
+
+class SQLiteLaneQueue:
+    """queue.Queue-like view of one lane of a SQLiteTaskStore, for WorkerPool."""
+
+    def __init__(self, store, lane):
+        self.store = store
+        self.lane = lane
+
+    def put(self, task_id):
+        # The pending row is the queue entry; just wake a local worker
+        self.store._wakeup(self.lane).set()
+
+    def get(self):
+        wakeup = self.store._wakeup(self.lane)
+        while True:
+            task_id = self.store.claim(self.lane)
+            if task_id:
+                return task_id
+            # Other processes may enqueue too, so poll as well as wait
+            wakeup.wait(self.store.poll_interval)
+            wakeup.clear()
+
+    def task_done(self):
+        pass
+
+    def qsize(self):
+        return self.store.pending_count(self.lane)
+
+    def count(self, client):
+        return self.store.pending_count(self.lane, client)
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def open_task_store(path=None):
+    """Returns a SQLite store for `path`, or an in-memory store when it is empty."""
+    if path:
+        store = SQLiteTaskStore(path)
+        store.recover()
+        return store
+    return MemoryTaskStore()
@@ -1,16 +1,41 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import io
 import json
+import os
+import zipfile
 import queue
-from app import app, tasks, task_queue
+import tempfile
+import threading
+import time
+from app import (app, tasks, task_queue, lane_for, info_cache, extraction_cache, process_task,
+                 single_cache_key, single_ydl_opts, inflight, settle_followers, dedupe_key, attach_to_inflight,
+                 download_playlist_entries, task_events, transfers, finish_task, FILE_RETENTION,
+                 reap, MAX_RESULT_AGE, info_limiter, download_limiter, ydl_pool, running_download)
+from yt_dlp import YoutubeDL as BaseYoutubeDL
+from yt_dlp.utils import DownloadError
+from cache import DownloadCache
+from zipstream import ZipStream
 
 class AppTestCase(unittest.TestCase):
 
     def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.download_cache = DownloadCache(self.cache_dir.name)
+        cache_patcher = patch('app.download_cache', self.download_cache)
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        self.addCleanup(self.cache_dir.cleanup)
         app.config['TESTING'] = True
         self.app = app.test_client()
         # Clear tasks and queue before each test
         tasks.clear()
+        inflight.clear()
+        info_cache.clear()
+        extraction_cache.clear()
+        ydl_pool.clear()
+        info_limiter.clear()
+        download_limiter.clear()
         while not task_queue.empty():
             task_queue.get()
 
@@ -19,7 +44,7 @@ class AppTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'YouTube Downloader', response.data)
 
-    @patch('yt_dlp.YoutubeDL')
+    @patch('engine.YoutubeDL')
     def test_info_route_video(self, mock_youtube_dl):
         mock_ydl_instance = MagicMock()
         mock_ydl_instance.extract_info.return_value = {
@@ -32,6 +57,8 @@ class AppTestCase(unittest.TestCase):
                 {'format_id': '2', 'height': 1080, 'vcodec': 'avc1', 'acodec': 'mp4a', 'ext': 'mp4', 'filesize': 2000},
             ]
         }
+        mock_ydl_instance.process_ie_result.side_effect = lambda info, **kwargs: info
+        mock_ydl_instance.sanitize_info.side_effect = lambda info, **kwargs: info
         mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
 
         response = self.app.post('/info',
@@ -44,7 +71,7 @@ class AppTestCase(unittest.TestCase):
         self.assertEqual(data['title'], 'test_title')
         self.assertEqual(len(data['formats']), 2)
 
-    @patch('yt_dlp.YoutubeDL')
+    @patch('engine.YoutubeDL')
     def test_info_route_playlist(self, mock_youtube_dl):
         mock_ydl_instance = MagicMock()
         mock_ydl_instance.extract_info.return_value = {
@@ -69,6 +96,414 @@ class AppTestCase(unittest.TestCase):
         self.assertEqual(data['title'], 'playlist_title')
         self.assertEqual(data['total_videos'], 2)
 
+    @patch('engine.YoutubeDL')
+    def test_info_route_uses_cache(self, mock_youtube_dl):
+        mock_ydl_instance = MagicMock()
+        mock_ydl_instance.extract_info.return_value = {
+            'id': 'dQw4w9WgXcQ',
+            'title': 'cached_title',
+            'formats': [],
+        }
+        mock_ydl_instance.sanitize_info.side_effect = lambda info, **kwargs: info
+        mock_ydl_instance.process_ie_result.side_effect = lambda info, **kwargs: info
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+        hits = info_cache.stats()['hits']
+
+        for url in ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'https://youtu.be/dQw4w9WgXcQ'):
+            response = self.app.post('/info',
+                                     data=json.dumps({'url': url}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)['title'], 'cached_title')
+
+        self.assertEqual(mock_ydl_instance.extract_info.call_count, 1)
+        self.assertEqual(info_cache.stats()['hits'], hits + 1)
+
+    @patch('engine.YoutubeDL')
+    def test_info_route_pages_playlists_lazily(self, mock_youtube_dl):
+        produced = []
+
+        def entries():
+            for i in range(5000):
+                produced.append(i)
+                yield {'id': f'v{i}', 'title': f'video {i}', 'thumbnails': [{'url': f't{i}'}]}
+
+        mock_ydl_instance = MagicMock()
+        mock_ydl_instance.extract_info.side_effect = lambda url, **kwargs: {
+            '_type': 'playlist', 'id': 'PL', 'title': 'big', 'playlist_count': 5000, 'entries': entries(),
+        }
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+        url = 'https://www.youtube.com/playlist?list=PL'
+
+        data = json.loads(self.app.post('/info', data=json.dumps({'url': url}), content_type='application/json').data)
+        self.assertEqual(data['total_videos'], 5000)
+        self.assertEqual([e['id'] for e in data['entries']], [f'v{i}' for i in range(10)])
+        self.assertEqual(data['entries'][0]['thumbnail'], 't0')
+        self.assertEqual(data['next_page'], 1)
+        self.assertEqual(len(produced), 11)
+        self.assertEqual(mock_ydl_instance.extract_info.call_args[1]['process'], False)
+        mock_ydl_instance.process_ie_result.assert_not_called()
+
+        response = self.app.post(f'/info?page={data["next_page"]}', data=json.dumps({'url': url}),
+                                 content_type='application/json')
+        self.assertEqual(json.loads(response.data)['entries'][0]['id'], 'v10')
+        self.assertEqual(self.app.post('/info?page=x', data=json.dumps({'url': url}),
+                                       content_type='application/json').status_code, 400)
+
+    @patch('engine.YoutubeDL')
+    def test_info_batch_streams_ndjson(self, mock_youtube_dl):
+        def extract(url, **kwargs):
+            if url.endswith('private'):
+                raise Exception('ERROR: Private video')
+            video_id = url.rsplit('=', 1)[-1]
+            return {'id': video_id, 'title': f'title {video_id}', 'formats': []}
+
+        mock_ydl_instance = MagicMock()
+        mock_ydl_instance.extract_info.side_effect = extract
+        mock_ydl_instance.sanitize_info.side_effect = lambda info, **kwargs: info
+        mock_ydl_instance.process_ie_result.side_effect = lambda info, **kwargs: info
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+        info_cache.put('youtube:cachedcache', {'type': 'video', 'title': 'from cache'})
+
+        urls = [
+            'https://www.youtube.com/watch?v=aaaaaaaaaaa',
+            'https://youtu.be/aaaaaaaaaaa',
+            'https://www.youtube.com/watch?v=cachedcache',
+            'https://example.com/watch?v=private',
+        ]
+        response = self.app.post('/info/batch', data=json.dumps({'urls': urls}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = {line['index']: line for line in map(json.loads, response.data.decode().splitlines())}
+
+        self.assertEqual(sorted(lines), [0, 1, 2, 3])
+        self.assertEqual(lines[0]['info']['title'], 'title aaaaaaaaaaa')
+        self.assertEqual(lines[1]['info'], lines[0]['info'])
+        self.assertEqual(lines[2]['info']['title'], 'from cache')
+        self.assertEqual(lines[3]['error'], 'This is a private video.')
+        self.assertEqual(mock_ydl_instance.extract_info.call_count, 2)
+
+    def test_info_batch_charges_each_extraction(self):
+        urls = [f'https://www.youtube.com/watch?v=video{i:06d}' for i in range(info_limiter.burst + 2)]
+        info_cache.put('youtube:cachedcache', {'type': 'video', 'title': 'from cache'})
+        with patch('app.extract_info_payload', side_effect=lambda url, key: {'title': key}) as extract:
+            response = self.app.post('/info/batch', data=json.dumps({'urls': urls + ['https://youtu.be/cachedcache']}),
+                                     content_type='application/json')
+            lines = [json.loads(line) for line in response.data.decode().splitlines()]
+            # The bucket held a token for all but the last two videos; the cached one was free
+            self.assertEqual(extract.call_count, info_limiter.burst)
+            self.assertEqual(len([line for line in lines if 'info' in line]), info_limiter.burst + 1)
+            self.assertEqual(sorted(line['index'] for line in lines if 'error' in line), [len(urls) - 2, len(urls) - 1])
+            self.assertIn('Retry-After', response.headers)
+
+            response = self.app.post('/info/batch', data=json.dumps({'urls': urls[:1]}), content_type='application/json')
+            self.assertEqual(response.status_code, 429)
+
+    def test_info_batch_rejects_bad_input(self):
+        for body in ({}, {'urls': []}, {'urls': ['u', 3]}, {'urls': ['u'] * 1000}):
+            response = self.app.post('/info/batch', data=json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    @patch('engine.YoutubeDL')
+    def test_download_reuses_info_extraction(self, mock_youtube_dl):
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        extraction_cache.put('youtube:dQw4w9WgXcQ', {'id': 'dQw4w9WgXcQ', 'formats': []})
+
+        def fake_download(info, download=True):
+            outtmpl = mock_youtube_dl.call_args[0][0]['outtmpl']
+            with open(outtmpl.replace('%(id)s.%(ext)s', 'dQw4w9WgXcQ.mp4'), 'w') as f:
+                f.write('data')
+            return info
+
+        mock_ydl_instance = MagicMock()
+        mock_ydl_instance.process_ie_result.side_effect = fake_download
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+
+        with tempfile.TemporaryDirectory() as download_folder, patch('app.DOWNLOAD_FOLDER', download_folder):
+            tasks['t'] = {'task_id': 't', 'url': url, 'mode': 'video', 'format_id': None,
+                          'submode': 'video', 'status': 'pending', 'result': None, 'error': None}
+            process_task('t')
+
+            self.assertEqual(tasks['t']['status'], 'completed')
+            self.assertTrue(os.path.exists(tasks['t']['result']))
+            self.assertIn('progress_hooks', mock_youtube_dl.call_args[0][0])
+
+        response = self.app.get('/status/t')
+        self.assertEqual(json.loads(response.data)['progress']['phase'], 'finished')
+        mock_ydl_instance.process_ie_result.assert_called_once()
+        mock_ydl_instance.extract_info.assert_not_called()
+
+    @patch('app.postprocess_executor')
+    @patch('engine.YoutubeDL')
+    def test_postprocessing_runs_as_separate_stage(self, mock_youtube_dl, mock_executor):
+        def fake_download(url, download=True):
+            opts = mock_youtube_dl.call_args[0][0]
+            part = opts['outtmpl'].replace('%(id)s.%(ext)s', 'x.f137.mp4')
+            with open(part, 'w') as f:
+                f.write('data')
+            opts['deferred_postprocessing'].append(lambda: os.rename(part, part.replace('.f137', '')))
+            return {'id': 'x'}
+
+        mock_ydl_instance = MagicMock()
+        mock_ydl_instance.extract_info.side_effect = fake_download
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+
+        with tempfile.TemporaryDirectory() as download_folder, patch('app.DOWNLOAD_FOLDER', download_folder):
+            tasks['t'] = {'task_id': 't', 'url': 'https://www.youtube.com/watch?v=x', 'mode': 'video',
+                          'format_id': None, 'submode': 'video', 'status': 'pending', 'result': None,
+                          'error': None}
+            process_task('t')
+            self.assertEqual(tasks['t']['status'], 'processing')
+            self.assertEqual(tasks['t']['progress']['phase'], 'postprocessing')
+
+            (stage,), _ = mock_executor.submit.call_args
+            stage()
+            self.assertEqual(tasks['t']['status'], 'completed')
+            self.assertEqual(os.path.basename(tasks['t']['result']), 'x.mp4')
+            self.assertLessEqual({'download', 'postprocess_wait', 'postprocess'}, set(tasks['t']['timings']))
+
+    @patch('engine.YoutubeDL')
+    def test_metrics_count_failures_by_category(self, mock_youtube_dl):
+        mock_youtube_dl.return_value.__enter__.return_value.extract_info.side_effect = \
+            Exception('ERROR: Private video. Sign in if you have access')
+        response = self.app.post('/info', data=json.dumps({'url': 'https://www.youtube.com/watch?v=p'}),
+                                 content_type='application/json')
+        self.assertEqual(json.loads(response.data)['error'], 'This is a private video.')
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.data.decode(), r'ytd_errors_total\{category="private"\} [1-9]')
+        self.assertIn('ytd_queue_depth{lane="single"}', response.data.decode())
+
+    def test_download_unknown_mode(self):
+        response = self.app.post('/download', data=json.dumps({'url': 'https://youtu.be/x', 'mode': 'mp4'}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.get_json())
+        self.assertTrue(task_queue.empty())
+
+    def test_crashed_task_fails(self):
+        tasks['t'] = {'task_id': 't', 'url': 'https://youtu.be/x', 'mode': 'video', 'format_id': None,
+                      'submode': 'video', 'status': 'pending', 'result': None, 'error': None}
+        inflight[dedupe_key(tasks['t'])] = 't'
+        with patch('app.run_task', side_effect=KeyError('mode')):
+            process_task('t')
+        self.assertEqual(tasks['t']['status'], 'failed')
+        self.assertEqual(inflight, {})
+
+    def test_cancel_queued_task(self):
+        response = self.app.post('/download', data=json.dumps({'url': 'https://youtu.be/x', 'mode': 'video'}),
+                                 content_type='application/json')
+        task_id = json.loads(response.data)['task_id']
+
+        response = self.app.delete(f'/task/{task_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['error'], 'The download was cancelled.')
+        with patch('engine.YoutubeDL') as mock_youtube_dl:
+            process_task(task_id)
+        mock_youtube_dl.assert_not_called()
+        self.assertEqual(inflight, {})
+
+    @patch('engine.YoutubeDL')
+    def test_cancel_running_task(self, mock_youtube_dl):
+        def fake_download(url, download=True):
+            opts = mock_youtube_dl.call_args[0][0]
+            with open(opts['outtmpl'].replace('%(id)s.%(ext)s', 'x.mp4.part'), 'w') as f:
+                f.write('data')
+            self.assertEqual(self.app.delete('/task/t').status_code, 202)
+            opts['job_budget'].progress_hook({'status': 'downloading', 'filename': 'x.mp4', 'downloaded_bytes': 4})
+
+        mock_youtube_dl.return_value.__enter__.return_value.extract_info.side_effect = fake_download
+
+        with tempfile.TemporaryDirectory() as download_folder, patch('app.DOWNLOAD_FOLDER', download_folder):
+            tasks['t'] = {'task_id': 't', 'url': 'https://www.youtube.com/watch?v=x', 'mode': 'video',
+                          'format_id': None, 'submode': 'video', 'status': 'pending', 'result': None,
+                          'error': None}
+            process_task('t')
+            self.assertEqual(tasks['t']['status'], 'failed')
+            self.assertEqual(tasks['t']['error'], 'The download was cancelled.')
+            self.assertEqual(os.listdir(download_folder), [])
+
+        response = self.app.delete('/task/t')
+        self.assertEqual(json.loads(response.data)['status'], 'deleted')
+        self.assertEqual(self.app.delete('/task/t').status_code, 404)
+
+    def test_info_refused_during_long_backoff(self):
+        with patch('app.outbound.backoff_remaining', return_value=60.0):
+            response = self.app.post('/info', data=json.dumps({'url': 'https://www.youtube.com/watch?v=x'}),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '60')
+
+    @patch('app.worker_pool')
+    @patch('engine.YoutubeDL')
+    def test_throttled_task_is_requeued(self, mock_youtube_dl, mock_pool):
+        mock_ydl_instance = MagicMock()
+        mock_ydl_instance.extract_info.side_effect = Exception('HTTP Error 429: Too Many Requests')
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+
+        with tempfile.TemporaryDirectory() as download_folder, patch('app.DOWNLOAD_FOLDER', download_folder), \
+                patch('app.THROTTLE_RETRIES', 1):
+            tasks['t'] = {'task_id': 't', 'url': 'https://www.youtube.com/watch?v=x', 'mode': 'video',
+                          'format_id': None, 'submode': 'video', 'status': 'pending', 'result': None,
+                          'error': None, 'lane': 'single'}
+            process_task('t')
+            self.assertEqual(tasks['t']['status'], 'pending')
+            self.assertEqual(tasks['t']['progress']['phase'], 'throttled')
+            mock_pool.submit.assert_called_once_with('t', 'single')
+
+            process_task('t')
+            self.assertEqual(tasks['t']['status'], 'failed')
+            self.assertEqual(tasks['t']['error'], 'Too many requests. Please try again later.')
+            self.assertEqual(mock_pool.submit.call_count, 1)
+
+    def test_download_cache_hit_completes_immediately(self):
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        key = single_cache_key(url, single_ydl_opts('audio', None))
+        src = os.path.join(self.cache_dir.name, 'dQw4w9WgXcQ.mp3')
+        with open(src, 'w') as f:
+            f.write('data')
+        path = self.download_cache.add(key, src)
+        self.download_cache.release(key)
+
+        response = self.app.post('/download',
+                                 data=json.dumps({'url': url, 'mode': 'audio'}),
+                                 content_type='application/json')
+        task_id = json.loads(response.data)['task_id']
+        self.assertEqual(tasks[task_id]['status'], 'completed')
+        self.assertTrue(task_queue.empty())
+
+        response = self.app.get(f'/file/{task_id}')
+        self.assertEqual(response.data, b'data')
+        response.close()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.download_cache.stats()['in_use'], 0)
+
+    @patch('engine.YoutubeDL')
+    def test_playlist_entries_download_concurrently(self, mock_youtube_dl):
+        running = []
+        peak = []
+
+        def make_ydl(opts):
+            ydl = MagicMock()
+            ydl.extract_info.return_value = {'_type': 'playlist', 'entries': [
+                {'_type': 'url', 'id': f'v{i}', 'url': f'https://youtu.be/v{i}', 'playlist_index': i}
+                for i in range(1, 5)
+            ]}
+            ydl.sanitize_info.side_effect = BaseYoutubeDL.sanitize_info
+
+            def fake_download(entry, download=True, extra_info=None):
+                running.append(entry['id'])
+                peak.append(len(running))
+                time.sleep(0.05)
+                running.remove(entry['id'])
+                if entry['id'] == 'v3':
+                    raise Exception('Video unavailable')
+                with open(opts['outtmpl'].replace('%(title)s.%(ext)s', entry['id'] + '.mp4'), 'w') as f:
+                    f.write('data')
+
+            ydl.process_ie_result.side_effect = fake_download
+            context = MagicMock()
+            context.__enter__.return_value = ydl
+            return context
+
+        mock_youtube_dl.side_effect = make_ydl
+
+        with tempfile.TemporaryDirectory() as tmpdir, patch('app.PLAYLIST_CONCURRENCY', 2):
+            download_playlist_entries('https://www.youtube.com/playlist?list=x', {}, tmpdir)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['001 - v1.mp4', '002 - v2.mp4', '004 - v4.mp4'])
+        self.assertEqual(max(peak), 2)
+
+    @patch('engine.YoutubeDL')
+    def test_playlist_progress_names_the_entry(self, mock_youtube_dl):
+        seen = []
+
+        def make_ydl(opts):
+            ydl = MagicMock()
+            ydl.extract_info.return_value = {'_type': 'playlist', 'entries': [
+                {'_type': 'url', 'id': f'v{i}', 'url': f'https://youtu.be/v{i}'} for i in range(1, 3)
+            ]}
+            ydl.sanitize_info.side_effect = BaseYoutubeDL.sanitize_info
+
+            def fake_download(entry, download=True, extra_info=None):
+                # yt-dlp resolves the URL and adds extra_info to the video it finds
+                info = {'id': entry['id'], 'format_id': '18', **(extra_info or {})}
+                path = opts['outtmpl'].replace('%(title)s.%(ext)s', entry['id'] + '.mp4')
+                for hook in opts['progress_hooks']:
+                    hook({'status': 'downloading', 'info_dict': info, 'filename': path,
+                          'downloaded_bytes': 1, 'total_bytes': 4})
+                seen.append(tasks['p']['progress']['entry'])
+                with open(path, 'w') as f:
+                    f.write('data')
+                return info
+
+            ydl.process_ie_result.side_effect = fake_download
+            context = MagicMock()
+            context.__enter__.return_value = ydl
+            return context
+
+        mock_youtube_dl.side_effect = make_ydl
+
+        with tempfile.TemporaryDirectory() as download_folder, patch('app.DOWNLOAD_FOLDER', download_folder), \
+                patch('app.PLAYLIST_CONCURRENCY', 1):
+            tasks['p'] = {'task_id': 'p', 'url': 'https://www.youtube.com/playlist?list=x', 'mode': 'playlist',
+                          'format_id': None, 'submode': 'video', 'status': 'pending', 'result': None,
+                          'error': None, 'lane': 'playlist'}
+            process_task('p')
+            self.assertEqual(tasks['p']['status'], 'completed')
+            self.assertEqual(seen, [1, 2])
+            self.assertEqual(tasks['p']['progress']['entries_done'], 2)
+            tasks['p']['archive'].close()
+
+    @patch('engine.YoutubeDL')
+    def test_throttled_playlist_entry_is_retried(self, mock_youtube_dl):
+        attempts = []
+
+        def make_ydl(opts):
+            ydl = MagicMock()
+            ydl.extract_info.return_value = {'_type': 'playlist', 'entries': [
+                {'_type': 'url', 'id': f'v{i}', 'url': f'https://youtu.be/v{i}'} for i in range(1, 4)
+            ]}
+            ydl.sanitize_info.side_effect = BaseYoutubeDL.sanitize_info
+
+            def fake_download(entry, download=True, extra_info=None):
+                attempts.append(entry['id'])
+                if entry['id'] == 'v2' and attempts.count('v2') == 1:
+                    raise DownloadError('ERROR: unable to download video data: HTTP Error 429: Too Many Requests')
+                if entry['id'] == 'v3':
+                    raise DownloadError('ERROR: Video unavailable')
+                with open(opts['outtmpl'].replace('%(title)s.%(ext)s', entry['id'] + '.mp4'), 'w') as f:
+                    f.write('data')
+
+            ydl.process_ie_result.side_effect = fake_download
+            context = MagicMock()
+            context.__enter__.return_value = ydl
+            return context
+
+        mock_youtube_dl.side_effect = make_ydl
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            download_playlist_entries('https://www.youtube.com/playlist?list=x', {}, tmpdir)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['001 - v1.mp4', '002 - v2.mp4'])
+        # Only the throttled entry is tried again; other failures are still skipped
+        self.assertEqual(sorted(attempts), ['v1', 'v2', 'v2', 'v3'])
+
+    def test_fragment_share_by_default(self):
+        # 32 fragment slots, capped at the 20 requests per second the governor allows
+        with running_download('video') as alone:
+            self.assertEqual(alone['concurrent_fragment_downloads'], 8)
+            with running_download('playlist_entry') as entry, running_download('audio') as audio:
+                self.assertEqual(entry['concurrent_fragment_downloads'], 4)
+                self.assertEqual(audio['concurrent_fragment_downloads'], 2)
+                with running_download('video') as fourth:
+                    self.assertEqual(fourth['concurrent_fragment_downloads'], 5)
+        # Once they finish, the next download gets the whole share again
+        with running_download('video') as later:
+            self.assertEqual(later['concurrent_fragment_downloads'], 8)
+
+    def test_workers_do_not_start_on_import(self):
+        self.assertFalse([t for t in threading.enumerate() if t.name.startswith(('worker-', 'reaper'))])
+
     def test_download_route(self):
         url = 'https://www.youtube.com/watch?v=test_id'
         response = self.app.post('/download',
@@ -86,6 +521,248 @@ class AppTestCase(unittest.TestCase):
         self.assertFalse(task_queue.empty())
         self.assertEqual(task_queue.get(), task_id)
 
+    def test_audio_formats_are_separate_jobs(self):
+        url = 'https://www.youtube.com/watch?v=test_id'
+        task_ids = []
+        for audio_format in ('mp3', 'original', 'original'):
+            response = self.app.post('/download',
+                                     data=json.dumps({'url': url, 'mode': 'audio', 'audio_format': audio_format}),
+                                     content_type='application/json')
+            task_ids.append(json.loads(response.data)['task_id'])
+        self.assertNotIn('leader', tasks[task_ids[1]])
+        self.assertEqual(tasks[task_ids[2]]['leader'], task_ids[1])
+
+        original = single_ydl_opts('audio', None, 'original')
+        self.assertNotEqual(single_cache_key(url, original), single_cache_key(url, single_ydl_opts('audio', None)))
+        self.assertNotIn('preferredquality', original['postprocessors'][0])
+
+    def test_unknown_audio_format_rejected(self):
+        response = self.app.post('/download',
+                                 data=json.dumps({'url': 'https://youtu.be/x', 'mode': 'audio', 'audio_format': 'flac'}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_playlist_download_uses_playlist_lane(self):
+        response = self.app.post('/download',
+                                 data=json.dumps({'url': 'https://www.youtube.com/playlist?list=x', 'mode': 'playlist'}),
+                                 content_type='application/json')
+
+        task_id = json.loads(response.data)['task_id']
+        self.assertEqual(lane_for(tasks[task_id]), 'playlist')
+        self.assertTrue(task_queue.empty())
+
+    def test_download_rate_limited_per_client(self):
+        payload = json.dumps({'url': 'https://www.youtube.com/playlist?list=x', 'mode': 'playlist'})
+        with patch.object(download_limiter, 'rate', 1 / 60), patch.object(download_limiter, 'burst', 2):
+            statuses = [self.app.post('/download', data=payload, content_type='application/json').status_code
+                        for _ in range(3)]
+            other = self.app.post('/download', data=payload, content_type='application/json',
+                                  environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(statuses[:2], [200, 200])
+        self.assertEqual(statuses[2], 429)
+        self.assertEqual(other.status_code, 200)
+
+    def test_download_refused_when_lane_is_full(self):
+        with patch('app.MAX_QUEUE', 0):
+            response = self.app.post('/download',
+                                     data=json.dumps({'url': 'https://www.youtube.com/watch?v=full', 'mode': 'video'}),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(len(tasks), 0)
+        self.assertEqual(inflight, {})
+
+    def test_stats_route(self):
+        response = self.app.get('/stats')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertIn('single', data['lanes'])
+        self.assertIn('playlist', data['lanes'])
+        self.assertIn('depth', data['lanes']['single'])
+
+    def test_identical_downloads_are_coalesced(self):
+        payload = json.dumps({'url': 'https://www.youtube.com/playlist?list=x', 'mode': 'playlist'})
+        first = json.loads(self.app.post('/download', data=payload, content_type='application/json').data)['task_id']
+        second = json.loads(self.app.post('/download', data=payload, content_type='application/json').data)['task_id']
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(tasks[second]['leader'], first)
+        self.assertEqual(tasks[first]['followers'], [second])
+
+    def test_coalesced_tasks_share_result_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as f:
+            f.write(b'zip')
+        leader = {'task_id': 'a', 'url': 'u', 'mode': 'playlist', 'format_id': None, 'submode': 'video',
+                  'status': 'completed', 'result': f.name, 'error': None, 'followers': ['b']}
+        tasks['a'] = leader
+        tasks['b'] = dict(leader, task_id='b', status='pending', result=None, followers=[], leader='a')
+        inflight[dedupe_key(leader)] = 'a'
+        with patch('app.shutil.rmtree'):
+            settle_followers(leader)
+            self.assertEqual(tasks['b']['status'], 'completed')
+            self.assertEqual(inflight, {})
+
+            self.app.get('/file/a').close()
+            self.assertTrue(os.path.exists(f.name))
+            self.app.get('/file/b').close()
+            self.assertFalse(os.path.exists(f.name))
+
+    def make_file_task(self, size):
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+            f.write(os.urandom(size))
+        self.addCleanup(lambda: os.path.exists(f.name) and os.remove(f.name))
+        tasks['v'] = {'task_id': 'v', 'url': 'u', 'mode': 'video', 'format_id': None, 'submode': 'video',
+                      'status': 'completed', 'result': f.name, 'error': None}
+        with open(f.name, 'rb') as src:
+            return f.name, src.read()
+
+    def test_file_route_resumes_with_range_requests(self):
+        path, data = self.make_file_task(100000)
+
+        response = self.app.get('/file/v', headers={'Range': 'bytes=0-59999'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.data, data[:60000])
+        etag = response.headers['ETag']
+        response.close()
+        self.assertTrue(os.path.exists(path))
+
+        response = self.app.get('/file/v', headers={'Range': 'bytes=60000-', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 60000-99999/100000')
+        self.assertEqual(response.data, data[60000:])
+        response.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertNotIn('v', tasks)
+
+    def test_file_route_stale_if_range_sends_whole_file(self):
+        path, data = self.make_file_task(1000)
+        response = self.app.get('/file/v', headers={'Range': 'bytes=500-', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, data)
+        response.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_route_unfinished_transfer_expires(self):
+        path, _ = self.make_file_task(100000)
+        self.app.get('/file/v', headers={'Range': 'bytes=0-9'}).close()
+        self.assertTrue(os.path.exists(path))
+
+        with patch.object(transfers, 'clock', return_value=time.monotonic() + FILE_RETENTION + 1):
+            expired = transfers.expired()
+        self.assertEqual(expired, ['v'])
+        finish_task(tasks['v'])
+        self.assertFalse(os.path.exists(path))
+
+    def test_reap_drops_results_never_fetched(self):
+        path, _ = self.make_file_task(10)
+        tasks['v']['finished_at'] = time.time() - MAX_RESULT_AGE - 1
+        tasks['f'] = {'task_id': 'f', 'url': 'u', 'mode': 'video', 'status': 'failed', 'result': None,
+                      'error': 'x', 'finished_at': time.time()}
+        with patch('app.reaper') as reaper:
+            reaper.sweep.return_value = 0
+            reap()
+        self.assertNotIn('v', tasks)
+        self.assertFalse(os.path.exists(path))
+        self.assertIn('f', tasks)
+
+    def make_playlist_task(self, status):
+        tmpdir = tempfile.mkdtemp()
+        archive = ZipStream()
+        for name in ('001 - a.mp4', '002 - b.mp4'):
+            with open(os.path.join(tmpdir, name), 'w') as f:
+                f.write(name)
+            archive.add(os.path.join(tmpdir, name))
+        tasks['p'] = {'task_id': 'p', 'url': 'u', 'mode': 'playlist', 'format_id': None, 'submode': 'video',
+                      'status': status, 'result': tmpdir, 'error': None,
+                      'archive': archive, 'archive_name': 'playlist-x.zip'}
+        return tmpdir, archive
+
+    def test_file_route_streams_playlist_archive(self):
+        tmpdir, archive = self.make_playlist_task('completed')
+        archive.close()
+
+        response = self.app.get('/file/p')
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertEqual(int(response.headers['Content-Length']), archive.content_length())
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+            self.assertEqual(zf.namelist(), ['001 - a.mp4', '002 - b.mp4'])
+            self.assertEqual(zf.infolist()[0].compress_type, zipfile.ZIP_STORED)
+        response.close()
+        self.assertFalse(os.path.exists(tmpdir))
+        self.assertNotIn('p', tasks)
+
+    def test_file_route_live_playlist_archive(self):
+        tmpdir, archive = self.make_playlist_task('processing')
+        self.assertEqual(self.app.get('/file/p').status_code, 404)
+
+        archive.close()
+        response = self.app.get('/file/p?live=1')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+            self.assertEqual(len(zf.namelist()), 2)
+        response.close()
+
+    def test_live_read_keeps_result_for_followers(self):
+        tmpdir, archive = self.make_playlist_task('processing')
+        tasks['p']['followers'] = []
+        tasks['q'] = {'task_id': 'q', 'url': 'u', 'mode': 'playlist', 'format_id': None, 'submode': 'video',
+                      'status': 'pending', 'result': None, 'error': None}
+        attach_to_inflight(tasks['p'])
+        self.assertTrue(attach_to_inflight(tasks['q']))
+        archive.close()
+
+        response = self.app.get('/file/p?live=1')
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+            self.assertEqual(len(zf.namelist()), 2)
+        response.close()
+        self.assertTrue(os.path.exists(tmpdir))
+
+        tasks['p']['status'] = 'completed'
+        settle_followers(tasks['p'])
+        for task_id in ('q', 'p'):
+            response = self.app.get(f'/file/{task_id}')
+            with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+                self.assertEqual(len(zf.namelist()), 2)
+            response.close()
+        self.assertFalse(os.path.exists(tmpdir))
+
+    def test_concurrent_archive_readers(self):
+        tmpdir, archive = self.make_playlist_task('completed')
+        archive.close()
+
+        first = self.app.get('/file/p', buffered=False)
+        chunks = iter(first.response)
+        head = next(chunks)
+        second = self.app.get('/file/p')
+        with zipfile.ZipFile(io.BytesIO(second.data)) as zf:
+            self.assertEqual(len(zf.namelist()), 2)
+        second.close()
+        self.assertTrue(os.path.exists(tmpdir))
+        with zipfile.ZipFile(io.BytesIO(head + b''.join(chunks))) as zf:
+            self.assertEqual(len(zf.namelist()), 2)
+        first.close()
+        self.assertFalse(os.path.exists(tmpdir))
+
+    def test_events_route_pushes_changes(self):
+        tasks['e'] = {'task_id': 'e', 'status': 'processing', 'error': None, 'progress': {'phase': 'downloading'}}
+
+        def finish():
+            time.sleep(0.1)
+            tasks['e']['status'] = 'completed'
+            task_events.notify('e')
+
+        threading.Thread(target=finish).start()
+        response = self.app.get('/events/e')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        messages = [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+                    if line.startswith('data: ')]
+        response.close()
+        self.assertEqual([m['status'] for m in messages], ['processing', 'completed'])
+
+    def test_events_route_unknown_task(self):
+        self.assertEqual(self.app.get('/events/missing').status_code, 404)
+
     def test_status_route(self):
         task_id = 'test_task_id'
         tasks[task_id] = {'status': 'pending'}
@@ -0,0 +1,165 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import asgi
+from app import tasks, inflight, info_cache, info_limiter, task_events
+from zipstream import ZipStream
+
+
+def call(path, method='GET', body=b'', headers=(), query=b''):
+    """Runs one request through the ASGI app; returns (status, headers, body)."""
+
+    async def run():
+        sent = []
+        received = [{'type': 'http.request', 'body': body}]
+        done = asyncio.Event()
+
+        async def receive():
+            if received:
+                return received.pop(0)
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                done.set()
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query,
+            'headers': [(k.lower().encode(), v.encode()) for k, v in headers],
+            'client': ('127.0.0.1', 1234), 'server': ('localhost', 5000),
+        }
+        await asgi.application(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    start = sent[0]
+    return (start['status'], {k.decode(): v.decode() for k, v in start['headers']},
+            b''.join(m.get('body', b'') for m in sent[1:]))
+
+
+class TestAsyncApp(unittest.TestCase):
+
+    def setUp(self):
+        tasks.clear()
+        inflight.clear()
+        info_cache.clear()
+        info_limiter.clear()
+
+    def test_status_route(self):
+        tasks['s'] = {'task_id': 's', 'status': 'processing', 'error': None, 'progress': {'phase': 'downloading'}}
+        status, headers, body = call('/status/s')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertEqual(json.loads(body)['progress'], {'phase': 'downloading'})
+        self.assertEqual(call('/status/missing')[0], 404)
+
+    def test_info_extracts_on_the_info_executor(self):
+        threads = []
+
+        def extract(url, key, page=0):
+            threads.append(threading.current_thread().name)
+            return {'type': 'video', 'title': 't'}
+
+        with patch('app.extract_info_payload', side_effect=extract):
+            status, _, body = call('/info', 'POST', json.dumps({'url': 'https://youtu.be/x'}).encode(),
+                                   [('Content-Type', 'application/json')])
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['title'], 't')
+        self.assertTrue(threads[0].startswith('info'))
+
+    def test_info_validation(self):
+        status, _, body = call('/info', 'POST', b'{}', [('Content-Type', 'application/json')])
+        self.assertEqual((status, json.loads(body)), (400, {'error': 'missing url'}))
+        # Malformed requests are answered by Flask itself
+        self.assertEqual(call('/info', 'POST', b'url', [('Content-Type', 'text/plain')])[0], 415)
+
+    def test_events_stream_wakes_on_change(self):
+        tasks['e'] = {'task_id': 'e', 'status': 'processing', 'error': None, 'progress': None}
+
+        def finish():
+            time.sleep(0.1)
+            tasks['e']['status'] = 'completed'
+            task_events.notify('e')
+
+        threading.Thread(target=finish).start()
+        start = time.monotonic()
+        status, headers, body = call('/events/e')
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith('text/event-stream'))
+        messages = [json.loads(line[len('data: '):]) for line in body.decode().splitlines()
+                    if line.startswith('data: ')]
+        self.assertEqual([m['status'] for m in messages], ['processing', 'completed'])
+        self.assertEqual(asgi.application.event_streams, 0)
+
+    def test_file_route_goes_through_flask(self):
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+            f.write(os.urandom(600000))
+        self.addCleanup(lambda: os.path.exists(f.name) and os.remove(f.name))
+        with open(f.name, 'rb') as src:
+            data = src.read()
+        tasks['v'] = {'task_id': 'v', 'url': 'u', 'mode': 'video', 'format_id': None, 'submode': 'video',
+                      'status': 'completed', 'result': f.name, 'error': None}
+
+        status, headers, body = call('/file/v', headers=[('Range', 'bytes=0-299999')])
+        self.assertEqual((status, body), (206, data[:300000]))
+        self.assertTrue(os.path.exists(f.name))
+
+        status, headers, body = call('/file/v', headers=[('Range', 'bytes=300000-')])
+        self.assertEqual(headers['content-range'], 'bytes 300000-599999/600000')
+        self.assertEqual(body, data[300000:])
+        # Fully delivered across both requests, so the result is cleaned up
+        self.assertFalse(os.path.exists(f.name))
+        self.assertNotIn('v', tasks)
+
+    def test_live_archive_waits_without_a_bridge_thread(self):
+        folder = tempfile.mkdtemp()
+        contents = {}
+        for name in ('001 - a.mp4', '002 - b.mp4'):
+            contents[name] = os.urandom(300000)
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(contents[name])
+        archive = ZipStream()
+        archive.add(os.path.join(folder, '001 - a.mp4'))
+        tasks['p'] = {'task_id': 'p', 'url': 'u', 'mode': 'playlist', 'status': 'processing',
+                      'result': folder, 'error': None, 'archive': archive, 'archive_name': 'p.zip'}
+        single = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(single.shutdown)
+        bridged = []
+
+        def finish():
+            time.sleep(0.2)
+            # The reader is waiting for the second entry, yet the only bridge thread is free
+            bridged.append(single.submit(lambda: True).result(timeout=1))
+            archive.add(os.path.join(folder, '002 - b.mp4'))
+            archive.close()
+            tasks['p']['status'] = 'completed'
+
+        threading.Thread(target=finish).start()
+        with patch.object(asgi.application, 'executor', single):
+            status, headers, body = call('/file/p', query=b'live=1')
+        self.assertEqual((status, bridged), (200, [True]))
+        self.assertEqual(headers['content-disposition'], 'attachment; filename="p.zip"')
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            self.assertEqual({name: zf.read(name) for name in zf.namelist()}, contents)
+        # The whole archive went out after the task completed, so it is cleaned up
+        self.assertNotIn('p', tasks)
+        self.assertFalse(os.path.exists(folder))
+
+    def test_unknown_route(self):
+        self.assertEqual(call('/nope')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from budget import (JobBudget, Cancelled, TimeLimitExceeded, SizeLimitExceeded, DurationLimitExceeded)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def progress(filename, downloaded, total=None):
+    return {'status': 'downloading', 'filename': filename, 'downloaded_bytes': downloaded, 'total_bytes': total}
+
+
+class TestJobBudget(unittest.TestCase):
+
+    def test_cancel_stops_next_check(self):
+        budget = JobBudget()
+        budget.progress_hook(progress('a', 10))
+        budget.cancel()
+        self.assertTrue(budget.aborted)
+        with self.assertRaises(Cancelled):
+            budget.progress_hook(progress('a', 20))
+        with self.assertRaises(Cancelled):
+            budget.check()
+
+    def test_wall_time_limit(self):
+        clock = FakeClock()
+        budget = JobBudget(max_seconds=60, clock=clock)
+        budget.check()
+        clock.now = 61
+        with self.assertRaises(TimeLimitExceeded):
+            budget.check()
+
+    def test_size_limit_counts_every_file_of_the_job(self):
+        budget = JobBudget(max_bytes=100)
+        budget.progress_hook(progress('video', 10, total=60))
+        with self.assertRaises(SizeLimitExceeded):
+            budget.progress_hook(progress('audio', 0, total=50))
+        with self.assertRaises(SizeLimitExceeded):
+            budget.check()
+
+    def test_duration_limit_refuses_before_download(self):
+        budget = JobBudget(max_duration=600)
+        self.assertIsNone(budget.match_filter({'duration': 300}))
+        self.assertIsNone(budget.match_filter({'is_live': True}))
+        with self.assertRaises(DurationLimitExceeded):
+            budget.match_filter({'duration': 36000})
+        budget.check()  # only that video is refused
+
+    def test_zero_disables_limits(self):
+        clock = FakeClock()
+        budget = JobBudget(clock=clock)
+        clock.now = 10 ** 6
+        budget.progress_hook(progress('a', 10 ** 12))
+        budget.match_filter({'duration': 10 ** 6})
+
+
+if __name__ == '__main__':
+    unittest.main()
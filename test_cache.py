@@ -0,0 +1,170 @@
+import unittest
+import os
+import tempfile
+
+from cache import MetadataCache, DownloadCache, canonical_key
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCanonicalKey(unittest.TestCase):
+
+    def test_youtube_spellings_share_a_key(self):
+        urls = [
+            'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            'https://youtube.com/watch?v=dQw4w9WgXcQ&t=42s',
+            'https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ',
+            'https://youtu.be/dQw4w9WgXcQ',
+            'youtu.be/dQw4w9WgXcQ',
+            'https://www.youtube.com/shorts/dQw4w9WgXcQ',
+        ]
+        self.assertEqual({canonical_key(u) for u in urls}, {'youtube:dQw4w9WgXcQ'})
+
+    def test_playlist_key(self):
+        self.assertEqual(canonical_key('https://www.youtube.com/playlist?list=PL123'), 'youtube:playlist:PL123')
+
+    def test_other_urls_drop_fragment(self):
+        self.assertEqual(canonical_key('HTTPS://Example.com/v/1?a=b#frag'), 'https://example.com/v/1?a=b')
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def test_hit_and_miss_counters(self):
+        cache = MetadataCache()
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', {'title': 'x'})
+        self.assertEqual(cache.get('a'), {'title': 'x'})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = MetadataCache(ttl=10, clock=clock)
+        cache.put('a', 1)
+        clock.now += 11
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction_by_count(self):
+        cache = MetadataCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_eviction_by_bytes(self):
+        cache = MetadataCache(max_bytes=50)
+        cache.put('a', 'x' * 30)
+        cache.put('b', 'y' * 30)
+        self.assertIsNone(cache.get('a'))
+        self.assertLessEqual(cache.stats()['bytes'], 50)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'cache.json')
+            cache = MetadataCache(path=path)
+            cache.put('a', {'title': 'x'})
+            cache.save()
+
+            restored = MetadataCache(path=path)
+            restored.load()
+            self.assertEqual(restored.get('a'), {'title': 'x'})
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_file(self, name, size):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_key_depends_on_format_and_postprocessor(self):
+        mp3 = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}]
+        self.assertEqual(DownloadCache.key_for('youtube:a', 'bestaudio/best', mp3),
+                         DownloadCache.key_for('youtube:a', 'bestaudio/best', mp3))
+        self.assertNotEqual(DownloadCache.key_for('youtube:a', 'bestaudio/best', mp3),
+                            DownloadCache.key_for('youtube:a', 'bestaudio/best'))
+        self.assertNotEqual(DownloadCache.key_for('youtube:a', '18'),
+                            DownloadCache.key_for('youtube:a', '22'))
+
+    def test_add_and_acquire(self):
+        cache = DownloadCache(os.path.join(self.root, 'cache'))
+        self.assertIsNone(cache.acquire('k'))
+        path = cache.add('k', self.make_file('a.mp4', 10))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(os.path.basename(path), 'a.mp4')
+        self.assertEqual(cache.acquire('k'), path)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_evicts_unreferenced_entries_only(self):
+        cache = DownloadCache(os.path.join(self.root, 'cache'), max_bytes=15)
+        in_use = cache.add('a', self.make_file('a.mp4', 10))
+        released = cache.add('b', self.make_file('b.mp4', 10))
+        self.assertTrue(os.path.exists(in_use))
+
+        cache.release('b')
+        cache.add('c', self.make_file('c.mp4', 1))
+        self.assertTrue(os.path.exists(in_use))
+        self.assertFalse(os.path.exists(released))
+        self.assertIsNone(cache.acquire('b'))
+
+    def test_load_indexes_existing_entries(self):
+        folder = os.path.join(self.root, 'cache')
+        DownloadCache(folder).add('k', self.make_file('a.mp4', 10))
+
+        cache = DownloadCache(folder)
+        cache.load()
+        self.assertEqual(cache.stats()['bytes'], 10)
+        self.assertIsNotNone(cache.acquire('k'))
+
+    def test_processes_share_references_and_budget(self):
+        folder = os.path.join(self.root, 'cache')
+        a = DownloadCache(folder, max_bytes=15, shared=True)
+        b = DownloadCache(folder, max_bytes=15, shared=True)
+        a.load()
+        b.load()
+        held = a.add('a', self.make_file('a.mp4', 10))
+        b.add('b', self.make_file('b.mp4', 10))
+        self.assertTrue(os.path.exists(held))
+
+        # Another process delivering the result drops the reference
+        b.release('a')
+        b.release('b')
+        b.add('c', self.make_file('c.mp4', 1))
+        self.assertFalse(os.path.exists(held))
+        self.assertIsNone(a.acquire('a'))
+
+    def test_load_leaves_folders_being_filled(self):
+        folder = os.path.join(self.root, 'cache')
+        cache = DownloadCache(folder)
+        os.makedirs(os.path.join(folder, 'filling'))
+        cache.load()
+        self.assertTrue(os.path.isdir(os.path.join(folder, 'filling')))
+
+    def test_load_drops_references_of_an_earlier_run(self):
+        folder = os.path.join(self.root, 'cache')
+        DownloadCache(folder).add('k', self.make_file('a.mp4', 10))
+        cache = DownloadCache(folder, max_bytes=5)
+        cache.load()
+        self.assertIsNone(cache.acquire('k'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,75 +1,135 @@
-
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 import os
 import sys
+import tempfile
+import threading
 
 # Add the parent directory to the sys.path to allow imports from the app
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from downloads import download_file
+from app import app, extraction_cache, download_limiter
+from downloads import client_streams
+from engine import STREAM_FORMATS, live_folders
 
 class TestDownloads(unittest.TestCase):
 
-    @patch('downloads.tempfile.mkdtemp')
-    @patch('downloads.YoutubeDL')
-    @patch('downloads.send_file')
-    @patch('downloads.shutil')
-    def test_download_video(self, mock_shutil, mock_send_file, mock_youtube_dl, mock_mkdtemp):
-        # Arrange
-        mock_mkdtemp.return_value = '/tmp/testdir'
-        mock_youtube_dl.return_value.__enter__.return_value.extract_info.return_value = {}
-        
-        # Mock os.listdir to return a dummy file
-        with patch('os.listdir', return_value=['test.mp4']):
-            # Act
-            download_file('some_url', 'video', None, None)
-
-            # Assert
-            mock_youtube_dl.assert_called_once()
-            mock_send_file.assert_called_once()
-
-    @patch('downloads.tempfile.mkdtemp')
-    @patch('downloads.YoutubeDL')
-    @patch('downloads.send_file')
-    @patch('downloads.shutil')
-    def test_download_audio(self, mock_shutil, mock_send_file, mock_youtube_dl, mock_mkdtemp):
-        # Arrange
-        mock_mkdtemp.return_value = '/tmp/testdir'
-        mock_youtube_dl.return_value.__enter__.return_value.extract_info.return_value = {}
-        
-        with patch('os.listdir', return_value=['test.mp3']):
-            # Act
-            download_file('some_url', 'audio', None, None)
-
-            # Assert
-            mock_youtube_dl.assert_called_once()
-            mock_send_file.assert_called_once()
-
-    @patch('downloads.tempfile.mkdtemp')
-    @patch('downloads.YoutubeDL')
-    @patch('downloads.send_file')
-    @patch('downloads.shutil')
-    def test_download_playlist(self, mock_shutil, mock_send_file, mock_youtube_dl, mock_mkdtemp):
-        # Arrange
-        mock_mkdtemp.return_value = '/tmp/testdir'
-        mock_youtube_dl.return_value.__enter__.return_value.extract_info.return_value = {}
-        mock_shutil.make_archive.return_value = '/tmp/testdir.zip'
-
-        # Act
-        download_file('some_url', 'playlist', None, 'video')
-
-        # Assert
-        mock_youtube_dl.assert_called_once()
-        mock_shutil.make_archive.assert_called_once()
-        mock_send_file.assert_called_once()
+    def setUp(self):
+        self.app = app.test_client()
+        extraction_cache.clear()
+        download_limiter.clear()
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        patcher = patch('engine.DOWNLOAD_FOLDER', self.folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
-    def test_download_no_url(self):
-        # Act
-        response, status_code = download_file(None, 'video', None, None)
+    def fake_download(self, mock_youtube_dl, ext, release):
+        """Makes YoutubeDL write b'first', wait for `release`, then write b'second'."""
+        def extract_info(url, download=True):
+            params = mock_youtube_dl.call_args[0][0]
+            path = params['outtmpl'].replace('%(id)s.%(ext)s', 'x.' + ext)
+            with open(path, 'wb') as f:
+                f.write(b'first')
+                f.flush()
+                for hook in params['progress_hooks']:
+                    hook({'status': 'downloading', 'filename': path, 'downloaded_bytes': 5})
+                while not release.wait(0.01):
+                    params['job_budget'].check()
+                f.write(b'second')
+            for hook in params['progress_hooks']:
+                hook({'status': 'finished', 'filename': path})
+            return {'id': 'x'}
+
+        mock_youtube_dl.return_value.__enter__.return_value.extract_info.side_effect = extract_info
+
+    def stream(self, **data):
+        return self.app.post('/download/stream', json=data, buffered=False)
+
+    @patch('engine.YoutubeDL')
+    def test_download_video(self, mock_youtube_dl):
+        release = threading.Event()
+        self.fake_download(mock_youtube_dl, 'mp4', release)
+
+        response = self.stream(url='https://youtu.be/x', mode='video')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'video/mp4')
+        self.assertIn('filename="x.mp4"', response.headers['Content-Disposition'])
+        chunks = iter(response.response)
+        # The first bytes arrive while the download is still running
+        self.assertEqual(next(chunks), b'first')
+        release.set()
+        self.assertEqual(b''.join(chunks), b'second')
+        response.close()
+
+        params = mock_youtube_dl.call_args[0][0]
+        self.assertEqual(params['format'], STREAM_FORMATS['video'])
+        self.assertTrue(params['nopart'])
+        self.assertEqual(os.listdir(self.folder), [])
+        self.assertEqual(live_folders, set())
+
+    @patch('engine.YoutubeDL')
+    def test_download_audio(self, mock_youtube_dl):
+        release = threading.Event()
+        release.set()
+        self.fake_download(mock_youtube_dl, 'm4a', release)
+
+        response = self.stream(url='https://youtu.be/x', mode='audio')
+        self.assertEqual(response.get_data(), b'firstsecond')
+        response.close()
+        self.assertEqual(mock_youtube_dl.call_args[0][0]['format'], STREAM_FORMATS['audio'])
 
-        # Assert
-        self.assertEqual(status_code, 400)
+    @patch('engine.YoutubeDL')
+    def test_closing_the_response_cancels_the_download(self, mock_youtube_dl):
+        release = threading.Event()
+        self.fake_download(mock_youtube_dl, 'mp4', release)
+
+        response = self.stream(url='https://youtu.be/x')
+        self.assertEqual(next(iter(response.response)), b'first')
+        response.close()
+        self.assertEqual(os.listdir(self.folder), [])
+        self.assertEqual(live_folders, set())
+
+    @patch('engine.YoutubeDL')
+    def test_download_failure(self, mock_youtube_dl):
+        mock_youtube_dl.return_value.__enter__.return_value.extract_info.side_effect = \
+            Exception('ERROR: Private video. Sign in if you have access')
+        response = self.stream(url='https://youtu.be/x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'This is a private video.')
+        self.assertEqual(os.listdir(self.folder), [])
+
+    @patch('engine.YoutubeDL')
+    def test_streams_per_client_are_capped(self, mock_youtube_dl):
+        release = threading.Event()
+        self.fake_download(mock_youtube_dl, 'mp4', release)
+
+        with patch('downloads.MAX_STREAMS_PER_CLIENT', 1):
+            first = self.stream(url='https://youtu.be/x')
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(self.stream(url='https://youtu.be/y').status_code, 429)
+            release.set()
+            first.close()
+        self.assertEqual(client_streams, {})
+
+    def test_stream_is_rate_limited(self):
+        with patch.object(download_limiter, 'acquire', return_value=3):
+            response = self.stream(url='https://youtu.be/x')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '3')
+
+    def test_download_playlist(self):
+        response = self.stream(url='https://www.youtube.com/playlist?list=x', mode='playlist')
+        self.assertEqual(response.status_code, 400)
+
+    def test_merged_format_is_refused(self):
+        response = self.stream(url='https://youtu.be/x', format_id='137+140')
+        self.assertEqual(response.status_code, 400)
+
+    def test_download_no_url(self):
+        response = self.stream(mode='video')
+        self.assertEqual(response.status_code, 400)
         self.assertIn('error', response.get_json())
 
 if __name__ == '__main__':
@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+import threading
+import time
+
+from events import TaskEvents
+
+
+class TestTaskEvents(unittest.TestCase):
+
+    def test_wait_returns_immediately_when_version_moved(self):
+        events = TaskEvents()
+        events.notify('a')
+        self.assertEqual(events.wait('a', 0, timeout=1), 1)
+
+    def test_wait_times_out_without_changes(self):
+        events = TaskEvents()
+        start = time.monotonic()
+        self.assertEqual(events.wait('a', 0, timeout=0.05), 0)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_notify_wakes_only_that_task(self):
+        events = TaskEvents()
+        woken = {}
+
+        def listen(task_id):
+            woken[task_id] = events.wait(task_id, 0, timeout=0.3)
+
+        threads = [threading.Thread(target=listen, args=(t,)) for t in ('a', 'b')]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        events.notify('a')
+        for t in threads:
+            t.join()
+        self.assertEqual(woken, {'a': 1, 'b': 0})
+
+    def test_forget_wakes_listeners(self):
+        events = TaskEvents()
+        events.notify('a')
+        result = []
+        thread = threading.Thread(target=lambda: result.append(events.wait('a', 1, timeout=1)))
+        thread.start()
+        time.sleep(0.05)
+        events.forget('a')
+        thread.join()
+        self.assertEqual(result, [0])
+
+    def test_wait_async_woken_from_another_thread(self):
+        events = TaskEvents()
+
+        async def listen():
+            threading.Timer(0.05, events.notify, args=('a',)).start()
+            return await events.wait_async('a', 0, timeout=1)
+
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(listen()), 1)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(events._watchers, {})
+
+    def test_wait_async_times_out_without_changes(self):
+        events = TaskEvents()
+        self.assertEqual(asyncio.run(events.wait_async('a', 0, timeout=0.05)), 0)
+        self.assertEqual(events._watchers, {})
+
+if __name__ == '__main__':
+    unittest.main()
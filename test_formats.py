@@ -0,0 +1,71 @@
+import unittest
+
+from formats import rank_formats, download_selector, codec_family, estimate_size
+
+FORMATS = [
+    {'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none', 'format_note': 'storyboard'},
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129.5, 'filesize': 3000},
+    {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 135.0, 'filesize': 3100},
+    {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'fps': 30,
+     'tbr': 500},
+    {'format_id': '134', 'ext': 'mp4', 'vcodec': 'avc1.4d401e', 'acodec': 'none', 'height': 360, 'fps': 30,
+     'tbr': 300},
+    {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720, 'fps': 30,
+     'filesize': 20000},
+    {'format_id': '298', 'ext': 'mp4', 'vcodec': 'avc1.4d4020', 'acodec': 'none', 'height': 720, 'fps': 60,
+     'filesize': 30000},
+    {'format_id': '302', 'ext': 'webm', 'vcodec': 'vp09.00.40.08', 'acodec': 'none', 'height': 720, 'fps': 60,
+     'filesize': 25000},
+    {'format_id': '999', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 1080, 'has_drm': True},
+]
+
+
+class TestRankFormats(unittest.TestCase):
+
+    def test_ranks_best_first_and_pairs_audio(self):
+        options = rank_formats({'duration': 100, 'formats': FORMATS})
+        self.assertEqual([o['selector'] for o in options], ['298+140', '302+251', '18', '251', '140'])
+
+        best = options[0]
+        self.assertEqual(best['label'], '720p60 avc1')
+        self.assertEqual((best['vcodec'], best['acodec'], best['ext']), ('avc1', 'mp4a', 'mp4'))
+        self.assertEqual(best['filesize'], 33000)
+
+    def test_keeps_best_format_per_resolution_and_codec(self):
+        options = rank_formats({'formats': FORMATS})
+        selectors = [o['selector'] for o in options]
+        self.assertNotIn('136+140', selectors)
+        self.assertNotIn('134+140', selectors)  # muxed 18 has the higher bitrate
+
+    def test_drops_unusable_formats(self):
+        selectors = [o['selector'] for o in rank_formats({'formats': FORMATS})]
+        self.assertFalse(any(s.startswith(('sb0', '999')) for s in selectors))
+
+    def test_video_only_without_audio_is_offered_alone(self):
+        options = rank_formats({'formats': [FORMATS[5]]})
+        self.assertEqual(options[0]['selector'], '136')
+        self.assertIsNone(options[0]['acodec'])
+
+    def test_size_estimated_from_bitrate(self):
+        self.assertEqual(estimate_size({'tbr': 800}, 10), 1_000_000)
+        self.assertIsNone(estimate_size({'tbr': 800}, None))
+        self.assertIsNone(rank_formats({'formats': FORMATS})[2]['filesize'])
+
+    def test_codec_family(self):
+        self.assertEqual(codec_family('vp09.00.40.08'), 'vp9')
+        self.assertEqual(codec_family('avc1.640028'), 'avc1')
+        self.assertIsNone(codec_family('none'))
+
+
+class TestDownloadSelector(unittest.TestCase):
+
+    def test_selectors_pass_through(self):
+        self.assertEqual(download_selector('298+140'), '298+140')
+        self.assertEqual(download_selector('best[height<=720]'), 'best[height<=720]')
+
+    def test_bare_id_merges_best_audio(self):
+        self.assertEqual(download_selector('136'), '136+bestaudio[ext=m4a]/136+bestaudio/136')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import io
+
+from yt_dlp.networking.common import Response
+from yt_dlp.networking.exceptions import HTTPError
+
+from governor import OutboundGovernor, governed, is_rate_limited
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestOutboundGovernor(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make_governor(self, **kwargs):
+        return OutboundGovernor(clock=self.clock, sleep=self.clock.sleep, jitter=lambda: 1.0, **kwargs)
+
+    def test_requests_are_paced_after_burst(self):
+        governor = self.make_governor(rate=2, burst=2)
+        for _ in range(4):
+            governor.acquire()
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+        self.assertEqual(governor.stats()['requests'], 4)
+
+    def test_bandwidth_is_paced(self):
+        governor = self.make_governor(bandwidth=1000)
+        governor.consume(1000)
+        self.assertEqual(self.clock.slept, [])
+        governor.consume(2000)
+        self.assertEqual(self.clock.slept, [2.0])
+        self.assertEqual(governor.stats()['bytes'], 3000)
+
+    def test_progress_hook_counts_new_bytes_per_file(self):
+        governor = self.make_governor()
+        for downloaded in (100, 300):
+            governor.progress_hook({'status': 'downloading', 'tmpfilename': 'a.part', 'downloaded_bytes': downloaded})
+        governor.progress_hook({'status': 'downloading', 'tmpfilename': 'b.part', 'downloaded_bytes': 50})
+        governor.progress_hook({'status': 'finished', 'tmpfilename': 'a.part'})
+        self.assertEqual(governor.stats()['bytes'], 350)
+
+    def test_backoff_grows_until_success(self):
+        governor = self.make_governor(backoff_base=5, backoff_max=12)
+        self.assertEqual([governor.throttled() for _ in range(3)], [5, 10, 12])
+        self.assertEqual(governor.backoff_remaining(), 12)
+
+        governor.acquire()
+        self.assertEqual(self.clock.slept, [12])
+        governor.succeeded()
+        self.assertEqual(governor.throttled(), 5)
+        self.assertEqual(governor.stats()['throttled'], 4)
+
+
+class TestGoverned(unittest.TestCase):
+
+    def test_urlopen_reports_429(self):
+        governor = OutboundGovernor(backoff_base=5, jitter=lambda: 1.0)
+
+        class FakeYoutubeDL:
+            def __init__(self, params=None, auto_init=True):
+                self.hooks = []
+
+            def add_progress_hook(self, hook):
+                self.hooks.append(hook)
+
+            def urlopen(self, req):
+                raise HTTPError(Response(io.BytesIO(b''), req, {}, status=429))
+
+        ydl = governed(FakeYoutubeDL, governor)()
+        self.assertEqual(ydl.hooks, [governor.progress_hook])
+        with self.assertRaises(HTTPError) as cm:
+            ydl.urlopen('https://example.com/')
+        self.assertTrue(is_rate_limited(cm.exception))
+        self.assertGreater(governor.backoff_remaining(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
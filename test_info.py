@@ -8,15 +8,18 @@ import json
 # Add the parent directory to the sys.path to allow imports from the app
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app import app
+from app import app, info_cache, info_limiter, ydl_pool
 
 class TestInfo(unittest.TestCase):
 
     def setUp(self):
         self.app = app.test_client()
         self.app.testing = True
+        info_cache.clear()
+        info_limiter.clear()
+        ydl_pool.clear()
 
-    @patch('info.YoutubeDL')
+    @patch('engine.YoutubeDL')
     def test_get_info_video(self, mock_youtube_dl):
         # Arrange
         mock_youtube_dl.return_value.__enter__.return_value.extract_info.return_value = {
@@ -26,6 +29,9 @@ class TestInfo(unittest.TestCase):
             'thumbnail': 'test_thumbnail',
             'formats': []
         }
+        ydl = mock_youtube_dl.return_value.__enter__.return_value
+        ydl.process_ie_result.side_effect = lambda info, **kwargs: info
+        ydl.sanitize_info.side_effect = lambda info, **kwargs: info
 
         # Act
         response = self.app.post('/info',
@@ -38,7 +44,7 @@ class TestInfo(unittest.TestCase):
         self.assertEqual(data['type'], 'video')
         self.assertEqual(data['id'], 'test_id')
 
-    @patch('info.YoutubeDL')
+    @patch('engine.YoutubeDL')
     def test_get_info_playlist(self, mock_youtube_dl):
         # Arrange
         mock_youtube_dl.return_value.__enter__.return_value.extract_info.return_value = {
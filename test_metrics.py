@@ -0,0 +1,47 @@
+import unittest
+
+from metrics import Registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_counter(self):
+        registry = Registry()
+        errors = registry.counter('errors_total', 'Errors.', ('category',))
+        errors.inc('private')
+        errors.inc('private')
+        errors.inc('say "hi"\n')
+        self.assertEqual(registry.render(), (
+            '# HELP errors_total Errors.\n'
+            '# TYPE errors_total counter\n'
+            'errors_total{category="private"} 2\n'
+            'errors_total{category="say \\"hi\\"\\n"} 1\n'
+        ))
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        seconds = registry.histogram('stage_seconds', 'Stages.', ('stage',), buckets=(1, 5))
+        for value in (0.5, 1, 3, 7):
+            seconds.observe(value, 'download')
+        lines = registry.render().splitlines()[2:]
+        self.assertEqual(lines, [
+            'stage_seconds_bucket{stage="download",le="1"} 2',
+            'stage_seconds_bucket{stage="download",le="5"} 3',
+            'stage_seconds_bucket{stage="download",le="+Inf"} 4',
+            'stage_seconds_sum{stage="download"} 11.5',
+            'stage_seconds_count{stage="download"} 4',
+        ])
+
+    def test_collected_values_are_read_on_render(self):
+        registry = Registry()
+        depth = {'single': 1}
+        registry.collected('queue_depth', 'Depth.', lambda: {(k,): v for k, v in depth.items()}, ('lane',))
+        registry.collected('tasks', 'Tasks.', lambda: 3)
+        depth['single'] = 4
+        output = registry.render()
+        self.assertIn('queue_depth{lane="single"} 4\n', output)
+        self.assertIn('tasks 3\n', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from profiles import transfer_opts, fragment_share, retry_sleep, MAX_RETRY_SLEEP
+
+
+class TestTransferProfiles(unittest.TestCase):
+
+    def test_fragment_share_splits_slots_between_jobs(self):
+        self.assertEqual(fragment_share(32, 8), 4)
+        self.assertEqual(fragment_share(4, 16), 1)
+        self.assertEqual(fragment_share(32, 0), 32)
+
+    def test_fragment_share_stays_within_request_rate(self):
+        self.assertEqual(fragment_share(32, 2, request_rate=20), 10)
+        self.assertEqual(fragment_share(32, 2, request_rate=0.5), 1)
+        self.assertEqual(fragment_share(32, 2, request_rate=0), 16)
+
+    def test_profile_fragments_capped_by_share(self):
+        self.assertEqual(transfer_opts('video', 4)['concurrent_fragment_downloads'], 4)
+        self.assertEqual(transfer_opts('video', 32)['concurrent_fragment_downloads'], 8)
+        self.assertEqual(transfer_opts('audio', 32)['concurrent_fragment_downloads'], 2)
+
+    def test_chunked_only_where_configured(self):
+        self.assertNotIn('http_chunk_size', transfer_opts('audio', 4))
+        self.assertEqual(transfer_opts('playlist_entry', 4)['http_chunk_size'], 10 * 1024 * 1024)
+
+    def test_retry_sleep_backs_off(self):
+        self.assertEqual([retry_sleep(n) for n in range(4)], [1, 2, 4, 8])
+        self.assertEqual(retry_sleep(20), MAX_RETRY_SLEEP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from progress import ProgressTracker
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgressTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.task = {}
+        self.clock = FakeClock()
+        self.tracker = ProgressTracker(self.task, interval=0.5, clock=self.clock)
+
+    def downloading(self, downloaded, total=1000, filename='a.mp4', index=None):
+        self.tracker.progress_hook({
+            'status': 'downloading', 'filename': filename, 'downloaded_bytes': downloaded,
+            'total_bytes': total, 'speed': 50.0, 'eta': 3, 'info_dict': {'playlist_index': index},
+        })
+
+    def test_initial_phase(self):
+        self.assertEqual(self.task['progress']['phase'], 'extracting')
+
+    def test_byte_progress_is_throttled(self):
+        self.downloading(100)
+        self.assertEqual(self.task['progress']['downloaded_bytes'], 100)
+        self.assertEqual(self.task['progress']['phase'], 'downloading')
+
+        self.clock.now += 0.1
+        self.downloading(200)
+        self.assertEqual(self.task['progress']['downloaded_bytes'], 100)
+
+        self.clock.now += 0.5
+        self.downloading(300)
+        progress = self.task['progress']
+        self.assertEqual((progress['downloaded_bytes'], progress['total_bytes']), (300, 1000))
+        self.assertEqual((progress['speed'], progress['eta']), (50.0, 3))
+
+    def test_finished_download_published_immediately(self):
+        self.downloading(100)
+        self.tracker.progress_hook({'status': 'finished', 'filename': 'a.mp4', 'total_bytes': 1000, 'info_dict': {}})
+        self.assertEqual(self.task['progress']['downloaded_bytes'], 1000)
+
+    def test_postprocessor_phases(self):
+        self.tracker.postprocessor_hook({'status': 'started', 'postprocessor': 'Merger'})
+        self.assertEqual(self.task['progress']['phase'], 'merging')
+        self.tracker.postprocessor_hook({'status': 'started', 'postprocessor': 'ExtractAudio'})
+        self.assertEqual(self.task['progress']['phase'], 'transcoding')
+
+    def test_playlist_entries_are_summed(self):
+        self.tracker.set_entries(3)
+        self.downloading(100, index=1, filename='1.mp4')
+        self.clock.now += 1
+        self.downloading(200, index=2, filename='2.mp4')
+        self.tracker.entry_done()
+        progress = self.task['progress']
+        self.assertEqual(progress['downloaded_bytes'], 300)
+        self.assertEqual(progress['total_bytes'], 2000)
+        self.assertEqual(progress['speed'], 100.0)
+        self.assertEqual((progress['entry'], progress['entries_done'], progress['entries_total']), (2, 1, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from ratelimit import RateLimiter
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_burst_then_steady_rate(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=3, clock=clock)
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+        clock.now = 0.5
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.stats()['limited'], 1)
+
+    def test_take_grants_what_the_bucket_holds(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=3, clock=clock)
+        self.assertEqual(limiter.take('a', 2), (2, 0))
+        taken, wait = limiter.take('a', 5)
+        self.assertEqual(taken, 1)
+        self.assertAlmostEqual(wait, 0.5)
+        clock.now = 1
+        self.assertEqual(limiter.take('a', 2), (2, 0))
+
+    def test_clients_have_separate_buckets(self):
+        limiter = RateLimiter(rate=1, burst=1, clock=FakeClock())
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertGreater(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('b'), 0)
+
+    def test_zero_rate_disables_limit(self):
+        limiter = RateLimiter(rate=0, burst=1, clock=FakeClock())
+        self.assertEqual([limiter.acquire('a') for _ in range(5)], [0] * 5)
+
+    def test_full_buckets_are_pruned(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=1, burst=1, clock=clock)
+        for i in range(1023):
+            limiter.acquire(i)
+        clock.now = 10
+        limiter.acquire('last')
+        self.assertEqual(limiter.stats()['clients'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
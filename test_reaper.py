@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import socket
+import tempfile
+
+from reaper import Reaper, BUSY, ORPHAN_GRACE, OWNER_FILE, make_job_dir
+
+
+class TestReaper(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.folder = self.tmpdir.name
+        self.owners = {}
+        self.evicted = []
+        self.now = 10000.0
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_entry(self, name, size, age):
+        path = os.path.join(self.folder, name)
+        os.mkdir(path)
+        with open(os.path.join(path, 'file'), 'wb') as f:
+            f.write(b'x' * size)
+        mtime = self.now - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def make_reaper(self, max_age=3600, max_bytes=0, batch=64):
+        def evict(path, owner):
+            self.evicted.append((os.path.basename(path), owner))
+            shutil.rmtree(path)
+        return Reaper(self.folder, max_age, max_bytes, owners=lambda: self.owners, evict=evict,
+                      prefix='tmp', batch=batch, clock=lambda: self.now)
+
+    def test_evicts_entries_past_max_age(self):
+        old = self.make_entry('tmp-old', 10, age=7200)
+        self.make_entry('tmp-new', 10, age=100)
+        self.owners[old] = 'task'
+        reaper = self.make_reaper()
+        self.assertEqual(reaper.sweep(), 10)
+        self.assertEqual(self.evicted, [('tmp-old', 'task')])
+        self.assertEqual(reaper.stats()['reclaimed_bytes'], 10)
+
+    def test_size_budget_evicts_orphans_then_oldest(self):
+        owned_old = self.make_entry('tmp-a', 100, age=3000)
+        owned_new = self.make_entry('tmp-b', 100, age=200)
+        self.make_entry('tmp-orphan', 100, age=ORPHAN_GRACE + 1)
+        busy = self.make_entry('tmp-busy', 100, age=3500)
+        self.owners.update({owned_old: 'a', owned_new: 'b', busy: BUSY})
+        reaper = self.make_reaper(max_bytes=250)
+        self.assertEqual(reaper.sweep(), 200)
+        self.assertEqual([name for name, _ in self.evicted], ['tmp-orphan', 'tmp-a'])
+        self.assertTrue(os.path.exists(busy))
+
+    def test_young_orphans_and_foreign_files_are_kept(self):
+        self.make_entry('tmp-starting', 10, age=1)
+        self.make_entry('My video.mp4', 10, age=99999)
+        self.assertEqual(self.make_reaper(max_bytes=1).sweep(), 0)
+        self.assertEqual(self.evicted, [])
+
+    def test_jobs_of_other_running_processes_are_kept(self):
+        path = make_job_dir(self.folder, 'tmp')
+        with open(os.path.join(path, OWNER_FILE), 'w') as f:
+            f.write(f'{socket.gethostname()}:{os.getppid()}')
+        os.utime(path, (self.now - 99999,) * 2)
+        self.assertEqual(self.make_reaper(max_bytes=1).sweep(), 0)
+
+        with open(os.path.join(path, OWNER_FILE), 'w') as f:
+            f.write('otherhost:1')
+        os.utime(path, (self.now - 99999,) * 2)
+        self.make_reaper(max_bytes=1).sweep()
+        self.assertEqual(self.evicted, [(os.path.basename(path), None)])
+
+    def test_scan_is_incremental(self):
+        for i in range(5):
+            self.make_entry(f'tmp{i}', 10, age=10)
+        reaper = self.make_reaper(batch=2)
+        self.assertEqual(reaper.scan(), 3)
+        self.assertEqual(reaper.scan(), 1)
+        self.assertEqual(reaper.scan(), 0)
+        self.assertEqual(reaper.total_bytes(), 50)
+
+        shutil.rmtree(os.path.join(self.folder, 'tmp0'))
+        self.assertEqual(reaper.scan(), 0)
+        self.assertEqual(reaper.total_bytes(), 40)
+
+    def test_sweep_orphans_ignores_max_age(self):
+        owned = self.make_entry('tmp-owned', 10, age=ORPHAN_GRACE + 1)
+        self.make_entry('tmp-crashed', 10, age=ORPHAN_GRACE + 1)
+        self.make_entry('tmp-starting', 10, age=1)
+        self.owners[owned] = 'task'
+        self.assertEqual(self.make_reaper(batch=1).sweep_orphans(), 10)
+        self.assertEqual(self.evicted, [('tmp-crashed', None)])
+
+    def test_sweep_orphans_keeps_jobs_of_other_running_processes(self):
+        mine = make_job_dir(self.folder, 'tmp')
+        other = make_job_dir(self.folder, 'tmp')
+        with open(os.path.join(other, OWNER_FILE), 'w') as f:
+            f.write(f'{socket.gethostname()}:{os.getppid()}')
+        for path in (mine, other):
+            os.utime(path, (self.now - ORPHAN_GRACE - 1,) * 2)
+        self.make_reaper().sweep_orphans()
+        self.assertEqual(self.evicted, [(os.path.basename(mine), None)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from stages import StageTimings, deferring
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeYoutubeDL:
+
+    def __init__(self, params):
+        self.params = params
+        self.processed = []
+
+    def post_process(self, filename, info, files_to_move=None):
+        self.processed.append(filename)
+        return {**info, 'filepath': filename + '.mp4'}
+
+
+class TestStageTimings(unittest.TestCase):
+
+    def test_totals_per_stage(self):
+        clock = FakeClock()
+        timings = StageTimings(clock=clock)
+        clock.now = 2.0
+        self.assertEqual(timings.record('download', 0.0), 2.0)
+        clock.now = 3.0
+        timings.record('download', 2.0)
+        timings.record('postprocess', 2.5)
+        self.assertEqual(timings.stats(), {
+            'download': {'count': 2, 'avg': 1.5, 'max': 2.0, 'total': 3.0},
+            'postprocess': {'count': 1, 'avg': 0.5, 'max': 0.5, 'total': 0.5},
+        })
+
+
+class TestDeferring(unittest.TestCase):
+
+    def test_postprocessing_is_deferred_when_asked(self):
+        jobs = []
+        ydl = deferring(FakeYoutubeDL)({'deferred_postprocessing': jobs})
+        info = ydl.post_process('video', {'id': 'x'})
+        self.assertEqual(info['filepath'], 'video')
+        self.assertEqual(ydl.processed, [])
+
+        self.assertEqual(jobs[0]()['filepath'], 'video.mp4')
+        self.assertEqual(ydl.processed, ['video'])
+
+    def test_runs_inline_by_default(self):
+        ydl = deferring(FakeYoutubeDL)({})
+        self.assertEqual(ydl.post_process('video', {})['filepath'], 'video.mp4')
+
+
+if __name__ == '__main__':
+    unittest.main()
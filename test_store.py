@@ -0,0 +1,156 @@
+import unittest
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from store import MemoryTaskStore, SQLiteTaskStore, open_task_store
+
+
+def make_task(task_id, lane='single', enqueued_at=1.0):
+    return {'task_id': task_id, 'url': 'u', 'mode': 'video', 'status': 'pending',
+            'result': None, 'error': None, 'lane': lane, 'enqueued_at': enqueued_at}
+
+
+class TestSQLiteTaskStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'tasks.db')
+        self.store = SQLiteTaskStore(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_open_task_store(self):
+        self.assertIsInstance(open_task_store(None), MemoryTaskStore)
+        self.assertIsInstance(open_task_store(self.path), SQLiteTaskStore)
+
+    def test_mapping_roundtrip(self):
+        self.store['a'] = make_task('a')
+        self.assertIn('a', self.store)
+        self.assertNotIn(None, self.store)
+        self.assertEqual(self.store['a']['url'], 'u')
+        self.assertEqual(list(self.store), ['a'])
+        del self.store['a']
+        self.assertIsNone(self.store.get('a'))
+
+    def test_volatile_fields_are_not_persisted(self):
+        task = make_task('a')
+        task['progress'] = {'phase': 'downloading'}
+        self.store['a'] = task
+
+        other = SQLiteTaskStore(self.path)
+        self.assertNotIn('progress', other['a'])
+        self.assertEqual(self.store['a']['progress'], {'phase': 'downloading'})
+
+    def test_claim_is_fifo_per_lane_and_exclusive(self):
+        self.store['b'] = make_task('b', enqueued_at=2.0)
+        self.store['a'] = make_task('a', enqueued_at=1.0)
+        self.store['p'] = make_task('p', lane='playlist')
+
+        other = SQLiteTaskStore(self.path)
+        other.owner = 'otherhost:1'
+        self.assertEqual(self.store.claim('single'), 'a')
+        self.assertEqual(other.claim('single'), 'b')
+        self.assertIsNone(self.store.claim('single'))
+        self.assertEqual(self.store.pending_count('playlist'), 1)
+        self.assertEqual(other['b']['status'], 'processing')
+
+    def test_claim_prefers_clients_with_less_in_progress(self):
+        for i in range(3):
+            self.store[f'a{i}'] = dict(make_task(f'a{i}', enqueued_at=i), client='a')
+        self.store['b0'] = dict(make_task('b0', enqueued_at=10), client='b')
+
+        self.assertEqual(self.store.claim('single'), 'a0')
+        self.assertEqual(self.store.claim('single'), 'b0')
+        self.assertEqual(self.store.queue('single').count('a'), 2)
+
+    def test_client_counts_follow_task_state(self):
+        self.store['a'] = dict(make_task('a'), client='a')
+        self.store['b'] = dict(make_task('b', enqueued_at=2.0), client='a')
+        task = self.store[self.store.claim('single')]
+        self.assertEqual(self.store.queue('single').count('a'), 1)
+        task['status'] = 'completed'
+        self.store.save(task)
+        del self.store['b']
+        self.store['c'] = dict(make_task('c'), client='c')
+        self.store['c'] = dict(make_task('c'), client='d')
+        self.assertEqual(self.store._db().execute('SELECT lane, client, pending, processing FROM lane_clients')
+                         .fetchall(), [('single', 'd', 1, 0)])
+
+    def test_old_databases_are_migrated(self):
+        path = os.path.join(self.tmpdir.name, 'old.db')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE tasks (task_id TEXT PRIMARY KEY, lane TEXT, state TEXT NOT NULL, '
+                   'data TEXT NOT NULL, enqueued_at REAL, owner TEXT, heartbeat REAL)')
+        for task_id, state, client in (('a', 'processing', 'a'), ('b', 'pending', 'a'), ('c', 'pending', 'c')):
+            task = dict(make_task(task_id), status=state, client=client)
+            db.execute('INSERT INTO tasks (task_id, lane, state, data, enqueued_at) VALUES (?, ?, ?, ?, ?)',
+                       (task_id, 'single', state, json.dumps(task), 1.0))
+        db.commit()
+        db.close()
+
+        store = SQLiteTaskStore(path)
+        self.assertEqual(store.queue('single').count('a'), 1)
+        self.assertEqual(store.claim('single'), 'c')
+
+    def test_concurrent_claims_never_duplicate(self):
+        for i in range(50):
+            self.store[str(i)] = make_task(str(i), enqueued_at=i)
+        claimed = []
+        lock = threading.Lock()
+
+        def drain():
+            store = SQLiteTaskStore(self.path)
+            while True:
+                task_id = store.claim('single')
+                if task_id is None:
+                    return
+                with lock:
+                    claimed.append(task_id)
+
+        threads = [threading.Thread(target=drain) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(claimed, key=int), [str(i) for i in range(50)])
+
+    def test_save_updates_other_processes(self):
+        self.store['a'] = make_task('a')
+        other = SQLiteTaskStore(self.path)
+        other.owner = 'otherhost:1'
+        task = other[other.claim('single')]
+        task['status'] = 'completed'
+        task['result'] = '/tmp/a.mp4'
+        other.save(task)
+
+        self.assertEqual(self.store['a']['status'], 'completed')
+        self.assertEqual(self.store['a']['result'], '/tmp/a.mp4')
+
+    def test_recover_requeues_tasks_of_dead_workers(self):
+        self.store['a'] = make_task('a')
+        self.store['b'] = make_task('b', enqueued_at=2.0)
+        dead = SQLiteTaskStore(self.path)
+        dead.owner = 'otherhost:1'
+        dead.claim('single')
+        self.store.claim('single')
+        dead._db().execute('UPDATE tasks SET heartbeat = 0 WHERE owner = ?', (dead.owner,))
+
+        self.assertEqual(self.store.recover(), 1)
+        self.assertEqual(self.store['a']['status'], 'pending')
+        self.assertEqual(self.store['b']['status'], 'processing')
+
+    def test_lane_queue(self):
+        queue = self.store.queue('single')
+        self.assertTrue(queue.empty())
+        self.store['a'] = make_task('a')
+        queue.put('a')
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get(), 'a')
+        self.assertTrue(queue.empty())
+
+if __name__ == '__main__':
+    unittest.main()
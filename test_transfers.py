@@ -0,0 +1,73 @@
+import unittest
+import os
+import tempfile
+
+from transfers import TransferLedger, DeliveryFile
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTransferLedger(unittest.TestCase):
+
+    def test_resumed_ranges_complete_delivery(self):
+        ledger = TransferLedger(retention=60)
+        ledger.touch('a')
+        self.assertFalse(ledger.record('a', 0, 40, 100))
+        self.assertFalse(ledger.record('a', 70, 100, 100))
+        self.assertTrue(ledger.record('a', 30, 80, 100))
+        self.assertEqual(len(ledger), 0)
+        # Only the first complete transfer reports delivery
+        self.assertFalse(ledger.record('a', 0, 100, 100))
+
+    def test_untouched_keys_are_ignored(self):
+        ledger = TransferLedger(retention=60)
+        self.assertFalse(ledger.record('a', 0, 100, 100))
+
+    def test_expiry_follows_last_request(self):
+        clock = FakeClock()
+        ledger = TransferLedger(retention=60, clock=clock)
+        ledger.touch('a')
+        ledger.touch('b')
+        clock.now = 50
+        ledger.touch('b')
+        clock.now = 61
+        self.assertEqual(ledger.expired(), ['a'])
+        clock.now = 111
+        self.assertEqual(ledger.expired(), ['b'])
+        self.assertEqual(len(ledger), 0)
+
+
+class TestDeliveryFile(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b'0123456789')
+        self.path = f.name
+        self.addCleanup(os.remove, self.path)
+        self.delivered = []
+
+    def test_reports_span_read_to_the_end(self):
+        f = DeliveryFile(self.path, lambda start, stop: self.delivered.append((start, stop)))
+        f.span = (4, 8)
+        f.seek(4)
+        self.assertEqual(f.read(4), b'4567')
+        f.close()
+        f.close()
+        self.assertEqual(self.delivered, [(4, 8)])
+
+    def test_interrupted_read_is_not_reported(self):
+        f = DeliveryFile(self.path, lambda start, stop: self.delivered.append((start, stop)))
+        f.span = (0, 10)
+        f.read(3)
+        f.close()
+        self.assertEqual(self.delivered, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from workers import WorkerPool, FairQueue, default_worker_count, run_bounded
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_default_worker_count(self):
+        self.assertEqual(default_worker_count(cpu_count=2, network_slots=8), 4)
+        self.assertEqual(default_worker_count(cpu_count=16, network_slots=8), 8)
+        self.assertEqual(default_worker_count(cpu_count=4, network_slots=0), 1)
+
+    def test_runs_tasks_on_all_workers(self):
+        seen = []
+        lock = threading.Lock()
+
+        def handler(task_id):
+            time.sleep(0.05)
+            with lock:
+                seen.append(task_id)
+
+        pool = WorkerPool(handler, {'single': 4})
+        pool.start()
+        start = time.time()
+        for i in range(4):
+            pool.submit(i, 'single')
+        pool.lane('single').queue.join()
+
+        self.assertEqual(sorted(seen), [0, 1, 2, 3])
+        self.assertLess(time.time() - start, 0.15)
+
+    def test_playlist_lane_does_not_block_single_lane(self):
+        release = threading.Event()
+        done = threading.Event()
+
+        def handler(task_id):
+            if task_id == 'playlist':
+                release.wait(1)
+            else:
+                done.set()
+
+        pool = WorkerPool(handler, {'single': 1, 'playlist': 1})
+        pool.start()
+        pool.submit('playlist', 'playlist')
+        pool.submit('video', 'single')
+
+        self.assertTrue(done.wait(0.5))
+        release.set()
+
+    def test_stats_report_depth_and_wait(self):
+        enqueued = {'a': time.time() - 2}
+        pool = WorkerPool(lambda task_id: None, {'single': 1}, enqueued_at=enqueued.get)
+        pool.submit('a', 'single')
+        self.assertEqual(pool.stats()['single']['depth'], 1)
+
+        pool.start()
+        pool.lane('single').queue.join()
+        stats = pool.stats()['single']
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['processed'], 1)
+        self.assertGreaterEqual(stats['wait_max'], 2)
+
+
+class TestFairQueue(unittest.TestCase):
+
+    def test_takes_turns_between_clients(self):
+        clients = {}
+        q = FairQueue(key=clients.get)
+        for i in range(5):
+            clients[f'a{i}'] = 'a'
+            q.put(f'a{i}')
+        clients['b0'] = 'b'
+        q.put('b0')
+
+        self.assertEqual(q.qsize(), 6)
+        self.assertEqual(q.count('a'), 5)
+        self.assertEqual([q.get() for _ in range(3)], ['a0', 'b0', 'a1'])
+        self.assertEqual(q.count('b'), 0)
+        for _ in range(3):
+            q.get()
+            q.task_done()
+        self.assertTrue(q.empty())
+
+
+class TestRunBounded(unittest.TestCase):
+
+    def test_limits_concurrency_and_keeps_order(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fn(item):
+            with lock:
+                active.append(item)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(item)
+            if item == 3:
+                raise ValueError(item)
+            return item * 10
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = run_bounded(executor, fn, range(6), limit=2)
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(results[:3], [0, 10, 20])
+        self.assertIsInstance(results[3], ValueError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import functools
+import threading
+import unittest
+
+from ydl_pool import SharedSession, YoutubeDLPool, sharing
+
+
+class FakeYoutubeDL:
+
+    def __init__(self, params):
+        self.params = params
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+    @functools.cached_property
+    def cookiejar(self):
+        return object()
+
+    @functools.cached_property
+    def _request_director(self):
+        return (object(), self.cookiejar)
+
+
+class TestYoutubeDLPool(unittest.TestCase):
+
+    def test_reuses_idle_instance_per_profile(self):
+        pool = YoutubeDLPool(FakeYoutubeDL)
+        with pool.instance('info', {'a': 1}) as first:
+            pass
+        with pool.instance('info', {'a': 1}) as second:
+            self.assertIs(second, first)
+            with pool.instance('info', {'a': 1}) as third:
+                self.assertIsNot(third, first)
+        with pool.instance('flat', {'b': 1}) as flat:
+            self.assertEqual(flat.params, {'b': 1})
+        self.assertEqual(pool.stats(), {'idle': {'info': 2, 'flat': 1}, 'created': 3, 'reused': 1})
+        self.assertFalse(first.closed)
+
+    def test_closes_instances_beyond_max_idle(self):
+        pool = YoutubeDLPool(FakeYoutubeDL, max_idle=1)
+        with pool.instance('info', {}) as first, pool.instance('info', {}) as second:
+            pass
+        self.assertEqual([first.closed, second.closed], [True, False])
+        pool.clear()
+        self.assertTrue(second.closed)
+
+    def test_instance_survives_errors(self):
+        pool = YoutubeDLPool(FakeYoutubeDL)
+        with self.assertRaises(ValueError), pool.instance('info', {}) as ydl:
+            raise ValueError
+        with pool.instance('info', {}) as again:
+            self.assertIs(again, ydl)
+
+
+class TestSharedSession(unittest.TestCase):
+
+    def test_instances_share_cookies_and_connections(self):
+        session = SharedSession()
+        ydl_class = sharing(FakeYoutubeDL, session)
+        first, second = ydl_class({}), ydl_class({})
+        self.assertIs(first.cookiejar, second.cookiejar)
+        self.assertIs(first._request_director, second._request_director)
+
+        first.close()
+        self.assertIs(second._request_director, session.director)
+
+    def test_concurrent_first_use_builds_once(self):
+        session = SharedSession()
+        built = []
+        barrier = threading.Barrier(4)
+
+        def use():
+            barrier.wait()
+            session.get('cookiejar', lambda: built.append(1) or object())
+
+        threads = [threading.Thread(target=use) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(built, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
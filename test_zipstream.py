@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+import io
+import os
+import tempfile
+import threading
+import zipfile
+
+import zipstream
+from zipstream import ZipStream
+
+
+class TestZipStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = {}
+        for name, size in (('001 - a.mp4', 3000), ('002 - b é.mp3', 10), ('003 - empty.txt', 0)):
+            path = os.path.join(self.tmpdir.name, name)
+            data = os.urandom(size)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.files[path] = data
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def build(self):
+        archive = ZipStream(chunk_size=1024)
+        for path in self.files:
+            archive.add(path)
+        archive.close()
+        return archive
+
+    def assertValidArchive(self, archive):
+        data = b''.join(archive)
+        self.assertEqual(len(data), archive.content_length())
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            for path, content in self.files.items():
+                info = zf.getinfo(os.path.basename(path))
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zf.read(info), content)
+        return data
+
+    def test_stored_archive_matches_content_length(self):
+        self.assertValidArchive(self.build())
+
+    def test_zip64_records(self):
+        with patch.object(zipstream, 'ZIP64_THRESHOLD', 100), patch.object(zipstream, 'ZIP64_COUNT_THRESHOLD', 2):
+            data = self.assertValidArchive(self.build())
+        self.assertIn(b'PK\x06\x06', data)
+
+    def test_content_length_unknown_until_closed(self):
+        archive = ZipStream()
+        archive.add(next(iter(self.files)))
+        self.assertIsNone(archive.content_length())
+
+    def test_streams_entries_as_they_are_added(self):
+        archive = ZipStream(chunk_size=1024)
+        paths = list(self.files)
+        archive.add(paths[0])
+        reader = iter(archive)
+        first = next(reader)
+        self.assertTrue(first.startswith(b'PK\x03\x04'))
+
+        chunks = [first]
+        thread = threading.Thread(target=lambda: chunks.extend(reader))
+        thread.start()
+        for path in paths[1:]:
+            archive.add(path)
+        archive.close()
+        thread.join(2)
+
+        self.assertEqual(len(b''.join(chunks)), archive.content_length())
+        self.assertValidArchive(archive)
+
+    def test_async_readers_wait_without_a_thread(self):
+        archive = ZipStream(chunk_size=1024)
+        paths = list(self.files)
+
+        async def read():
+            entries = []
+            while (entry := await archive.next_entry_async(len(entries))) is not None:
+                entries.append(entry)
+            return b''.join(b''.join(archive.entry_blocks(e)) for e in entries) + b''.join(archive.central_directory())
+
+        def fill():
+            for path in paths:
+                archive.add(path)
+            archive.close()
+
+        async def main():
+            reader = asyncio.ensure_future(read())
+            await asyncio.sleep(0.05)
+            self.assertFalse(reader.done())
+            threading.Thread(target=fill).start()
+            return await asyncio.wait_for(reader, 2)
+
+        data = asyncio.run(main())
+        self.assertEqual(len(data), archive.content_length())
+        self.assertEqual(data, b''.join(archive))
+
+if __name__ == '__main__':
+    unittest.main()
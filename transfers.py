@@ -0,0 +1,101 @@
+import io
+import threading
+import time
+
+
+class TransferLedger:
+    """Remembers which byte ranges of each served result reached a client.
+
+    A result counts as delivered once its ranges cover the whole file,
+    whether in one response or across several resumed ones. Results that
+    are never fully delivered expire `retention` seconds after they were
+    last requested.
+    """
+
+    def __init__(self, retention, clock=time.monotonic):
+        self.retention = retention
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._ranges = {}  # key -> merged [start, stop) ranges, sorted
+        self._deadlines = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ranges)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._ranges
+
+    def touch(self, key):
+        """Starts or extends the retention window of `key`."""
+        with self._lock:
+            self._ranges.setdefault(key, [])
+            self._deadlines[key] = self.clock() + self.retention
+
+    def record(self, key, start, stop, size):
+        """Marks bytes [start, stop) of `key` as delivered; True once all `size` bytes are.
+
+        Returns True only once per key, so concurrent transfers of the same
+        result clean it up exactly once.
+        """
+        with self._lock:
+            ranges = self._ranges.get(key)
+            if ranges is None:
+                return False
+            ranges = _merge(ranges + [(start, stop)])
+            if ranges[0][0] <= 0 and ranges[0][1] >= size:
+                self._forget(key)
+                return True
+            self._ranges[key] = ranges
+            return False
+
+    def expired(self):
+        """Removes and returns the keys whose retention window has passed."""
+        now = self.clock()
+        with self._lock:
+            keys = [key for key, deadline in self._deadlines.items() if deadline <= now]
+            for key in keys:
+                self._forget(key)
+        return keys
+
+    def forget(self, key):
+        with self._lock:
+            self._forget(key)
+
+    def _forget(self, key):
+        self._ranges.pop(key, None)
+        self._deadlines.pop(key, None)
+
+
+def _merge(ranges):
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+class DeliveryFile(io.FileIO):
+    """Read-only file that reports the byte range it served when closed.
+
+    `span` is the (start, stop) range the response promised; set it once
+    the Range header has been processed. On close, `on_delivered(start,
+    stop)` is called if the reader got as far as `stop`. Being a real file,
+    it can still be handed to the server's `wsgi.file_wrapper`.
+    """
+
+    def __init__(self, path, on_delivered):
+        super().__init__(path, 'rb')
+        self.on_delivered = on_delivered
+        self.span = None
+
+    def close(self):
+        if self.closed:
+            return
+        position = self.tell()
+        super().close()
+        if self.span is not None and position >= self.span[1]:
+            self.on_delivered(*self.span)
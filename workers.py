@@ -0,0 +1,168 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_count(cpu_count=None, network_slots=None):
+    """Sizes a lane from the CPU count, capped by the network slot budget."""
+    cpu = cpu_count or os.cpu_count() or 1
+    if network_slots is None:
+        network_slots = int(os.environ.get('YTD_NETWORK_SLOTS', 8))
+    return max(1, min(cpu * 2, network_slots))
+
+
+class FairQueue(queue.Queue):
+    """queue.Queue that takes turns between groups of items instead of serving strict FIFO.
+
+    Items are grouped by `key(item)`, e.g. the client that submitted them.
+    `get` serves the groups round-robin and each group in FIFO order, so one
+    client's burst of tasks cannot starve another client's single task.
+    """
+
+    def __init__(self, key, maxsize=0):
+        self.key = key
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._groups = {}  # key -> deque of items
+        self._turns = deque()  # keys with queued items, in serving order
+        self._size = 0
+
+    def _qsize(self):
+        return self._size
+
+    def _put(self, item):
+        key = self.key(item)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = deque()
+            self._turns.append(key)
+        group.append(item)
+        self._size += 1
+
+    def _get(self):
+        key = self._turns.popleft()
+        group = self._groups[key]
+        item = group.popleft()
+        if group:
+            self._turns.append(key)
+        else:
+            del self._groups[key]
+        self._size -= 1
+        return item
+
+    def count(self, key):
+        """Number of queued items in group `key`."""
+        with self.mutex:
+            return len(self._groups.get(key, ()))
+
+
+class Lane:
+    """A named queue of task ids drained by its own set of worker threads."""
+
+    def __init__(self, name, workers, task_queue=None):
+        self.name = name
+        self.workers = workers
+        self.queue = task_queue if task_queue is not None else queue.Queue()
+        self.active = 0
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_start(self, waited):
+        with self._lock:
+            self.active += 1
+            self.processed += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def record_done(self):
+        with self._lock:
+            self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'depth': self.queue.qsize(),
+                'active': self.active,
+                'processed': self.processed,
+                'wait_avg': self.wait_total / self.processed if self.processed else 0.0,
+                'wait_max': self.wait_max,
+            }
+
+
+class WorkerPool:
+    """Runs `handler(task_id)` for queued tasks on a fixed set of threads per lane.
+
+    `lanes` maps a lane name to its worker count; `enqueued_at` returns the
+    time a task was queued so wait time can be reported per lane. Each lane
+    drains a queue.Queue unless `queue_factory(lane_name)` supplies another
+    object with the same put/get/task_done/qsize interface.
+    """
+
+    def __init__(self, handler, lanes, enqueued_at=None, queue_factory=None):
+        self.handler = handler
+        self.enqueued_at = enqueued_at
+        self.lanes = {
+            name: Lane(name, count, queue_factory(name) if queue_factory else None)
+            for name, count in lanes.items()
+        }
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def lane(self, name):
+        return self.lanes[name]
+
+    def submit(self, task_id, lane):
+        self.lanes[lane].queue.put(task_id)
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            for lane in self.lanes.values():
+                for i in range(lane.workers):
+                    threading.Thread(
+                        target=self._run, args=(lane,),
+                        name=f'worker-{lane.name}-{i}', daemon=True,
+                    ).start()
+
+    def _run(self, lane):
+        while True:
+            task_id = lane.queue.get()
+            queued = self.enqueued_at(task_id) if self.enqueued_at else None
+            lane.record_start(time.time() - queued if queued else 0.0)
+            try:
+                self.handler(task_id)
+            except Exception:
+                logger.exception('Unhandled error in %s worker for task %s', lane.name, task_id)
+            finally:
+                lane.record_done()
+                lane.queue.task_done()
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+def run_bounded(executor, fn, items, limit):
+    """Runs `fn(item)` for every item on `executor`, at most `limit` at a time.
+
+    Returns the results in input order; an item whose call raised yields the
+    exception instead of a result.
+    """
+    slots = threading.BoundedSemaphore(max(1, limit))
+    futures = []
+    for item in items:
+        slots.acquire()
+        future = executor.submit(fn, item)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    return [f.exception() or f.result() for f in futures]
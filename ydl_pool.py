@@ -0,0 +1,117 @@
+import contextlib
+import functools
+import threading
+
+
+class SharedSession:
+    """One cookie jar and one set of HTTP request handlers for every YoutubeDL.
+
+    The cookie file is parsed once instead of by every instance, and the
+    request handlers, which hold the keep-alive connection pools (with the
+    `requests` package installed), are reused across instances. `close`
+    saves the cookies and closes the connections; call it at exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()  # Building the handlers loads the cookie jar
+        self.cookiejar = None
+        self.director = None
+
+    def get(self, name, build):
+        with self._lock:
+            if getattr(self, name) is None:
+                setattr(self, name, build())
+            return getattr(self, name)
+
+    def close(self):
+        with self._lock:
+            if self.cookiejar is not None and self.cookiejar.filename:
+                self.cookiejar.save()
+            if self.director is not None:
+                self.director.close()
+                self.director = None
+
+
+def sharing(ydl_class, session):
+    """Returns a subclass of `ydl_class` whose instances all use `session`'s cookie jar and connections.
+
+    Only valid while every instance has the same network options (cookie
+    file, headers, proxies), as the shared handlers are built from the first.
+    """
+
+    class SharedSessionYoutubeDL(ydl_class):
+
+        @functools.cached_property
+        def cookiejar(self):
+            return session.get('cookiejar', lambda: ydl_class.cookiejar.func(self))
+
+        @functools.cached_property
+        def _request_director(self):
+            return session.get('director', lambda: ydl_class._request_director.func(self))
+
+        def save_cookies(self):
+            pass  # Saved once by session.close()
+
+        def close(self):
+            self.__dict__.pop('_request_director', None)  # Shared; closed by session.close()
+            super().close()
+
+    return SharedSessionYoutubeDL
+
+
+class YoutubeDLPool:
+    """Idle YoutubeDL instances per option profile, reused instead of built for every call.
+
+    `instance(profile, params)` lends an instance built by `factory(params)`
+    for the duration of a with block; all calls for one profile must pass
+    the same params. Instances are entered when built and only exited when
+    the pool drops them, so their extractors and caches carry over from one
+    call to the next. Each instance serves one caller at a time; at most
+    `max_idle` per profile are kept between calls.
+    """
+
+    def __init__(self, factory, max_idle=4):
+        self.factory = factory
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # profile -> [(context manager, instance)]
+        self.created = 0
+        self.reused = 0
+
+    @contextlib.contextmanager
+    def instance(self, profile, params):
+        with self._lock:
+            idle = self._idle.get(profile)
+            entry = idle.pop() if idle else None
+            if entry is not None:
+                self.reused += 1
+        if entry is None:
+            manager = self.factory(params)
+            entry = (manager, manager.__enter__())
+            with self._lock:
+                self.created += 1
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(profile, [])
+                keep = len(idle) < self.max_idle
+                if keep:
+                    idle.append(entry)
+            if not keep:
+                entry[0].__exit__(None, None, None)
+
+    def clear(self):
+        with self._lock:
+            entries = [entry for idle in self._idle.values() for entry in idle]
+            self._idle.clear()
+        for manager, _ in entries:
+            manager.__exit__(None, None, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': {profile: len(idle) for profile, idle in self._idle.items()},
+                'created': self.created,
+                'reused': self.reused,
+            }
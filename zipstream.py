@@ -0,0 +1,229 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+import zlib
+
+CHUNK_SIZE = 1024 * 1024
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+# Sizes, offsets and entry counts from these on need ZIP64 records
+ZIP64_THRESHOLD = ZIP32_LIMIT
+ZIP64_COUNT_THRESHOLD = ZIP32_COUNT_LIMIT
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+DATA_DESCRIPTOR = struct.Struct('<IIII')
+DATA_DESCRIPTOR64 = struct.Struct('<IIQQ')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+END_LOCATOR64 = struct.Struct('<IIQI')
+ZIP64_LOCAL_EXTRA = struct.Struct('<HHQQ')
+ZIP64_CENTRAL_EXTRA = struct.Struct('<HHQQQ')
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class _Entry:
+
+    def __init__(self, path, arcname, offset):
+        self.path = path
+        self.name = arcname.encode('utf-8')
+        self.size = os.path.getsize(path)
+        self.mtime = os.path.getmtime(path)
+        self.offset = offset
+        self.zip64 = self.size >= ZIP64_THRESHOLD or offset >= ZIP64_THRESHOLD
+        self.crc = None
+
+    def local_length(self):
+        extra = ZIP64_LOCAL_EXTRA.size if self.zip64 else 0
+        descriptor = DATA_DESCRIPTOR64.size if self.zip64 else DATA_DESCRIPTOR.size
+        return LOCAL_HEADER.size + len(self.name) + extra + self.size + descriptor
+
+    def central_length(self):
+        extra = ZIP64_CENTRAL_EXTRA.size if self.zip64 else 0
+        return CENTRAL_HEADER.size + len(self.name) + extra
+
+
+class ZipStream:
+    """Builds an uncompressed (stored) ZIP archive on the fly from files on disk.
+
+    Files are added with `add` as they become available and `close` marks the
+    archive complete. Any number of readers may iterate the archive; each one
+    yields entries as soon as they are added and blocks until more arrive or
+    the archive is closed. Sizes are fixed when a file is added, so once the
+    archive is closed `content_length` is known before a byte is sent.
+    Entries and archives past the 4 GiB / 65535 entry limits use ZIP64.
+
+    Async readers wait for entries with `next_entry_async` instead, which
+    holds no thread, and build the archive from `entry_blocks` and
+    `central_directory`.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._entries = []
+        self._offset = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._watchers = set()  # (loop, future) of async readers waiting for an entry
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, path, arcname=None):
+        with self._cond:
+            if self._closed:
+                raise ValueError('archive is closed')
+            entry = _Entry(path, arcname or os.path.basename(path), self._offset)
+            self._offset += entry.local_length()
+            self._entries.append(entry)
+            self._cond.notify_all()
+            self._wake_watchers()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._wake_watchers()
+
+    def _wake_watchers(self):
+        for loop, future in self._watchers:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # Its event loop is closed
+
+    def content_length(self):
+        """Total archive size in bytes, or None while entries can still be added."""
+        with self._cond:
+            if not self._closed:
+                return None
+            central_size = sum(e.central_length() for e in self._entries)
+            return self._offset + central_size + self._end_length(central_size)
+
+    def _end_length(self, central_size):
+        length = END_RECORD.size
+        if self._needs_zip64_end(central_size):
+            length += END_RECORD64.size + END_LOCATOR64.size
+        return length
+
+    def _needs_zip64_end(self, central_size):
+        return (len(self._entries) >= ZIP64_COUNT_THRESHOLD
+                or self._offset >= ZIP64_THRESHOLD
+                or central_size >= ZIP64_THRESHOLD)
+
+    def _next_entry(self, index):
+        with self._cond:
+            while index >= len(self._entries) and not self._closed:
+                self._cond.wait()
+            if index < len(self._entries):
+                return self._entries[index]
+            return None
+
+    async def next_entry_async(self, index):
+        """Awaits entry `index`; returns None once the archive is closed without it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            watcher = (loop, loop.create_future())
+            with self._cond:
+                if index < len(self._entries):
+                    return self._entries[index]
+                if self._closed:
+                    return None
+                self._watchers.add(watcher)
+            try:
+                await watcher[1]
+            finally:
+                with self._cond:
+                    self._watchers.discard(watcher)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            entry = self._next_entry(index)
+            if entry is None:
+                break
+            yield from self.entry_blocks(entry)
+            index += 1
+        yield from self.central_directory()
+
+    def entry_blocks(self, entry):
+        mod_time, mod_date = dos_datetime(entry.mtime)
+        flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        version = 45 if entry.zip64 else 20
+        extra = ZIP64_LOCAL_EXTRA.pack(0x0001, 16, 0, 0) if entry.zip64 else b''
+        placeholder = ZIP32_LIMIT if entry.zip64 else 0
+        yield LOCAL_HEADER.pack(
+            0x04034b50, version, flags, 0, mod_time, mod_date,
+            0, placeholder, placeholder, len(entry.name), len(extra),
+        ) + entry.name + extra
+
+        crc = 0
+        remaining = entry.size
+        with open(entry.path, 'rb') as f:
+            while remaining:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f'{entry.path} shrank while being archived')
+                crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        entry.crc = crc
+
+        descriptor = DATA_DESCRIPTOR64 if entry.zip64 else DATA_DESCRIPTOR
+        yield descriptor.pack(0x08074b50, crc, entry.size, entry.size)
+
+    def central_directory(self):
+        central_size = 0
+        for entry in self._entries:
+            header = self._central_header(entry)
+            central_size += len(header)
+            yield header
+
+        count = len(self._entries)
+        if self._needs_zip64_end(central_size):
+            end64_offset = self._offset + central_size
+            yield END_RECORD64.pack(
+                0x06064b50, END_RECORD64.size - 12, 45, 45, 0, 0,
+                count, count, central_size, self._offset,
+            )
+            yield END_LOCATOR64.pack(0x07064b50, 0, end64_offset, 1)
+            yield END_RECORD.pack(
+                0x06054b50, 0, 0, ZIP32_COUNT_LIMIT, ZIP32_COUNT_LIMIT, ZIP32_LIMIT, ZIP32_LIMIT, 0,
+            )
+        else:
+            yield END_RECORD.pack(0x06054b50, 0, 0, count, count, central_size, self._offset, 0)
+
+    def _central_header(self, entry):
+        mod_time, mod_date = dos_datetime(entry.mtime)
+        version = 45 if entry.zip64 else 20
+        if entry.zip64:
+            extra = ZIP64_CENTRAL_EXTRA.pack(0x0001, 24, entry.size, entry.size, entry.offset)
+            size = offset = ZIP32_LIMIT
+        else:
+            extra = b''
+            size, offset = entry.size, entry.offset
+        return CENTRAL_HEADER.pack(
+            0x02014b50, (3 << 8) | version, version, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, 0,
+            mod_time, mod_date, entry.crc, size, size,
+            len(entry.name), len(extra), 0, 0, 0, 0o100644 << 16, offset,
+        ) + entry.name + extra
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)